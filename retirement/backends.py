@@ -0,0 +1,213 @@
+import time
+import itertools
+import numpy as np
+
+from history_cache import SPAN_SECONDS, HistoryCache
+
+
+class MarketBackend:
+    # Where market data comes from and where orders go. rh_wrapper talks to whichever backend is
+    # active (see rh_wrapper.set_backend), so the Manager live loop runs unchanged against the real
+    # brokerage or a local replay.
+    cacheable = True  # whether history from this backend belongs in the local HistoryCache
+    order_poll_interval = 0.5  # longest wait between status checks of an open order, see orders.py
+
+    def login(self, fresh=False):
+        pass
+
+    def now(self):
+        # Current time on this backend's clock, in epoch seconds
+        return time.time()
+
+    def get_price(self, ticker):
+        raise Exception("not implemented")
+
+    def get_prices(self, tickers):
+        # {ticker: price}. Backends that can fetch several quotes in one call override this.
+        return {ticker: self.get_price(ticker) for ticker in tickers}
+
+    def get_history(self, ticker, interval, span):
+        # List of {'price': str, 'time': ISO string} dicts, like rh_wrapper.get_crypto_history
+        times, prices = self.get_history_arrays(ticker, interval, span)
+        return [{'price': repr(price), 'time': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time_at_price))}
+                for time_at_price, price in zip(times.tolist(), prices.tolist())]
+
+    def get_history_arrays(self, ticker, interval, span):
+        raise Exception("not implemented")
+
+    def execute_trade(self, ticker, amount_in_dollars):
+        raise Exception("not implemented")
+
+    # Order API for orders.OrderRouter. side is ledger.BUY_SIDE (of amount dollars) or SELL_SIDE
+    # (of shares). order_status returns {'state': 'open', 'filled', 'cancelled' or 'rejected',
+    # 'shares': filled so far, 'amount': dollars filled so far}.
+    def submit_order(self, ticker, side, amount=None, shares=None):
+        raise Exception("not implemented")
+
+    def order_status(self, order_id):
+        raise Exception("not implemented")
+
+    def cancel_order(self, order_id):
+        raise Exception("not implemented")
+
+    def exhausted(self):
+        # True once a finite data source has nothing left to serve
+        return False
+
+
+class ReplayBackend(MarketBackend):
+    # Serves recorded bars as a live quote stream. The first `warmup_bars` of each ticker are handed
+    # out as history; the rest are replayed after start().
+    #
+    # speed is how much faster than real time the replay clock runs (1.0, 100.0, ...). With
+    # speed=None the replay goes as fast as it's asked: every get_price call moves that ticker on to
+    # its next bar and the clock follows the newest bar served.
+    #
+    # Orders fill at the replayed price fill_latency seconds after they're placed, counted on the
+    # replay clock, so a faster replay fills faster too.
+    cacheable = False
+
+    def __init__(self, histories, speed=1.0, fill_latency=0.0, warmup_bars=0):
+        self.histories = {}
+        for ticker, (times, prices) in histories.items():
+            self.histories[ticker] = (np.asarray(times, dtype=np.float64), np.asarray(prices, dtype=np.float64))
+        self.speed = speed
+        self.fill_latency = fill_latency
+        self.warmup_bars = warmup_bars
+        self.cursors = {ticker: warmup_bars for ticker in self.histories}
+        self.fills = []
+        self.orders = {}  # order id -> order and its fill, see submit_order
+        self.order_ids = itertools.count()
+        self.num_quotes = 0
+
+        self.replay_start = min(times[min(warmup_bars, len(times) - 1)] for times, _ in self.histories.values())
+        self.replay_end = max(times[-1] for times, _ in self.histories.values())
+        self.clock = self.replay_start
+        self.wall_start = None
+
+    @classmethod
+    def from_cache(cls, tickers, interval='hour', cache=None, **kwargs):
+        # Replay whatever is in the local history cache
+        if cache is None:
+            cache = HistoryCache()
+        histories = {}
+        for ticker in tickers:
+            times, prices = cache.load(ticker, interval)
+            if len(times) == 0:
+                raise Exception("nothing cached for " + ticker + " at interval " + interval)
+            histories[ticker] = (np.array(times), np.array(prices))
+        return cls(histories, **kwargs)
+
+    @property
+    def order_poll_interval(self):
+        # Fills come due on the replay clock, and at full speed any wait is bars of the replay going by
+        return 0.0 if self.speed is None else MarketBackend.order_poll_interval / self.speed
+
+    def login(self, fresh=False):
+        print("Replaying ", len(self.histories), " tickers at ",
+              "full speed" if self.speed is None else str(self.speed) + "x")
+        self.start()
+
+    def start(self):
+        self.wall_start = time.perf_counter()
+
+    def now(self):
+        if self.speed is None or self.wall_start is None:
+            return self.clock
+        return self.replay_start + (time.perf_counter() - self.wall_start) * self.speed
+
+    def get_price(self, ticker):
+        times, prices = self.histories[ticker]
+        self.num_quotes += 1
+        if self.speed is None:
+            cursor = min(self.cursors[ticker], len(times) - 1)
+            self.cursors[ticker] = cursor + 1
+            self.clock = max(self.clock, times[cursor])
+            return prices[cursor]
+        return self.current_price(ticker)
+
+    def current_price(self, ticker):
+        # Price on the replay clock, without counting as a quote or moving the replay along
+        times, prices = self.histories[ticker]
+        if self.speed is None:
+            return prices[max(min(self.cursors[ticker], len(times)) - 1, 0)]
+        index = int(np.searchsorted(times, self.now(), side='right')) - 1
+        return prices[max(index, 0)]
+
+    def get_history_arrays(self, ticker, interval, span):
+        # Recorded bars before the replay starts, limited to the span. The interval is whatever was recorded.
+        times, prices = self.histories[ticker]
+        stop = self.warmup_bars
+        start = int(np.searchsorted(times[:stop], self.replay_start - SPAN_SECONDS[span], side='left'))
+        return times[start:stop], prices[start:stop]
+
+    def price_at(self, ticker, time_of_price):
+        # Replayed price at a time on the replay clock, the current one for anything up to now
+        if time_of_price <= self.now():
+            return self.current_price(ticker)
+        times, prices = self.histories[ticker]
+        index = int(np.searchsorted(times, time_of_price, side='right')) - 1
+        return prices[max(index, 0)]
+
+    def execute_trade(self, ticker, amount_in_dollars):
+        # Fills straight away at the price fill_latency from now, so the latency costs what it would
+        # without holding up the decision
+        time_of_fill = self.now() + self.fill_latency
+        price = float(self.price_at(ticker, time_of_fill))
+        fill = {
+            'ticker': ticker,
+            'amount': amount_in_dollars,
+            'price': price,
+            'shares': amount_in_dollars / price,
+            'time': time_of_fill,
+        }
+        self.fills.append(fill)
+        return fill
+
+    def submit_order(self, ticker, side, amount=None, shares=None):
+        # Acked straight away. The whole order fills once fill_latency has gone by on the replay
+        # clock, or when the replay runs out, at the price then (see order_status).
+        order_id = next(self.order_ids)
+        self.orders[order_id] = {'ticker': ticker, 'side': side, 'amount': amount, 'shares': shares,
+                                 'due': self.now() + self.fill_latency, 'state': 'open', 'fill': None}
+        if self.fill_latency <= 0:
+            self.fill_order(self.orders[order_id])
+        return order_id
+
+    def fill_order(self, order):
+        time_of_fill = min(order['due'], self.now())
+        price = float(self.price_at(order['ticker'], time_of_fill))
+        amount, shares = order['amount'], order['shares']
+        if amount is None:
+            amount = shares * price
+        else:
+            shares = amount / price
+        fill = {
+            'ticker': order['ticker'],
+            'side': order['side'],
+            'amount': amount,
+            'price': price,
+            'shares': shares,
+            'time': time_of_fill,
+        }
+        self.fills.append(fill)
+        order['fill'] = fill
+        order['state'] = 'filled'
+
+    def order_status(self, order_id):
+        order = self.orders[order_id]
+        if order['state'] == 'open' and (self.now() >= order['due'] or self.exhausted()):
+            self.fill_order(order)
+        if order['fill'] is None:
+            return {'state': order['state'], 'shares': 0.0, 'amount': 0.0}
+        return {'state': order['state'], 'shares': order['fill']['shares'], 'amount': order['fill']['amount']}
+
+    def cancel_order(self, order_id):
+        order = self.orders[order_id]
+        if order['state'] == 'open':
+            order['state'] = 'cancelled'
+
+    def exhausted(self):
+        if self.speed is None:
+            return any(self.cursors[ticker] >= len(times) for ticker, (times, _) in self.histories.items())
+        return self.now() > self.replay_end
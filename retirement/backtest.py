@@ -0,0 +1,171 @@
+import time
+
+# Taken before anything else is imported, so the reported startup time includes the imports
+STARTED = time.perf_counter()
+
+import sys
+import json
+import argparse
+import numpy as np
+import quant
+import pipeline
+import parallel_runner
+
+from retirement import Manager
+from history_cache import HistoryCache
+
+IMPORTED = time.perf_counter()
+
+
+# Headless backtests and sweeps for batch jobs: no display, no brokerage login, and neither
+# matplotlib nor robin_stocks is imported unless a chart image is asked for. Settings come from a
+# JSON config file and/or the command line, which wins:
+#
+#   python backtest.py DOGE BTC --interval hour --days 90 --image 'summary_{ticker}.png'
+#   python backtest.py --config backtest.json
+#
+# with backtest.json something like
+#   {
+#     "tickers": ["DOGE"],
+#     "interval": "hour",
+#     "engines": [{"engine": "IthDerivBasedQuantEngine", "deriv_dim": 4, "buy_threshold": 0.01}],
+#     "sweep": {"deriv_dims": [2, 4], "buy_thresholds": [-0.01, 0.0, 0.01], "keep": 5},
+#     "files": {"DOGE": "doge.csv"}
+#   }
+#
+# History comes from the local HistoryCache unless there's a file for the ticker: .npy with rows
+# (times, prices) like the parallel runners write, or .csv with one time,price line per bar and no
+# header. Leaving out "engines" gets the Manager's own; "sweep": false turns the sweep off.
+
+DEFAULTS = {
+    'tickers': ['DOGE'],
+    'interval': 'hour',
+    'days': None,
+    'engines': None,
+    'sweep': {},
+    'files': {},
+    'top_k': 10,
+    'image': None,
+    'chunk_size': pipeline.DEFAULT_CHUNK_SIZE,
+}
+
+
+def parse_engine(spec):
+    # 'IthDerivBasedQuantEngine:deriv_dim=4,buy_threshold=0.01' -> the config file's form. Values
+    # are JSON, so null rather than None.
+    name, _, args = spec.partition(':')
+    config = {'engine': name}
+    for arg in args.split(','):
+        if arg:
+            key, _, value = arg.partition('=')
+            config[key] = json.loads(value)
+    return config
+
+
+def build_engines(configs):
+    if configs is None:
+        return None
+    engines = []
+    for config in configs:
+        kwargs = dict(config)
+        name = kwargs.pop('engine')
+        if not isinstance(getattr(quant, name, None), type) or not issubclass(getattr(quant, name), quant.QuantEngine):
+            raise Exception("unknown engine: " + name)
+        engines.append(parallel_runner.build_engine(parallel_runner.engine_config(name, **kwargs)))
+    return engines
+
+
+def configure_sweep(manager, sweep):
+    # Anything the config leaves out keeps the Manager's default grid
+    if sweep is False:
+        manager.num_swept_engines = 0
+        return
+    manager.num_swept_engines = sweep.get('keep', manager.num_swept_engines)
+    manager.sweep_deriv_dims = sweep.get('deriv_dims', manager.sweep_deriv_dims)
+    manager.sweep_buy_thresholds = sweep.get('buy_thresholds', manager.sweep_buy_thresholds)
+    manager.sweep_sell_thresholds = sweep.get('sell_thresholds', manager.sweep_sell_thresholds)
+    manager.sweep_emer_escape_thresholds = sweep.get('emer_escape_thresholds', manager.sweep_emer_escape_thresholds)
+
+
+def load_history(ticker, settings, cache):
+    # (times, prices) for the ticker. Cached and .npy histories stay memory-mapped and get read a
+    # chunk at a time by the Manager.
+    path = settings['files'].get(ticker)
+    if path is None:
+        since = None if settings['days'] is None else time.time() - settings['days'] * 86400
+        return cache.load(ticker, settings['interval'], since)
+    if path.endswith('.npy'):
+        history = np.load(path, mmap_mode='r')
+        return history[0], history[1]
+    history = np.loadtxt(path, delimiter=',', ndmin=2)
+    return history[:, 0], history[:, 1]
+
+
+def image_path(settings, ticker):
+    if settings['image'] is None:
+        return None
+    return settings['image'].replace('{ticker}', ticker)
+
+
+def run(settings):
+    cache = HistoryCache()
+    print("Ready in %.3f s (imports %.3f s)" % (time.perf_counter() - STARTED, IMPORTED - STARTED))
+    num_run = 0
+    for ticker in settings['tickers']:
+        times, prices = load_history(ticker, settings, cache)
+        if len(times) == 0:
+            print("No history for ", ticker, " at interval ", settings['interval'])
+            continue
+
+        start = time.perf_counter()
+        manager = Manager(ticker, plotting=False, engines=build_engines(settings['engines']))
+        configure_sweep(manager, settings['sweep'])
+        manager.stream_history(pipeline.array_source(times, prices, settings['chunk_size']))
+        manager.close(top_k=settings['top_k'], image_path=image_path(settings, ticker))
+        print("Backtested ", ticker, " (", len(times), " bars, ", len(manager.engines), " engines) in %.3f s"
+              % (time.perf_counter() - start))
+        num_run += 1
+    return num_run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless backtests and sweeps over stored history')
+    parser.add_argument('tickers', nargs='*')
+    parser.add_argument('--config', help='JSON file of settings, see backtest.py')
+    parser.add_argument('--interval')
+    parser.add_argument('--days', type=float, help='only the newest this many days of history')
+    parser.add_argument('--file', help='history file for the (single) ticker instead of the cache')
+    parser.add_argument('--engine', action='append', dest='engines', metavar='NAME[:KEY=VALUE,...]',
+                        help='an engine to run, may be repeated. Defaults to the Manager\'s own.')
+    parser.add_argument('--no-sweep', action='store_true')
+    parser.add_argument('--sweep-keep', type=int, help='how many of the best swept engines to run')
+    parser.add_argument('--top-k', type=int)
+    parser.add_argument('--image', help='save the summary chart here, {ticker} is replaced by the ticker')
+    parser.add_argument('--chunk-size', type=int)
+    args = parser.parse_args(argv)
+
+    settings = dict(DEFAULTS)
+    if args.config is not None:
+        with open(args.config) as config_file:
+            settings.update(json.load(config_file))
+    for key in ('interval', 'days', 'top_k', 'image', 'chunk_size'):
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+    if args.tickers:
+        settings['tickers'] = args.tickers
+    if args.engines:
+        settings['engines'] = [parse_engine(spec) for spec in args.engines]
+    if args.file is not None:
+        if len(settings['tickers']) != 1:
+            raise Exception("--file needs exactly one ticker")
+        settings['files'] = {settings['tickers'][0]: args.file}
+    if args.no_sweep:
+        settings['sweep'] = False
+    elif args.sweep_keep is not None:
+        settings['sweep'] = dict(settings['sweep'] or {}, keep=args.sweep_keep)
+
+    return 0 if run(settings) > 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+import os
+import sys
+import gc
+import io
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import contextlib
+import numpy as np
+import quant
+import journal
+
+
+# Benchmarks for the quant engines on synthetic prices. Nothing here touches the network or the
+# brokerage; the Manager case only needs the modules importable.
+#
+#   python benchmark.py --sizes 1000 100000 --output results.json
+#   python benchmark.py --save-baseline                 (record this machine's numbers)
+#   python benchmark.py --max-slowdown 0.2              (exit 1 if >20% slower than the baseline)
+#   python benchmark.py --no-baseline                   (just measure, no regression check)
+#
+# Without a baseline to compare against the check fails (exit 2) rather than quietly passing.
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+REGIMES = ('random_walk', 'trending', 'mean_reverting')
+BAR_SECONDS = {'15second': 15, '5minute': 300, 'hour': 3600, 'day': 86400}
+
+quiet_journal = journal.Journal(verbosity=journal.OFF)
+retirement = None  # see load_retirement
+
+
+def synthetic_prices(num_bars, regime='random_walk', bar_seconds=15, seed=0, start_price=0.2):
+    # Seeded synthetic history, returned as (times, prices). Volatility is scaled to the bar spacing
+    # so a day of 15 second bars moves about as much as a day of hourly ones.
+    rng = np.random.default_rng(seed)
+    sigma = 0.8 * np.sqrt(bar_seconds / (365.0 * 86400))  # ~80% a year, about right for crypto
+    shocks = rng.normal(0.0, sigma, num_bars)
+
+    if regime == 'random_walk':
+        log_prices = np.cumsum(shocks)
+    elif regime == 'trending':
+        drift = 1.5 * bar_seconds / (365.0 * 86400)
+        log_prices = np.cumsum(shocks + drift)
+    elif regime == 'mean_reverting':
+        # Ornstein-Uhlenbeck on log price with a half life of about a day
+        theta = np.log(2) * bar_seconds / 86400.0
+        log_prices = np.zeros(num_bars)
+        level = 0.0
+        for i, shock in enumerate(shocks.tolist()):
+            level += -theta * level + shock
+            log_prices[i] = level
+    else:
+        raise Exception("unknown regime: " + regime)
+
+    times = 1.6e9 + bar_seconds * np.arange(num_bars, dtype=np.float64)
+    return times, start_price * np.exp(log_prices)
+
+
+def make_engine(kind):
+    if kind == 'ith_deriv':
+        engine = quant.IthDerivBasedQuantEngine(deriv_dim=4, buy_threshold=0.0001, sell_threshold=-0.0001)
+    elif kind == 'time_based':
+        engine = quant.TimeBasedQuantEngine()
+    elif kind == 'baseline':
+        engine = quant.BaselineQuantEngine()
+    else:
+        raise Exception("unknown engine: " + kind)
+    engine.journal = quiet_journal
+    return engine
+
+
+def run_ticks(kind, times, prices):
+    # The live path: one update_model + decision per bar
+    engine = make_engine(kind)
+    for price, time_of_price in zip(prices.tolist(), times.tolist()):
+        engine.update_model(price, time_of_price)
+        if engine.should_buy():
+            engine.buy()
+        elif engine.should_sell():
+            engine.sell()
+
+
+def run_backtest(kind, times, prices):
+    make_engine(kind).backtest(prices, times)
+
+
+def load_retirement():
+    # The Manager case's imports, done before its timer starts. Not at the top so the engine cases
+    # don't pay for matplotlib, and Agg first so nothing opens a display.
+    global retirement
+    import matplotlib
+    matplotlib.use('Agg')
+    import retirement
+
+
+def run_manager(times, prices):
+    # Full Manager replay (engines, sweep, buffers) without a display or a login
+    manager = retirement.Manager()
+    manager.plotting = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        manager.set_arrays(prices, times)
+
+
+CASES = {
+    'ith_deriv_tick': lambda times, prices: run_ticks('ith_deriv', times, prices),
+    'time_based_tick': lambda times, prices: run_ticks('time_based', times, prices),
+    'baseline_tick': lambda times, prices: run_ticks('baseline', times, prices),
+    'ith_deriv_backtest': lambda times, prices: run_backtest('ith_deriv', times, prices),
+    'time_based_backtest': lambda times, prices: run_backtest('time_based', times, prices),
+    'baseline_backtest': lambda times, prices: run_backtest('baseline', times, prices),
+    'manager_replay': run_manager,
+}
+
+# Run once before a case is timed
+SETUP = {
+    'manager_replay': load_retirement,
+}
+
+
+def measure(case, times, prices, repeat=1, track_memory=True):
+    # Best wall time over `repeat` runs, then one more run under tracemalloc for peak memory (kept
+    # separate so tracing overhead doesn't skew the timing)
+    run = CASES[case]
+    if case in SETUP:
+        SETUP[case]()
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        run(times, prices)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    result = {
+        'bars': len(prices),
+        'seconds': best,
+        'ticks_per_second': len(prices) / best if best > 0 else float('inf'),
+    }
+    if track_memory:
+        gc.collect()
+        tracemalloc.start()
+        run(times, prices)
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def run_suite(cases, sizes, regimes, bars, repeat=1, track_memory=True, seed=0):
+    results = {}
+    for regime in regimes:
+        for bar in bars:
+            for size in sizes:
+                times, prices = synthetic_prices(size, regime, BAR_SECONDS[bar], seed)
+                for case in cases:
+                    key = '/'.join([case, regime, bar, str(size)])
+                    results[key] = measure(case, times, prices, repeat, track_memory)
+                    print(key, " %.0f ticks/s" % results[key]['ticks_per_second'],
+                          " peak %.1f MB" % (results[key].get('peak_memory_bytes', 0) / 1e6))
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'seed': seed,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, max_slowdown=0.25, max_memory_growth=0.25):
+    # Regressions against a stored baseline, as a list of human readable strings. Only cases present
+    # in both are compared.
+    regressions = []
+    for key, result in report['results'].items():
+        if key not in baseline['results']:
+            continue
+        base = baseline['results'][key]
+        if result['ticks_per_second'] < base['ticks_per_second'] * (1 - max_slowdown):
+            regressions.append("%s: %.0f ticks/s vs %.0f baseline" % (key, result['ticks_per_second'],
+                                                                     base['ticks_per_second']))
+        if 'peak_memory_bytes' in result and 'peak_memory_bytes' in base:
+            if result['peak_memory_bytes'] > base['peak_memory_bytes'] * (1 + max_memory_growth):
+                regressions.append("%s: peak %d bytes vs %d baseline" % (key, result['peak_memory_bytes'],
+                                                                        base['peak_memory_bytes']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Throughput and memory benchmarks for the quant engines')
+    parser.add_argument('--cases', nargs='+', default=sorted(CASES), choices=sorted(CASES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000],
+                        help='history lengths in bars, e.g. 1000 up to 10000000')
+    parser.add_argument('--regimes', nargs='+', default=['random_walk'], choices=REGIMES)
+    parser.add_argument('--bars', nargs='+', default=['15second'], choices=sorted(BAR_SECONDS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc peak memory runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON here')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--no-baseline', action='store_true', help="measure only, don't compare against a baseline")
+    parser.add_argument('--max-slowdown', type=float, default=0.25,
+                        help='fail when ticks/s drops by more than this fraction of the baseline')
+    parser.add_argument('--max-memory-growth', type=float, default=0.25,
+                        help='fail when peak memory grows by more than this fraction of the baseline')
+    args = parser.parse_args(argv)
+
+    # Checked up front, so a missing baseline doesn't cost a whole run first
+    checking = not args.save_baseline and not args.no_baseline
+    if checking and not os.path.exists(args.baseline):
+        print("No baseline at ", args.baseline, ", run with --save-baseline to create one or --no-baseline to skip the check")
+        return 2
+
+    report = run_suite(args.cases, args.sizes, args.regimes, args.bars, args.repeat, not args.no_memory, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2, sort_keys=True)
+        print("Saved baseline to ", args.baseline)
+        return 0
+    if not checking:
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(report, baseline, args.max_slowdown, args.max_memory_growth)
+    for regression in regressions:
+        print("REGRESSION: ", regression)
+    if regressions:
+        return 1
+    print("No regressions against ", args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import numpy as np
+import quant
+
+from ledger import COLUMNS
+
+
+# Snapshots of a Manager and its engines for warm restarts (see Manager.checkpoint_state and
+# Manager.from_checkpoint). One .npz file per ticker: a JSON 'meta' entry with every engine's scalar
+# state, plus the arrays (live buffer, price summary, each engine's ledger columns). Files are
+# written to a temp file and renamed into place, so a crash mid-write leaves the previous snapshot.
+
+VERSION = 1
+
+
+def checkpoint_path(directory, ticker):
+    return os.path.join(directory, ticker + '.npz')
+
+
+def write_checkpoint(path, meta, arrays):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    meta = dict(meta, version=VERSION, saved_at=time.time())
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as out_file:
+        np.savez(out_file, meta=np.array(json.dumps(meta)), **arrays)
+        out_file.flush()
+        os.fsync(out_file.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path):
+    # Returns (meta, arrays), or None if there's no usable checkpoint at path
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        if meta.get('version') != VERSION:
+            print("Ignoring checkpoint ", path, " from version ", meta.get('version'))
+            return None
+        arrays = {name: data[name] for name in data.files if name != 'meta'}
+    return meta, arrays
+
+
+def engine_state(engine, index, arrays):
+    # The engine's meta entry. Its ledger columns go into arrays.
+    state = engine.checkpoint_state()
+    state['class'] = type(engine).__name__
+    for name in COLUMNS:
+        arrays['engine' + str(index) + '_' + name] = engine.ledger.column(name).copy()
+    return state
+
+
+def restore_engine(state, index, arrays):
+    engine = getattr(quant, state['class'])()
+    engine.restore_checkpoint_state(state)
+    engine.ledger.extend(**{name: arrays['engine' + str(index) + '_' + name] for name in COLUMNS})
+    return engine
+
+
+class PeriodicCheckpoint:
+    # Snapshots every manager every `interval` seconds from the live event loop, and once more on
+    # stop. The state is copied on the loop's thread and written out on another one, so the live
+    # loop only waits for the copy.
+    def __init__(self, managers, directory, interval=300.0):
+        self.managers = managers
+        self.directory = directory
+        self.interval = interval
+        self.running = False
+        self.num_saves = 0
+
+    def snapshot(self):
+        return [(checkpoint_path(self.directory, manager.ticker),) + manager.checkpoint_state()
+                for manager in self.managers]
+
+    @staticmethod
+    def write(snapshots):
+        for path, meta, arrays in snapshots:
+            write_checkpoint(path, meta, arrays)
+
+    def save(self):
+        self.write(self.snapshot())
+        self.num_saves += 1
+
+    def stop(self):
+        self.running = False
+
+    async def run(self):
+        import asyncio  # only the live loop needs it, see metrics.PeriodicExporter.run
+        self.running = True
+        loop = asyncio.get_event_loop()
+        last_save = time.perf_counter()
+        while self.running:
+            # Wake up often enough to notice stop() without waiting out a whole interval
+            await asyncio.sleep(min(self.interval, 0.5))
+            if time.perf_counter() - last_save >= self.interval:
+                await loop.run_in_executor(None, self.write, self.snapshot())
+                self.num_saves += 1
+                last_save = time.perf_counter()
+        self.save()
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+# Shrinking long series down to about as many points as the chart has pixels, keeping their shape.
+# Both return (x, y) subsets of the original points, in order, always including the endpoints.
+
+
+def lttb(x, y, num_points):
+    # Largest-Triangle-Three-Buckets: one point per bucket, picked to make the largest triangle
+    # with the point picked from the previous bucket and the average of the next one. Keeps peaks
+    # and troughs that plain striding would skip over.
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    num_samples = len(x)
+    if num_points >= num_samples or num_points < 3:
+        return x, y
+
+    # num_points - 2 buckets between the first and last points
+    edges = np.linspace(1, num_samples - 1, num_points - 1).astype(np.int64)
+    sum_x = np.concatenate([[0.0], np.cumsum(x)])
+    sum_y = np.concatenate([[0.0], np.cumsum(y)])
+    counts = edges[1:] - edges[:-1]
+    average_x = (sum_x[edges[1:]] - sum_x[edges[:-1]]) / counts
+    average_y = (sum_y[edges[1:]] - sum_y[edges[:-1]]) / counts
+    # The last bucket looks ahead to the final point
+    average_x = np.append(average_x[1:], x[-1])
+    average_y = np.append(average_y[1:], y[-1])
+
+    indices = np.empty(num_points, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = num_samples - 1
+    previous = 0
+    for bucket in range(num_points - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        previous_x, previous_y = x[previous], y[previous]
+        areas = np.abs((previous_x - average_x[bucket]) * (y[start:stop] - previous_y)
+                       - (previous_x - x[start:stop]) * (average_y[bucket] - previous_y))
+        previous = start + int(np.argmax(areas))
+        indices[bucket + 1] = previous
+    return x[indices], y[indices]
+
+
+def min_max(x, y, num_buckets):
+    # The lowest and highest point of each bucket, fully vectorized. Cheaper than lttb and never
+    # clips an extreme, at the cost of up to two points per bucket.
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    num_samples = len(x)
+    if 2 * num_buckets >= num_samples or num_buckets < 1:
+        return x, y
+
+    edges = np.linspace(0, num_samples, num_buckets + 1).astype(np.int64)
+    counts = np.diff(edges)
+    buckets = np.repeat(np.arange(num_buckets), counts)
+    picked = [[0, num_samples - 1]]
+    for extreme in (np.minimum, np.maximum):
+        # First point in each bucket that hits the bucket's extreme
+        hits = np.flatnonzero(y == np.repeat(extreme.reduceat(y, edges[:-1]), counts))
+        _, first_hit = np.unique(buckets[hits], return_index=True)
+        picked.append(hits[first_hit])
+    indices = np.unique(np.concatenate(picked))
+    return x[indices], y[indices]
+
+
+METHODS = {'lttb': lttb, 'min_max': min_max}
+
+
+def downsample(x, y, num_points, method='lttb'):
+    # num_points is roughly the chart width in pixels. min_max gets half as many buckets since it
+    # keeps two points per bucket.
+    if method == 'min_max':
+        return min_max(x, y, num_points // 2)
+    if method not in METHODS:
+        raise Exception("unknown downsampling method: " + method)
+    return METHODS[method](x, y, num_points)
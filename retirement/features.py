@@ -0,0 +1,113 @@
+import collections
+import market_calendar
+
+
+class FeatureStore:
+    # Per-tick features shared by every engine reading the same buffer. Engines subscribe to the
+    # features they need and each one is computed at most once per tick, however many engines read
+    # it. Feature keys:
+    #   ('diff', n)         latest nth order difference of price (np.diff(prices, n)[-1])
+    #   ('time_deriv', 1)   latest time-normalized 1st derivative, dp/dt
+    #   ('window', name)    whether the latest sample is in a SessionCalendar window
+    #
+    # All difference orders come off one rolling chain sized for the highest order anyone asked for.
+    # Features subscribed with history > 1 also keep their last `history` values; older values are
+    # evicted as new ticks come in.
+    #
+    # Over a multi-instrument buffer the price features are arrays with one value per instrument,
+    # computed for all of them in the same few vectorized steps. Windows only depend on the time.
+    def __init__(self, buffer, calendar=None):
+        self.buffer = buffer
+        self.calendar = calendar or market_calendar.local_calendar()
+        self.subscriptions = {}  # key -> how many recent values to keep
+        self.histories = {}
+        self.cache = {}
+        self.num_computed = 0
+
+        self.max_order = 0
+        self.diff_state = []
+        self.latest_top_diff = None
+        self.num_diffed = 0
+
+    def subscribe(self, key, history=1):
+        history = max(history, self.subscriptions.get(key, 1))
+        self.subscriptions[key] = history
+        if history > 1:
+            old_values = self.histories.get(key, [])
+            self.histories[key] = collections.deque(old_values, maxlen=history)
+
+        if key[0] == 'diff' and key[1] > self.max_order:
+            # Rebuild the chain from the buffer; the nth difference only needs the last n + 1 prices
+            self.max_order = key[1]
+            self.diff_state = []
+            self.latest_top_diff = None
+            self.num_diffed = 0
+            prices = self.buffer.latest_prices(self.max_order + 1)
+            for index in range(prices.shape[-1]):
+                self.advance_diffs(self.as_value(prices[..., index]))
+        self.cache = {}
+        return key
+
+    def advance_diffs(self, price):
+        value = price
+        for order in range(len(self.diff_state)):
+            prev_value = self.diff_state[order]
+            self.diff_state[order] = value
+            value = value - prev_value
+
+        if len(self.diff_state) < self.max_order:
+            self.diff_state.append(value)
+        else:
+            self.latest_top_diff = value
+        self.num_diffed += 1
+
+    def update(self):
+        # Call once per tick, after the newest sample went into the buffer
+        self.cache = {}
+        if self.max_order > 0:
+            self.advance_diffs(self.latest_price())
+
+        for key, history in self.histories.items():
+            history.append(self.latest(key))
+
+    def latest(self, key):
+        if key in self.cache:
+            return self.cache[key]
+
+        value = self.compute(key)
+        self.cache[key] = value
+        self.num_computed += 1
+        return value
+
+    def recent(self, key):
+        # Up to `history` most recent values, oldest first
+        return list(self.histories.get(key, [self.latest(key)]))
+
+    def compute(self, key):
+        kind = key[0]
+        if kind == 'diff':
+            order = key[1]
+            if order == 0:
+                return self.latest_price() if len(self.buffer) else None
+            if self.num_diffed <= order:
+                return None
+            return self.latest_top_diff if order == self.max_order else self.diff_state[order]
+        if kind == 'time_deriv':
+            if len(self.buffer) < 2:
+                return None
+            prices = self.buffer.latest_prices(2)
+            times = self.buffer.latest_times(2)
+            return self.as_value((prices[..., 1] - prices[..., 0]) / (times[1] - times[0]))
+        if kind == 'window':
+            if len(self.buffer) == 0:
+                return False
+            return self.calendar.in_window(key[1], float(self.buffer.latest_times(1)[0]))
+        raise Exception("unknown feature: " + str(key))
+
+    def latest_price(self):
+        return self.as_value(self.buffer.latest_prices(1)[..., 0])
+
+    @staticmethod
+    def as_value(values):
+        # Plain floats for a single instrument, which keeps the per-tick scalar math cheap
+        return float(values) if values.ndim == 0 else values.copy()
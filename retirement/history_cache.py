@@ -0,0 +1,120 @@
+import os
+import time
+import numpy as np
+
+from os.path import expanduser
+
+
+# How far back each robinhood span reaches, in seconds
+SPAN_SECONDS = {
+    'hour': 3600,
+    'day': 86400,
+    'week': 7 * 86400,
+    'month': 31 * 86400,
+    '3month': 92 * 86400,
+    'year': 366 * 86400,
+    '5year': 5 * 366 * 86400,
+}
+
+INTERVAL_SECONDS = {
+    '15second': 15,
+    '5minute': 300,
+    '10minute': 600,
+    'hour': 3600,
+    'day': 86400,
+    'week': 7 * 86400,
+}
+
+
+def smallest_span_covering(seconds, max_span):
+    # Smallest span that reaches back at least `seconds`, but never beyond what the caller asked for
+    for span in sorted(SPAN_SECONDS, key=SPAN_SECONDS.get):
+        if SPAN_SECONDS[span] >= seconds or span == max_span:
+            return span
+    return max_span
+
+
+def history_to_arrays(history, time_key='time', price_key='price'):
+    # Turn get_crypto_history's list of dicts into float64 arrays of epoch times and prices in one
+    # vectorized step. Timestamps look like 2021-05-01T00:00:00Z: keeping only the first 19 characters
+    # drops the Z so numpy parses them as plain UTC datetimes.
+    if len(history) == 0:
+        return np.zeros(0), np.zeros(0)
+
+    time_strings = np.array([entry.get(time_key) for entry in history], dtype='U19')
+    price_strings = np.array([entry.get(price_key) for entry in history])
+    times = time_strings.astype('datetime64[s]').astype(np.int64).astype(np.float64)
+    prices = price_strings.astype(np.float64)
+    return times, prices
+
+
+class HistoryCache:
+    # Historical bars kept on disk as one .npy file per (ticker, interval). Each file is a 2 x n float64
+    # array: row 0 is epoch times, row 1 prices, sorted by time. Files are memory-mapped on load so
+    # years of bars open instantly, and only bars newer than the last cached one ever get added.
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(expanduser("~"), '.retirement', 'history')
+        self.cache_dir = cache_dir
+
+    def path(self, ticker, interval):
+        return os.path.join(self.cache_dir, ticker + '_' + interval + '.npy')
+
+    def load(self, ticker, interval, since=None):
+        # Returns (times, prices) views into the memory-mapped file, optionally only bars at or after `since`
+        path = self.path(ticker, interval)
+        if not os.path.exists(path):
+            return np.zeros(0), np.zeros(0)
+
+        history = np.load(path, mmap_mode='r')
+        start = 0
+        if since is not None:
+            start = int(np.searchsorted(history[0], since, side='left'))
+        return history[0][start:], history[1][start:]
+
+    def last_time(self, ticker, interval):
+        times, _ = self.load(ticker, interval)
+        if len(times) == 0:
+            return None
+        return float(times[-1])
+
+    def append(self, ticker, interval, times, prices):
+        # Adds the bars newer than the last cached one. Returns how many were new.
+        times = np.asarray(times, dtype=np.float64)
+        prices = np.asarray(prices, dtype=np.float64)
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        prices = prices[order]
+
+        cached_times, cached_prices = self.load(ticker, interval)
+        if len(cached_times) > 0:
+            newer = times > cached_times[-1]
+            times = times[newer]
+            prices = prices[newer]
+        if len(times) == 0:
+            return 0
+
+        history = np.vstack([np.concatenate([cached_times, times]),
+                             np.concatenate([cached_prices, prices])])
+
+        # Write to a temp file and swap it in so a crash never leaves a half written cache behind
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(ticker, interval)
+        tmp_path = path + '.tmp.npy'
+        np.save(tmp_path, history)
+        os.replace(tmp_path, path)
+        return len(times)
+
+    def fetch_span(self, ticker, interval, span, now=None):
+        # Which span to request so that everything after the last cached bar gets covered. None if
+        # the cache is already up to date.
+        if now is None:
+            now = time.time()
+        last_time = self.last_time(ticker, interval)
+        if last_time is None:
+            return span
+
+        gap = now - last_time
+        if gap < INTERVAL_SECONDS.get(interval, 0):
+            return None
+        return smallest_span_covering(gap + INTERVAL_SECONDS.get(interval, 0), span)
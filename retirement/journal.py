@@ -0,0 +1,180 @@
+import os
+import queue
+import threading
+import numpy as np
+
+
+# Verbosity levels. Each level records everything the ones below it do.
+OFF = 0
+TRADES = 1  # buys and sells
+DECISIONS = 2  # plus wanted-but-blocked trades, emergency escapes and other decisions worth knowing
+
+# Record kinds
+BUY = 1
+SELL = 2
+DECISION = 3
+ERROR = 4
+
+# Decision / error codes. A wanted trade can_trade held back is recorded under the limit that held it.
+BUY_TOO_SOON = 1
+SELL_TOO_SOON = 2
+EMERGENCY_SALE = 3
+MARKET_OPEN_SALE = 4
+ALREADY_INVESTED = 5
+NOT_INVESTED = 6
+NO_PURCHASE_PRICE = 7
+ORDER_PENDING = 8
+BUY_TOO_FEW_SAMPLES = 9
+SELL_TOO_FEW_SAMPLES = 10
+
+# The message echoed for each code
+MESSAGES = {
+    0: "",
+    BUY_TOO_SOON: "Want to buy, but not enough time since the last trade",
+    SELL_TOO_SOON: "Want to sell, but not enough time since the last trade",
+    EMERGENCY_SALE: "Initiating sale for emergency escape",
+    MARKET_OPEN_SALE: "Initiating sale for market open",
+    ALREADY_INVESTED: "ERROR: trying to buy when you already bought",
+    NOT_INVESTED: "ERROR: trying to sell when you ain't got none",
+    NO_PURCHASE_PRICE: "ERROR: last purchase price not initialized",
+    ORDER_PENDING: "Want to trade, but still waiting on the last order",
+    BUY_TOO_FEW_SAMPLES: "Want to buy, but not enough samples to trade yet",
+    SELL_TOO_FEW_SAMPLES: "Want to sell, but not enough samples to trade yet",
+}
+
+JOURNAL_DTYPE = np.dtype([
+    ('kind', np.uint8),
+    ('code', np.uint8),
+    ('engine', np.int32),
+    ('time', np.float64),
+    ('price', np.float64),
+    ('shares', np.float64),
+    ('amount', np.float64),
+])
+
+shared_journals = {}
+
+
+def default_journal():
+    # What engines write to unless told otherwise: their trades, in memory only and without printing.
+    # Live runs echo to the console through their own journal, see Manager.start_live_journal.
+    if 'default' not in shared_journals:
+        shared_journals['default'] = Journal(verbosity=TRADES)
+    return shared_journals['default']
+
+
+def read_journal(path):
+    # Returns (records, engine names indexed by the records' engine column)
+    records = np.fromfile(path, dtype=JOURNAL_DTYPE) if os.path.exists(path) else np.zeros(0, JOURNAL_DTYPE)
+    names = []
+    if os.path.exists(path + '.engines'):
+        with open(path + '.engines') as engines_file:
+            names = [line.rstrip('\n') for line in engines_file]
+    return records, names
+
+
+class Journal:
+    # Typed trade and decision records collected in a preallocated NumPy buffer. Full buffers are
+    # handed to a background thread that appends them to `path` as raw JOURNAL_DTYPE records (read
+    # them back with read_journal), so recording never waits on disk. Engine names go to a sidecar
+    # file, one per line, in engine id order.
+    #
+    # Without a path, records stay in memory only and the buffer starts over whenever it fills up.
+    # With verbosity OFF nothing is recorded at all, which is what backtests want.
+    def __init__(self, path=None, verbosity=TRADES, capacity=4096, echo=False):
+        self.path = path
+        self.verbosity = verbosity
+        self.capacity = capacity
+        self.echo = echo
+        self.buffer = np.zeros(capacity, dtype=JOURNAL_DTYPE)
+        self.num_buffered = 0
+        self.num_recorded = 0
+        self.engine_ids = {}
+        self.engine_names = []
+
+        self.pending = None
+        self.writer = None
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Appending to an existing journal: keep its engine ids
+            for name in read_journal(path)[1]:
+                self.engine_ids[name] = len(self.engine_names)
+                self.engine_names.append(name)
+            self.pending = queue.Queue()
+            self.writer = threading.Thread(target=self.write_pending, daemon=True)
+            self.writer.start()
+
+    def engine_id(self, name):
+        if name not in self.engine_ids:
+            self.engine_ids[name] = len(self.engine_names)
+            self.engine_names.append(name)
+            if self.pending is not None:
+                self.pending.put(('engine', name))
+        return self.engine_ids[name]
+
+    def trade(self, name, kind, time_of_trade, price, shares, amount):
+        if self.verbosity < TRADES:
+            return
+        self.record(kind, 0, name, time_of_trade, price, shares, amount)
+
+    def decision(self, name, code, time_of_decision=0.0, price=0.0):
+        if self.verbosity < DECISIONS:
+            return
+        kind = ERROR if ALREADY_INVESTED <= code <= NO_PURCHASE_PRICE else DECISION
+        self.record(kind, code, name, time_of_decision, price, 0.0, 0.0)
+
+    def record(self, kind, code, name, time_of_record, price, shares, amount):
+        self.buffer[self.num_buffered] = (kind, code, self.engine_id(name), time_of_record, price, shares, amount)
+        if self.echo:
+            print(self.describe(self.buffer[self.num_buffered]))
+        self.num_buffered += 1
+        self.num_recorded += 1
+
+        if self.num_buffered == self.capacity:
+            if self.pending is None:
+                self.num_buffered = 0
+            else:
+                self.flush()
+
+    def describe(self, row):
+        if row['kind'] == BUY:
+            return "Buying  " + str(row['shares']) + "  shares at  " + str(row['price']) + "  for $ " + str(row['amount'])
+        if row['kind'] == SELL:
+            return "Sold  " + str(row['shares']) + "  shares at  " + str(row['price']) + "  for $ " + str(row['amount'])
+        return MESSAGES[int(row['code'])] + " (" + self.engine_names[row['engine']] + ")"
+
+    def records(self):
+        # Records still held in memory, oldest first
+        return self.buffer[:self.num_buffered].copy()
+
+    def flush(self):
+        # Hand what's buffered to the writer and carry on with a fresh buffer
+        if self.pending is None or self.num_buffered == 0:
+            return
+        self.pending.put(('records', self.buffer[:self.num_buffered]))
+        self.buffer = np.zeros(self.capacity, dtype=JOURNAL_DTYPE)
+        self.num_buffered = 0
+
+    def close(self):
+        if self.writer is None:
+            return
+        self.flush()
+        self.pending.put(None)
+        self.writer.join()
+        self.writer = None
+
+    def write_pending(self):
+        with open(self.path, 'ab') as records_file, open(self.path + '.engines', 'a') as engines_file:
+            while True:
+                item = self.pending.get()
+                if item is None:
+                    return
+                kind, payload = item
+                if kind == 'engine':
+                    engines_file.write(payload + '\n')
+                    engines_file.flush()
+                else:
+                    payload.tofile(records_file)
+                    records_file.flush()
@@ -0,0 +1,128 @@
+import numpy as np
+
+
+BUY_SIDE = 1
+SELL_SIDE = -1
+
+COLUMNS = ('time', 'price', 'shares', 'side', 'amount', 'cash')
+
+
+class TradeLedger:
+    # One engine's trades as growable NumPy columns:
+    #   time    when the trade happened
+    #   price   share price traded at
+    #   shares  shares bought or sold
+    #   side    BUY_SIDE or SELL_SIDE
+    #   amount  dollars spent or received, i.e. what EventPoint.price has always held
+    #   cash    funds available after the trade
+    # Columns double in size when full, so appending is amortized O(1) and every statistic below
+    # is a vectorized pass over the filled part.
+    column_names = COLUMNS
+
+    def __init__(self, capacity=16):
+        self.size = 0
+        self.columns = {name: np.zeros(capacity, dtype=np.float64) for name in self.column_names}
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, size):
+        capacity = max(len(self.columns['time']), 1)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in self.column_names:
+            grown = np.zeros(capacity, dtype=np.float64)
+            grown[:self.size] = self.columns[name][:self.size]
+            self.columns[name] = grown
+
+    def append(self, time_of_trade, price, shares, side, amount, cash):
+        self.reserve(self.size + 1)
+
+        index = self.size
+        self.columns['time'][index] = time_of_trade
+        self.columns['price'][index] = price
+        self.columns['shares'][index] = shares
+        self.columns['side'][index] = side
+        self.columns['amount'][index] = amount
+        self.columns['cash'][index] = cash
+        self.size += 1
+
+    def extend(self, **columns):
+        # A batch of trades at once, one array (or scalar for all of them) per column name
+        num_trades = max(np.size(values) for values in columns.values())
+        self.reserve(self.size + num_trades)
+        for name, values in columns.items():
+            self.columns[name][self.size:self.size + num_trades] = values
+        self.size += num_trades
+
+    def column(self, name):
+        return self.columns[name][:self.size]
+
+    def times(self):
+        return self.column('time')
+
+    def values(self):
+        # Dollar value at each trade: everything we had going in on a buy, everything we got out on a sale
+        return self.column('amount')
+
+    def is_sale(self):
+        return self.column('side') == SELL_SIDE
+
+    def equity(self):
+        # Cash plus the position marked at the trade's price, right after each trade. The position is
+        # rebuilt from the trades, so this assumes the engine started out holding nothing.
+        held = np.cumsum(self.column('side') * self.column('shares'))
+        return self.column('cash') + held * self.column('price')
+
+    def equity_curve(self):
+        return self.times(), self.equity()
+
+    def final_value(self):
+        return self.values()[-1] if self.size else np.nan
+
+    def total_return(self):
+        # Fractional change from the first trade's value to the last
+        if self.size == 0:
+            return np.nan
+        values = self.values()
+        return (values[-1] - values[0]) / values[0]
+
+    def max_drawdown(self):
+        # Largest fractional drop from a running peak of the equity curve
+        if self.size == 0:
+            return 0.0
+        equity = self.equity()
+        return float(np.max(1 - equity / np.maximum.accumulate(equity)))
+
+    def num_trades(self):
+        return self.size
+
+    def legs(self):
+        # (side, amount) per leg: a run of trades on the same side, like an order filled in parts
+        side = self.column('side')
+        starts = np.flatnonzero(np.concatenate([[True], side[1:] != side[:-1]]))
+        return side[starts], np.add.reduceat(self.values(), starts)
+
+    def win_rate(self):
+        # Fraction of round trips (a buying leg followed by its selling leg) that got out with more
+        # than went in
+        if self.size == 0:
+            return np.nan
+        sides, amounts = self.legs()
+        sales = np.flatnonzero(sides == SELL_SIDE)
+        sales = sales[sales > 0]
+        if len(sales) == 0:
+            return np.nan
+        return float(np.mean(amounts[sales] > amounts[sales - 1]))
+
+
+def rank(ledgers, min_trades=2):
+    # Indices of the ledgers with at least min_trades trades, best final value first. The final values
+    # are gathered once and ranked with a single argsort.
+    sizes = np.array([len(ledger) for ledger in ledgers], dtype=np.int64)
+    final_values = np.array([ledger.final_value() for ledger in ledgers], dtype=np.float64)
+    eligible = np.flatnonzero(sizes >= min_trades)
+    order = np.argsort(-final_values[eligible], kind='stable')
+    return eligible[order]
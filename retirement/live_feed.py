@@ -0,0 +1,241 @@
+import time
+import asyncio
+
+
+class BlockingQuoteSource:
+    # Wraps a blocking get_price(ticker) call (e.g. rh_wrapper.get_crypto_price) so several tickers
+    # can be fetched at once on the event loop's thread pool
+    def __init__(self, get_price):
+        self.get_price = get_price
+
+    async def fetch(self, ticker):
+        loop = asyncio.get_event_loop()
+        return float(await loop.run_in_executor(None, self.get_price, ticker))
+
+
+class BatchedQuoteSource:
+    # Wraps a blocking get_prices(tickers) call (e.g. rh_wrapper.get_crypto_prices). Every fetch
+    # started in the same pass of the event loop - which is how LiveFeed polls its tickers each
+    # interval - goes out together as one get_prices call, so N tickers cost one request, not N.
+    def __init__(self, get_prices):
+        self.get_prices = get_prices
+        self.pending = {}  # ticker -> futures waiting on the next batch
+        self.num_batches = 0
+
+    async def fetch(self, ticker):
+        loop = asyncio.get_event_loop()
+        if not self.pending:
+            loop.call_soon(self.flush)
+        future = loop.create_future()
+        self.pending.setdefault(ticker, []).append(future)
+        return await future
+
+    def flush(self):
+        batch = self.pending
+        self.pending = {}
+        self.num_batches += 1
+        loop = asyncio.get_event_loop()
+        request = loop.run_in_executor(None, self.get_prices, list(batch))
+        request.add_done_callback(lambda done: self.resolve(batch, done))
+
+    @staticmethod
+    def resolve(batch, done):
+        error = done.exception()
+        prices = None if error is not None else done.result()
+        for ticker, futures in batch.items():
+            for future in futures:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                elif prices.get(ticker) is None:
+                    future.set_exception(Exception("no quote for " + ticker))
+                else:
+                    future.set_result(float(prices[ticker]))
+
+
+class FakeQuoteSource:
+    # Local stand-in for the brokerage. Serves prices from per-ticker lists (or a callable of ticker
+    # and call count) after a configurable delay, so the feed can be exercised without logging in.
+    def __init__(self, prices, latency=0.0):
+        self.prices = prices
+        self.latency = latency
+        self.num_calls = {}
+
+    async def fetch(self, ticker):
+        call = self.num_calls.get(ticker, 0)
+        self.num_calls[ticker] = call + 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if callable(self.prices):
+            return float(self.prices(ticker, call))
+        ticker_prices = self.prices[ticker]
+        return float(ticker_prices[min(call, len(ticker_prices) - 1)])
+
+
+class TickerStats:
+    def __init__(self):
+        self.polls = 0
+        self.samples = 0
+        self.dropped = 0  # samples pushed out of a full queue before anyone read them
+        self.skipped_polls = 0  # ticks where the previous quote for this ticker was still in flight
+        self.errors = 0
+        self.callback_errors = 0  # samples a subscriber raised on
+        self.last_latency = None
+
+
+class LiveFeed:
+    # Polls every ticker concurrently on a fixed cadence. Ticks are scheduled against the start time
+    # (start + n * interval) rather than sleeping a fixed amount after each poll, so quote latency
+    # never accumulates into drift. Each quote is stamped when it arrives and queued for its ticker;
+    # a consumer per ticker hands the samples to whoever subscribed to that ticker.
+    #
+    # Queues are bounded. When consumers fall behind, the oldest sample is dropped to make room for
+    # the new one and counted in the ticker's stats.
+    #
+    # An interval of 0 polls again as soon as the event loop comes back around. clock stamps the
+    # samples, so a replayed market can hand out its own time. With a metrics registry, quote
+    # latency and how late each tick starts (loop lag) go into histograms.
+    def __init__(self, source, tickers, interval=1.0, queue_size=100, clock=time.time, metrics=None):
+        self.source = source
+        self.clock = clock
+        self.metrics = metrics
+        self.lag_histogram = None
+        if metrics is not None:
+            self.lag_histogram = metrics.histogram('live_loop_lag_seconds')
+            metrics.add_collector(self.collect_metrics)
+        self.tickers = list(tickers)
+        self.interval = interval
+        self.queue_size = queue_size
+        self.subscribers = {ticker: [] for ticker in self.tickers}
+        self.stats = {ticker: TickerStats() for ticker in self.tickers}
+        self.queues = {}
+        self.in_flight = {}
+        self.missed_ticks = 0
+        self.num_ticks = 0
+        self.running = False
+
+    def subscribe(self, ticker, callback):
+        # callback(price, time_of_price) gets every sample for the ticker, in order
+        self.subscribers[ticker].append(callback)
+
+    def stop(self):
+        self.running = False
+
+    def backlog(self):
+        # Samples queued up that no subscriber has seen yet
+        return sum(queue.qsize() for queue in self.queues.values())
+
+    async def run(self, max_ticks=None):
+        self.running = True
+        self.queues = {ticker: asyncio.Queue(maxsize=self.queue_size) for ticker in self.tickers}
+        consumers = [asyncio.ensure_future(self.consume(ticker)) for ticker in self.tickers]
+
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        tick = 0
+        try:
+            while self.running and (max_ticks is None or self.num_ticks < max_ticks):
+                if self.lag_histogram is not None and self.interval > 0:
+                    self.lag_histogram.observe(max(loop.time() - (start + tick * self.interval), 0.0))
+                for ticker in self.tickers:
+                    self.poll(ticker)
+                self.num_ticks += 1
+
+                if self.interval <= 0:
+                    await asyncio.sleep(0)
+                    continue
+
+                # Sleep until the next slot on the fixed grid. If we're already past it, skip the
+                # missed slots instead of firing a burst of catch-up polls.
+                tick += 1
+                next_tick_time = start + tick * self.interval
+                now = loop.time()
+                if now > next_tick_time:
+                    behind = int((now - next_tick_time) // self.interval) + 1
+                    self.missed_ticks += behind
+                    tick += behind
+                    next_tick_time = start + tick * self.interval
+                await asyncio.sleep(next_tick_time - now)
+        finally:
+            self.running = False
+            pending = [task for task in self.in_flight.values() if not task.done()]
+            if pending:
+                await asyncio.wait(pending)
+            # The end marker waits for room behind whatever is still queued, so nothing is pushed out
+            # on the way down. Consumers outlive failing callbacks (see consume), so the queues
+            # always drain.
+            await asyncio.gather(*[queue.put(None) for queue in self.queues.values()])
+            await asyncio.gather(*consumers)
+
+    def poll(self, ticker):
+        previous = self.in_flight.get(ticker)
+        if previous is not None and not previous.done():
+            self.stats[ticker].skipped_polls += 1
+            return
+        self.in_flight[ticker] = asyncio.ensure_future(self.fetch(ticker))
+
+    async def fetch(self, ticker):
+        stats = self.stats[ticker]
+        stats.polls += 1
+        requested_at = time.perf_counter()
+        try:
+            price = await self.source.fetch(ticker)
+        except Exception as err:
+            stats.errors += 1
+            print("Quote for ", ticker, " failed: ", err)
+            return
+        stats.last_latency = time.perf_counter() - requested_at
+        if self.metrics is not None:
+            self.metrics.histogram('quote_fetch_seconds', ticker=ticker).observe(stats.last_latency)
+        received_at = self.clock()
+
+        self.enqueue(ticker, (price, received_at))
+        stats.samples += 1
+
+    def enqueue(self, ticker, sample):
+        queue = self.queues[ticker]
+        if queue.full():
+            queue.get_nowait()
+            self.stats[ticker].dropped += 1
+        queue.put_nowait(sample)
+
+    async def consume(self, ticker):
+        queue = self.queues[ticker]
+        while True:
+            sample = await queue.get()
+            if sample is None:
+                return
+            price, time_of_price = sample
+            for callback in self.subscribers[ticker]:
+                # One subscriber failing (a trade, a redraw) mustn't stop the others or the ticker
+                try:
+                    callback(price, time_of_price)
+                except Exception as err:
+                    self.stats[ticker].callback_errors += 1
+                    print("Handling ", ticker, " sample failed: ", repr(err))
+            # Let the pollers in between samples, even if every callback is synchronous
+            await asyncio.sleep(0)
+
+    def collect_metrics(self, registry):
+        registry.set_gauge('live_ticks', self.num_ticks)
+        registry.set_gauge('live_missed_ticks', self.missed_ticks)
+        for ticker in self.tickers:
+            stats = self.stats[ticker]
+            registry.set_gauge('live_samples', stats.samples, ticker=ticker)
+            registry.set_gauge('live_dropped_samples', stats.dropped, ticker=ticker)
+            registry.set_gauge('live_skipped_polls', stats.skipped_polls, ticker=ticker)
+            registry.set_gauge('live_quote_errors', stats.errors, ticker=ticker)
+            registry.set_gauge('live_callback_errors', stats.callback_errors, ticker=ticker)
+
+    def report(self):
+        print("Live feed: ", self.num_ticks, " ticks, ", self.missed_ticks, " missed")
+        for ticker in self.tickers:
+            stats = self.stats[ticker]
+            print(ticker,
+                  " polls: ", stats.polls,
+                  " samples: ", stats.samples,
+                  " dropped: ", stats.dropped,
+                  " skipped polls: ", stats.skipped_polls,
+                  " errors: ", stats.errors,
+                  " callback errors: ", stats.callback_errors)
@@ -0,0 +1,158 @@
+import time
+import asyncio
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.ticker as mtick
+import metrics
+
+from matplotlib.widgets import Button
+
+
+class LiveRenderer:
+    # Draws a Manager's live price and derivative plots on its own schedule, decoupled from quote
+    # handling. The quote handler only calls mark_dirty(); frames are drawn from run() at most
+    # `fps` times a second, and only when something changed.
+    #
+    # The figure, lines and stop button are built once. Frames only redraw the two lines over a
+    # cached background (blitting) and fall back to a full draw when the axis limits have to move.
+    # Limits are given some headroom so that doesn't happen every frame.
+    #
+    # A frame is skipped whenever `backlog()` says samples are still waiting to be handled, so
+    # rendering never holds up engine decisions.
+    def __init__(self, manager, fps=10, backlog=None, headroom=0.25):
+        self.manager = manager
+        self.frame_interval = 1.0 / fps
+        self.backlog = backlog
+        self.headroom = headroom
+        self.fig = None
+        self.axes = {}
+        self.lines = {}
+        self.button = None
+        self.background = None
+        self.dirty = False
+        self.running = False
+        self.num_frames = 0
+        self.num_full_draws = 0
+        self.skipped_frames = 0
+
+        if manager.metrics is not None:
+            self.draw_frame = metrics.timed_call(self.draw_frame,
+                                                 manager.metrics.histogram('render_frame_seconds',
+                                                                           ticker=manager.ticker))
+
+    def build(self):
+        if self.fig is not None:
+            return
+        manager = self.manager
+        self.fig = manager.fig if getattr(manager, 'fig', None) is not None else plt.figure(figsize=(13, 9))
+        plt.ion()
+
+        # Create and label top graph (stock price) and bottom graph (rate of change)
+        self.axes['price'] = self.fig.add_subplot(211)
+        self.axes['price'].set_ylabel('Share Price')
+        self.axes['price'].set_title(manager.ticker + ' Share Price Over Time: {}'.format(''))
+        self.axes['deriv'] = self.fig.add_subplot(212)
+        self.axes['deriv'].set_ylabel('Deriv Price')
+        self.axes['deriv'].set_title('Deriv Share Price Over Time: {}'.format(''))
+
+        for plot, axis in self.axes.items():
+            self.lines[plot], = axis.plot([], [], '-o', alpha=0.8, animated=True)
+            axis.xaxis.set_major_locator(plt.MaxNLocator(15))
+            axis.xaxis.set_major_formatter(
+                mtick.FuncFormatter(lambda pos, _: time.strftime("%m/%d/%Y %H:%M:%S", time.localtime(pos)))
+            )
+        self.fig.autofmt_xdate()
+
+        # Put a stop button in place
+        button_pos = self.fig.add_axes([0.81, 0.05, 0.1, 0.075])
+        self.button = Button(button_pos, 'Stop')
+        self.button.on_clicked(manager.stop_pressed)
+
+        # Anything that redraws the whole figure (resizes, limit changes) refreshes the background
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+        self.fig.canvas.draw()
+        plt.show(block=False)
+
+    def on_draw(self, _):
+        if self.fig.canvas.supports_blit:
+            self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        for plot, line in self.lines.items():
+            self.axes[plot].draw_artist(line)
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def stop(self):
+        self.running = False
+
+    async def run(self):
+        self.build()
+        self.running = True
+        loop = asyncio.get_event_loop()
+        next_frame_time = loop.time()
+        while self.running:
+            if self.dirty:
+                if self.backlog is not None and self.backlog() > 0:
+                    self.skipped_frames += 1
+                else:
+                    self.draw_frame()
+
+            # Same fixed grid as the live feed: late frames are dropped, not made up
+            next_frame_time += self.frame_interval
+            now = loop.time()
+            if now > next_frame_time:
+                behind = int((now - next_frame_time) // self.frame_interval) + 1
+                self.skipped_frames += behind
+                next_frame_time += behind * self.frame_interval
+            await asyncio.sleep(next_frame_time - now)
+
+    def draw_frame(self):
+        self.dirty = False
+        data = self.manager.data
+        if len(data['x']) < self.manager.MAX_SAMPLES - 1:
+            return
+
+        needs_full_draw = self.background is None
+        for plot, (x_key, y_key) in (('price', ('x', 'y')), ('deriv', ('x_p', 'y_p'))):
+            x_data = data[x_key]
+            y_data = data[y_key]
+            self.lines[plot].set_data(x_data, y_data)
+            if self.rescale(self.axes[plot], x_data, y_data):
+                needs_full_draw = True
+
+        canvas = self.fig.canvas
+        if needs_full_draw or not canvas.supports_blit:
+            # on_draw draws the lines on top and grabs the new background
+            canvas.draw()
+            self.num_full_draws += 1
+        else:
+            canvas.restore_region(self.background)
+            for plot, line in self.lines.items():
+                self.axes[plot].draw_artist(line)
+            canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+        self.num_frames += 1
+
+    def rescale(self, axis, x_data, y_data):
+        # Only move the limits when the data has left them, and then leave room to grow so the
+        # next few frames can still be blitted. Returns whether anything changed.
+        changed = False
+        x_min, x_max = x_data[0], x_data[-1]
+        last_x_min, last_x_max = axis.get_xlim()
+        if x_min < last_x_min or x_max > last_x_max:
+            span = max(x_max - x_min, 1.0)
+            axis.set_xlim([x_min, x_max + self.headroom * span])
+            changed = True
+
+        current_min = np.min(y_data)
+        current_max = np.max(y_data)
+        last_min, last_max = axis.get_ylim()
+        if current_min <= last_min or current_max >= last_max:
+            spread = max(np.std(y_data), abs(current_max) * 1e-6, 1e-12)
+            axis.set_ylim([current_min - spread, current_max + spread])
+            changed = True
+        return changed
+
+    def report(self):
+        print("Renderer: ", self.num_frames, " frames (", self.num_full_draws, " full redraws), ",
+              self.skipped_frames, " skipped")
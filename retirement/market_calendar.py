@@ -0,0 +1,134 @@
+import time
+import numpy as np
+import datetime as dt
+
+
+# Windows the engines care about, as local (start, end) times of day, both ends inclusive
+DEFAULT_WINDOWS = {
+    'just_opened': (dt.time(8, 00), dt.time(8, 30)),
+    'just_closed': (dt.time(16, 00), dt.time(16, 30)),
+}
+
+# How far past the requested time the calendar gets extended whenever it runs out
+EXTEND_SECONDS = 366 * 86400
+DAY_SECONDS = 86400
+
+shared_calendars = {}
+
+
+def local_calendar():
+    # One calendar in the machine's local time shared by every engine, so the windows only get
+    # precomputed once per process
+    if None not in shared_calendars:
+        shared_calendars[None] = SessionCalendar()
+    return shared_calendars[None]
+
+
+def seconds_of_day(time_of_day):
+    return time_of_day.hour * 3600 + time_of_day.minute * 60 + time_of_day.second
+
+
+class SessionCalendar:
+    # Precomputes each window as sorted [start, stop) epoch ranges. Lookups are then a binary search,
+    # or a vectorized one over a whole time array, instead of formatting every timestamp.
+    #
+    # tz is a tzinfo (e.g. zoneinfo.ZoneInfo('America/New_York')) or None for the machine's local
+    # time, which is what QuantEngine.is_time_in_window has always used. A timestamp is in a window
+    # when the wall clock, to the second, reads between its start and end, exactly like
+    # is_time_in_window. Windows whose start is later than their end run over midnight.
+    def __init__(self, windows=None, tz=None):
+        if windows is None:
+            windows = DEFAULT_WINDOWS
+        self.windows = dict(windows)
+        self.tz = tz
+        self.covered_from = None
+        self.covered_until = None
+        self.starts = {}
+        self.stops = {}
+
+    def utc_offset(self, epoch_time):
+        if self.tz is None:
+            return time.localtime(epoch_time).tm_gmtoff
+        return int(dt.datetime.fromtimestamp(epoch_time, self.tz).utcoffset().total_seconds())
+
+    def offset_segments(self, first_time, last_time):
+        # [(offset, segment_start, segment_stop)] covering the range. DST changes are found by checking
+        # the offset every hour, then pinned down to the second with a bisection.
+        segments = []
+        segment_start = first_time
+        offset = self.utc_offset(first_time)
+        check_time = first_time
+        while check_time < last_time:
+            next_check = min(check_time + 3600, last_time)
+            next_offset = self.utc_offset(next_check)
+            if next_offset != offset:
+                low, high = check_time, next_check
+                while high - low > 1:
+                    middle = (low + high) // 2
+                    if self.utc_offset(middle) == offset:
+                        low = middle
+                    else:
+                        high = middle
+                segments.append((offset, segment_start, high))
+                segment_start = high
+                offset = next_offset
+            check_time = next_check
+        segments.append((offset, segment_start, last_time))
+        return segments
+
+    def build(self, first_time, last_time):
+        first_time = int(np.floor(first_time))
+        last_time = int(np.ceil(last_time)) + 1
+        self.covered_from = first_time
+        self.covered_until = last_time
+        segments = self.offset_segments(first_time, last_time)
+
+        for name, (start_time, end_time) in self.windows.items():
+            window_start = seconds_of_day(start_time)
+            # Exclusive, and a second past the end since the end second still counts
+            window_stop = seconds_of_day(end_time) + 1
+            if window_stop <= window_start:
+                # Over midnight
+                window_stop += DAY_SECONDS
+
+            starts = []
+            stops = []
+            for offset, segment_start, segment_stop in segments:
+                # Within a segment local time is just epoch + offset, so each local day's window is a
+                # fixed shift of the day's start. Go a day early to catch windows running past midnight.
+                first_day = (segment_start + offset) // DAY_SECONDS - 1
+                last_day = (segment_stop + offset) // DAY_SECONDS
+                day_starts = np.arange(first_day, last_day + 1) * DAY_SECONDS - offset
+                starts.append(np.maximum(day_starts + window_start, segment_start))
+                stops.append(np.minimum(day_starts + window_stop, segment_stop))
+
+            starts = np.concatenate(starts)
+            stops = np.concatenate(stops)
+            keep = starts < stops
+            order = np.argsort(starts[keep], kind='stable')
+            self.starts[name] = starts[keep][order].astype(np.float64)
+            self.stops[name] = stops[keep][order].astype(np.float64)
+
+    def ensure_covers(self, first_time, last_time):
+        if self.covered_from is not None and self.covered_from <= first_time and last_time < self.covered_until:
+            return
+
+        if self.covered_from is not None:
+            first_time = min(first_time, self.covered_from)
+            last_time = max(last_time, self.covered_until)
+        self.build(first_time - DAY_SECONDS, last_time + EXTEND_SECONDS)
+
+    def in_window(self, name, epoch_time):
+        self.ensure_covers(epoch_time, epoch_time)
+        index = int(np.searchsorted(self.starts[name], epoch_time, side='right')) - 1
+        return index >= 0 and epoch_time < self.stops[name][index]
+
+    def window_mask(self, name, epoch_times):
+        epoch_times = np.asarray(epoch_times, dtype=np.float64)
+        if len(epoch_times) == 0:
+            return np.zeros(0, dtype=bool)
+
+        self.ensure_covers(float(epoch_times.min()), float(epoch_times.max()))
+        indices = np.searchsorted(self.starts[name], epoch_times, side='right') - 1
+        valid = indices >= 0
+        return valid & (epoch_times < self.stops[name][np.maximum(indices, 0)])
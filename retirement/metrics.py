@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import bisect
+
+
+# Opt-in timers and counters for the engines and the live loop. Nothing here runs unless a Metrics
+# registry is handed out (see Manager.enable_metrics), and instrumenting swaps timed wrappers onto
+# the instances involved, so code that isn't instrumented takes no extra branches at all.
+
+# Histogram bucket upper bounds in seconds, 1us up to 10s at 1-2-5 steps
+DEFAULT_BOUNDS = [scale * 10.0 ** exponent for exponent in range(-6, 1) for scale in (1, 2, 5)] + [10.0]
+
+PREFIX = 'retirement_'
+
+
+class Histogram:
+    def __init__(self, bounds=None):
+        self.bounds = list(bounds or DEFAULT_BOUNDS)
+        self.bucket_counts = [0] * (len(self.bounds) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket the quantile falls in, so an overestimate by at most one bucket
+        if self.count == 0:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.bounds, self.bucket_counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': [[bound, bucket_count] for bound, bucket_count in zip(self.bounds, self.bucket_counts)],
+            'overflow': self.bucket_counts[-1],
+        }
+
+
+class Metrics:
+    # Counters, gauges and histograms keyed by name and labels, e.g.
+    # histogram('engine_update_model_seconds', engine='TimeBasedQuantEngine'). Collectors are called
+    # right before every snapshot, for values that are cheaper to read at export time than to track
+    # on every tick (trade counts, queue stats).
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+        self.created = time.time()
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def histogram(self, name, bounds=None, **labels):
+        key = self.key(name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram(bounds)
+        return self.histograms[key]
+
+    def count(self, name, amount=1, **labels):
+        key = self.key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        self.gauges[self.key(name, labels)] = value
+
+    def add_collector(self, collector):
+        # collector(metrics) sets whatever gauges it owns
+        self.collectors.append(collector)
+
+    def collect(self):
+        for collector in self.collectors:
+            collector(self)
+
+    def snapshot(self):
+        self.collect()
+        return {
+            'time': time.time(),
+            'uptime': time.time() - self.created,
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in sorted(self.counters.items())],
+            'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                       for (name, labels), value in sorted(self.gauges.items())],
+            'histograms': [dict(histogram.snapshot(), name=name, labels=dict(labels))
+                           for (name, labels), histogram in sorted(self.histograms.items())],
+        }
+
+    def prometheus_text(self):
+        # Prometheus text exposition format. Collectors run here too.
+        self.collect()
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE ' + name + ' ' + kind)
+
+        for (name, labels), value in sorted(self.counters.items()):
+            metric = PREFIX + name + '_total'
+            declare(metric, 'counter')
+            lines.append(metric + format_labels(labels) + ' ' + repr(float(value)))
+        for (name, labels), value in sorted(self.gauges.items()):
+            metric = PREFIX + name
+            declare(metric, 'gauge')
+            lines.append(metric + format_labels(labels) + ' ' + repr(float(value)))
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            metric = PREFIX + name
+            declare(metric, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.bounds, histogram.bucket_counts):
+                cumulative += bucket_count
+                lines.append(metric + '_bucket' + format_labels(labels + (('le', repr(bound)),)) +
+                             ' ' + str(cumulative))
+            lines.append(metric + '_bucket' + format_labels(labels + (('le', '+Inf'),)) + ' ' + str(histogram.count))
+            lines.append(metric + '_sum' + format_labels(labels) + ' ' + repr(histogram.sum))
+            lines.append(metric + '_count' + format_labels(labels) + ' ' + str(histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, json_path=None, prometheus_path=None):
+        # Written to a temp file and renamed into place, so scrapers never see half a file
+        if json_path is not None:
+            write_atomic(json_path, json.dumps(self.snapshot(), indent=2, sort_keys=True))
+        if prometheus_path is not None:
+            write_atomic(prometheus_path, self.prometheus_text())
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+                          for name, value in labels) + '}'
+
+
+def write_atomic(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as out_file:
+        out_file.write(text)
+    os.replace(tmp_path, path)
+
+
+def timed_call(function, histogram):
+    # function, but every call's wall time goes into histogram
+    clock = time.perf_counter
+    observe = histogram.observe
+
+    def timed(*args, **kwargs):
+        start = clock()
+        result = function(*args, **kwargs)
+        observe(clock() - start)
+        return result
+    return timed
+
+
+class PeriodicExporter:
+    # Exports a registry every `interval` seconds from the live event loop, and once more on stop
+    def __init__(self, metrics, json_path=None, prometheus_path=None, interval=10.0):
+        self.metrics = metrics
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.running = False
+        self.num_exports = 0
+
+    def export(self):
+        self.metrics.export(self.json_path, self.prometheus_path)
+        self.num_exports += 1
+
+    def stop(self):
+        self.running = False
+
+    async def run(self):
+        # Imported here since only the live loop needs it, and engines import this module
+        import asyncio
+        self.running = True
+        last_export = time.perf_counter()
+        while self.running:
+            # Wake up often enough to notice stop() without waiting out a whole interval
+            await asyncio.sleep(min(self.interval, 0.5))
+            if time.perf_counter() - last_export >= self.interval:
+                self.export()
+                last_export = time.perf_counter()
+        self.export()
@@ -0,0 +1,243 @@
+import sys
+import copy
+import time
+import argparse
+import numpy as np
+import quant
+import sweep
+import parallel_runner
+
+from history_cache import HistoryCache
+
+
+# Robustness checks: run the engines over thousands of made-up price histories instead of the one
+# that actually happened. Paths are rows of one 2-D array, each engine computes its signals for
+# every path in one go (see QuantEngine.compute_signals), and the buy/sell state machine then walks
+# the bars once with every path advancing together.
+#
+#   python monte_carlo.py DOGE --paths 10000 --method bootstrap
+
+# Generate paths this many at a time, to bound the size of the temporary index arrays
+PATH_BATCH = 1000
+
+
+def log_returns(prices):
+    return np.diff(np.log(np.asarray(prices, dtype=np.float64)))
+
+
+def block_bootstrap_paths(prices, num_paths, num_bars=None, block_size=24, seed=0, start_price=None):
+    # Paths stitched together from randomly chosen blocks of the history's log returns. Blocks keep
+    # the short range structure (volatility clusters, daily patterns) that resampling single
+    # returns would scramble. Returns an array of shape (num_paths, num_bars).
+    returns = log_returns(prices)
+    num_bars = num_bars or len(prices)
+    block_size = min(block_size, len(returns))
+    start_price = prices[0] if start_price is None else start_price
+    num_blocks = -(-(num_bars - 1) // block_size)
+    rng = np.random.default_rng(seed)
+
+    paths = np.empty((num_paths, num_bars))
+    paths[:, 0] = np.log(start_price)
+    for first in range(0, num_paths, PATH_BATCH):
+        batch = min(PATH_BATCH, num_paths - first)
+        starts = rng.integers(0, len(returns) - block_size + 1, size=(batch, num_blocks))
+        indices = (starts[:, :, None] + np.arange(block_size)).reshape(batch, -1)[:, :num_bars - 1]
+        np.cumsum(returns[indices], axis=1, out=paths[first:first + batch, 1:])
+        paths[first:first + batch, 1:] += paths[first:first + batch, :1]
+    return np.exp(paths)
+
+
+def fit_gbm(prices):
+    # Per-bar mean and standard deviation of log returns
+    returns = log_returns(prices)
+    return float(np.mean(returns)), float(np.std(returns))
+
+
+def gbm_paths(start_price, drift, volatility, num_paths, num_bars, seed=0):
+    # Geometric Brownian motion with per-bar log return mean `drift` and std `volatility`
+    rng = np.random.default_rng(seed)
+    paths = np.empty((num_paths, num_bars))
+    paths[:, 0] = np.log(start_price)
+    for first in range(0, num_paths, PATH_BATCH):
+        batch = min(PATH_BATCH, num_paths - first)
+        np.cumsum(rng.normal(drift, volatility, size=(batch, num_bars - 1)), axis=1,
+                  out=paths[first:first + batch, 1:])
+        paths[first:first + batch, 1:] += paths[first:first + batch, :1]
+    return np.exp(paths)
+
+
+def path_times(times, num_bars):
+    # The history's own bar times, carried on at its median spacing if the paths are longer
+    times = np.asarray(times, dtype=np.float64)
+    if num_bars <= len(times):
+        return times[:num_bars].copy()
+    spacing = np.median(np.diff(times)) if len(times) > 1 else 1.0
+    extra = times[-1] + spacing * np.arange(1, num_bars - len(times) + 1)
+    return np.concatenate([times, extra])
+
+
+def simulate_engine(engine, paths, times):
+    # The engine's backtest, run over every row of paths at once. The engine itself isn't touched;
+    # its signals are computed on a copy. Returns per-path arrays of final value (after liquidating
+    # like QuantEngine.close), max drawdown (as TradeLedger.max_drawdown) and number of trades.
+    template = copy.copy(engine)
+    template.time_of_last_trade = times[0]
+    template.signal_offset = 0
+    buy_signal, sell_signal = template.compute_signals(paths, times)
+    escape = template.escape_threshold()
+
+    # Bars on the outer axis so each step reads contiguous rows
+    prices = np.ascontiguousarray(paths.T)
+    buy_signal = np.ascontiguousarray(np.broadcast_to(buy_signal, paths.shape).T)
+    sell_signal = np.ascontiguousarray(np.broadcast_to(sell_signal, paths.shape).T)
+    any_buy = buy_signal.any(axis=1)
+    any_sell = sell_signal.any(axis=1)
+
+    num_paths = paths.shape[0]
+    funds = np.full(num_paths, float(engine.seed_money))
+    shares = np.zeros(num_paths)
+    invested = np.zeros(num_paths, dtype=bool)
+    escape_level = np.full(num_paths, np.nan)  # nan never bails
+    num_trades = np.zeros(num_paths, dtype=np.int64)
+    peak = np.zeros(num_paths)
+    max_drawdown = np.zeros(num_paths)
+
+    def record(trading, price):
+        # Running peak and drawdown of cash plus position after each trade, like the ledger's equity
+        values = funds[trading] + shares[trading] * price[trading]
+        peak[trading] = np.maximum(peak[trading], values)
+        max_drawdown[trading] = np.maximum(max_drawdown[trading], 1 - values / peak[trading])
+        num_trades[trading] += 1
+
+    def sell(selling, price):
+        # Same arithmetic as QuantEngine.sell_at
+        amounts = shares[selling] * price[selling]
+        funds[selling] = funds[selling] + amounts
+        shares[selling] = shares[selling] - shares[selling]
+        invested[selling] = False
+        escape_level[selling] = np.nan
+        record(selling, price)
+
+    for bar in range(prices.shape[0]):
+        price = prices[bar]
+        bailing = escape is not None and invested.any()
+        if not any_buy[bar] and not any_sell[bar] and not bailing:
+            continue
+
+        selling = invested & sell_signal[bar]
+        if bailing:
+            selling |= price <= escape_level
+        buying = ~invested & buy_signal[bar]
+
+        if buying.any():
+            # Same arithmetic as QuantEngine.buy_at with how_much_to_buy being all available funds
+            amounts = funds[buying]
+            funds[buying] = funds[buying] + amounts * -1
+            shares[buying] = shares[buying] + amounts / price[buying]
+            invested[buying] = True
+            if escape is not None:
+                escape_level[buying] = price[buying] * escape
+            record(buying, price)
+
+        if selling.any():
+            sell(selling, price)
+
+    # Liquidate whatever is still held, like QuantEngine.close
+    sell(invested.copy(), prices[-1])
+    return {'final_value': funds, 'max_drawdown': max_drawdown, 'num_trades': num_trades}
+
+
+def simulate(engines, paths, times, verbose=True):
+    # Per-path results for every engine over the same paths, in the engines' order. Swept engines
+    # can share a name, so each result carries the name rather than being keyed by it.
+    results = []
+    for engine in engines:
+        start = time.perf_counter()
+        result = simulate_engine(engine, paths, times)
+        result['name'] = engine.name
+        result['seed_money'] = float(engine.seed_money)
+        results.append(result)
+        if verbose:
+            print("Simulated ", engine.name, " over ", paths.shape[0],
+                  " paths in %.2f s" % (time.perf_counter() - start))
+    return results
+
+
+def summarize(results, percentiles=(5, 50, 95)):
+    # Distribution of each engine's outcomes, best median final value first
+    rows = []
+    for result in results:
+        final_values = result['final_value']
+        rows.append({
+            'name': result['name'],
+            'final_value': np.percentile(final_values, percentiles),
+            'mean_final_value': float(np.mean(final_values)),
+            'chance_of_loss': float(np.mean(final_values < result['seed_money'])),
+            'max_drawdown': np.percentile(result['max_drawdown'], percentiles),
+            'num_trades': np.percentile(result['num_trades'], percentiles),
+        })
+    rows.sort(key=lambda row: row['final_value'][len(percentiles) // 2], reverse=True)
+    return rows
+
+
+def print_summary(rows):
+    print("Final value (5/50/95th pct), chance of loss, max drawdown (50/95th), trades (50th):")
+    for row in rows:
+        print("%-45s %9.2f %9.2f %9.2f   %5.1f%%   %5.1f%% %5.1f%%   %6d"
+              % (row['name'], row['final_value'][0], row['final_value'][1], row['final_value'][2],
+                 row['chance_of_loss'] * 100, row['max_drawdown'][1] * 100, row['max_drawdown'][2] * 100,
+                 row['num_trades'][1]))
+
+
+def default_engines():
+    # The Manager's built-in engines plus one engine for every point of its default sweep grid
+    engines = quant.builtin_engines()
+    deriv_dims, buy_thresholds, sell_thresholds, emer_escape_thresholds = sweep.default_grid()
+    for deriv_dim in deriv_dims:
+        for buy_threshold in buy_thresholds:
+            for sell_threshold in sell_thresholds:
+                for escape in emer_escape_thresholds:
+                    engines.append(quant.IthDerivBasedQuantEngine(deriv_dim=deriv_dim,
+                                                                  buy_threshold=float(buy_threshold),
+                                                                  sell_threshold=float(sell_threshold),
+                                                                  emer_escape_threshold=escape))
+    for engine in engines:
+        engine.journal = parallel_runner.quiet_journal
+    return engines
+
+
+def make_paths(prices, method, num_paths, num_bars, block_size=24, seed=0):
+    if method == 'bootstrap':
+        return block_bootstrap_paths(prices, num_paths, num_bars, block_size, seed)
+    if method == 'gbm':
+        drift, volatility = fit_gbm(prices)
+        return gbm_paths(prices[0], drift, volatility, num_paths, num_bars, seed)
+    raise Exception("unknown path method: " + method)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Monte Carlo simulation of the engines over synthetic price paths')
+    parser.add_argument('ticker')
+    parser.add_argument('--interval', default='hour')
+    parser.add_argument('--method', default='bootstrap', choices=['bootstrap', 'gbm'])
+    parser.add_argument('--paths', type=int, default=10000)
+    parser.add_argument('--bars', type=int, default=None, help='path length, defaults to the cached history length')
+    parser.add_argument('--block-size', type=int, default=24)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    times, prices = HistoryCache().load(args.ticker, args.interval)
+    if len(times) < 2:
+        print("Not enough cached history for ", args.ticker, " at interval ", args.interval)
+        return 1
+    prices = np.array(prices)
+    num_bars = args.bars or len(prices)
+
+    paths = make_paths(prices, args.method, args.paths, num_bars, args.block_size, args.seed)
+    results = simulate(default_engines(), paths, path_times(times, num_bars))
+    print_summary(summarize(results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
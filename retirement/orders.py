@@ -0,0 +1,442 @@
+import time
+import asyncio
+import itertools
+import threading
+
+from ledger import BUY_SIDE, SELL_SIDE
+from quote_client import shared_rate_limiter
+
+
+# Live order routing. Engines don't talk to the brokerage themselves: with an OrderRouter
+# attached (see Manager.route_orders), QuantEngine.buy/sell just queue an OrderIntent and go on
+# to the next decision. The router's run() task, on the live event loop, takes everything queued
+# for a ticker at once and:
+#   - crosses opposite intents against each other (one engine selling what another is buying),
+#     so only the difference goes to the brokerage
+#   - merges what's left into a single order, split back over the intents pro rata as it fills
+#   - submits orders concurrently on the loop's thread pool, through the same rate limiter as
+#     the quotes, and polls each one until it's done
+# An intent is settled once its order finishes: the engine gets what actually filled (see
+# QuantEngine.fill_buy / fill_sell), or nothing if it was cancelled or rejected, and can trade
+# again.
+#
+# Brokers implement submit_order / order_status / cancel_order (see backends.MarketBackend);
+# FakeBroker below is a local one with configurable latency, partial fills and rejections.
+
+# Intent and order states
+QUEUED = 'queued'
+SENT = 'sent'
+FILLED = 'filled'
+CANCELLED = 'cancelled'
+REJECTED = 'rejected'
+
+OPEN = 'open'  # at the brokerage, not done yet
+DONE_STATES = (FILLED, CANCELLED, REJECTED)
+
+# Open orders are checked right after the ack, then every FIRST_POLL_INTERVAL seconds, doubling up
+# to the router's poll_interval
+FIRST_POLL_INTERVAL = 0.05
+DEFAULT_POLL_INTERVAL = 0.5
+
+
+class OrderIntent:
+    # One engine's buy (of `amount` dollars) or sell (of `shares`), and how much of it has filled
+    checkpoint_attributes = ('side', 'price', 'time_of_decision', 'amount', 'shares', 'filled_shares', 'filled_amount')
+
+    def __init__(self, engine, ticker, side, price, time_of_decision, amount=None, shares=None):
+        self.engine = engine
+        self.ticker = ticker
+        self.side = side
+        self.price = price  # the engine's price when it decided
+        self.time_of_decision = time_of_decision
+        self.amount = amount
+        self.shares = shares
+        self.state = QUEUED
+        self.filled_shares = 0.0
+        self.filled_amount = 0.0
+        self.crossed = False  # filled, at least partly, against another engine's intent
+        self.order = None  # the BrokerOrder it went out in
+        self.queued_at = time.perf_counter()
+
+    def value(self, price):
+        # Size in dollars
+        return self.amount if self.side == BUY_SIDE else self.shares * price
+
+    def fill(self, shares, amount):
+        self.filled_shares += shares
+        self.filled_amount += amount
+
+    def checkpoint_state(self):
+        # Enough to follow the intent up after a restart (see OrderRouter.resume). Once the brokerage
+        # has acked its order, that's the order's id, what it had filled and this intent's share of it.
+        state = {attribute: getattr(self, attribute) for attribute in self.checkpoint_attributes}
+        order = self.order
+        if order is not None and order.order_id is not None:
+            state['order'] = {'order_id': order.order_id, 'amount': order.amount, 'shares': order.shares,
+                              'filled_shares': order.filled_shares, 'filled_amount': order.filled_amount,
+                              'weight': order.weights[order.intents.index(self)]}
+        return state
+
+    @classmethod
+    def from_checkpoint(cls, engine, state):
+        # The ticker is filled in once the engine is registered with a router again
+        intent = cls(engine, None, state['side'], state['price'], state['time_of_decision'],
+                     amount=state['amount'], shares=state['shares'])
+        intent.fill(state['filled_shares'], state['filled_amount'])
+        saved = state.get('order')
+        if saved is not None:
+            order = BrokerOrder(None, intent.side, [intent], [saved['weight']], amount=saved['amount'],
+                                shares=saved['shares'])
+            order.order_id = saved['order_id']
+            order.filled_shares = saved['filled_shares']
+            order.filled_amount = saved['filled_amount']
+            order.state = OPEN
+            intent.order = order
+            intent.state = SENT
+        return intent
+
+
+class BrokerOrder:
+    # What actually goes to the brokerage: the uncrossed rest of a ticker's intents, with the share
+    # of each fill that goes to each intent
+    def __init__(self, ticker, side, intents, weights, amount=None, shares=None):
+        self.ticker = ticker
+        self.side = side
+        self.intents = intents
+        self.weights = weights
+        self.amount = amount
+        self.shares = shares
+        self.order_id = None
+        self.state = QUEUED
+        self.filled_shares = 0.0
+        self.filled_amount = 0.0
+        self.sent_at = None
+        self.acked_at = None
+
+    def update(self, status):
+        # Hands out whatever filled since the last status
+        new_shares = status['shares'] - self.filled_shares
+        new_amount = status['amount'] - self.filled_amount
+        if new_shares > 0:
+            for intent, weight in zip(self.intents, self.weights):
+                intent.fill(new_shares * weight, new_amount * weight)
+            self.filled_shares = status['shares']
+            self.filled_amount = status['amount']
+        self.state = status['state']
+
+
+class OrderRouter:
+    def __init__(self, broker, rate_limiter=None, max_in_flight=4, poll_interval=None, drain_timeout=30.0,
+                 clock=time.time, metrics=None):
+        self.broker = broker
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        self.max_in_flight = max_in_flight  # broker calls at once
+        # Longest wait between status checks of an open order. Defaults to the broker's, e.g. none at
+        # all for a replay that runs as fast as it can.
+        if poll_interval is None:
+            poll_interval = getattr(broker, 'order_poll_interval', DEFAULT_POLL_INTERVAL)
+        self.poll_interval = poll_interval
+        self.drain_timeout = drain_timeout  # how long stop() waits for open orders before cancelling them
+        self.clock = clock
+        self.metrics = metrics
+        self.tickers = {}  # engine -> ticker
+        self.queued = {}  # ticker -> [OrderIntent]
+        self.open_orders = set()
+        self.tasks = set()
+        self.resumed = []  # orders from before a restart, to follow up on once running
+        self.running = False
+        self.stopped_at = None
+        self.wakeup = None
+        self.slots = None
+
+        self.num_intents = 0
+        self.num_crossed = 0
+        self.num_orders = 0
+        self.num_rejected = 0
+        self.num_cancelled = 0
+
+    def register(self, engine, ticker):
+        # Live trades of the engine go through here from now on
+        self.tickers[engine] = ticker
+        engine.orders = self
+        if engine.pending_order is not None:
+            self.resume(engine.pending_order)
+
+    def resume(self, intent):
+        # An intent restored from a checkpoint. If its order had been acked it's followed up on where
+        # it was, otherwise it never got to the brokerage and is queued again.
+        intent.ticker = self.tickers[intent.engine]
+        self.num_intents += 1
+        if intent.order is None:
+            self.queued.setdefault(intent.ticker, []).append(intent)
+        else:
+            intent.order.ticker = intent.ticker
+            self.resumed.append(intent.order)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def submit(self, engine, side, price, time_of_decision, amount=None, shares=None):
+        # Called from the engines' decisions, on the event loop's thread. Never waits on the brokerage.
+        ticker = self.tickers[engine]
+        intent = OrderIntent(engine, ticker, side, price, time_of_decision, amount=amount, shares=shares)
+        if not self.running:
+            print("Order router isn't running, not trading ", ticker, " for ", engine.name)
+            self.settle(intent, REJECTED)
+            return None
+        self.queued.setdefault(ticker, []).append(intent)
+        self.num_intents += 1
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return intent
+
+    def cancel(self, intent):
+        # Only intents that haven't gone out yet can be cancelled
+        intents = self.queued.get(intent.ticker, [])
+        if intent not in intents:
+            return False
+        intents.remove(intent)
+        self.settle(intent, CANCELLED)
+        return True
+
+    def stop(self):
+        # Stops taking new intents, cancels the queued ones and winds down the open orders
+        self.running = False
+        self.stopped_at = time.perf_counter()
+        for intents in list(self.queued.values()):
+            for intent in list(intents):
+                self.cancel(intent)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def run(self):
+        self.running = True
+        self.wakeup = asyncio.Event()
+        self.slots = asyncio.Semaphore(self.max_in_flight)
+        if self.queued or self.resumed:
+            self.wakeup.set()
+        while self.running:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            self.dispatch()
+        if self.tasks:
+            await asyncio.wait(list(self.tasks))
+
+    def dispatch(self):
+        # Everything queued so far goes out now, one order per ticker at most
+        queued = self.queued
+        self.queued = {}
+        for ticker, intents in queued.items():
+            if intents:
+                order = self.net(ticker, intents)
+                if order is not None:
+                    self.start(self.execute(order))
+        resumed = self.resumed
+        self.resumed = []
+        for order in resumed:
+            self.start(self.complete(order))
+
+    def start(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def net(self, ticker, intents):
+        # Crosses buys against sells at the newest decision price and returns an order for the rest,
+        # or None if nothing is left to send
+        price = max(intents, key=lambda intent: intent.time_of_decision).price
+        buys = [intent for intent in intents if intent.side == BUY_SIDE]
+        sells = [intent for intent in intents if intent.side == SELL_SIDE]
+        buy_value = sum(intent.value(price) for intent in buys)
+        sell_value = sum(intent.value(price) for intent in sells)
+        crossed = min(buy_value, sell_value)
+        if crossed > 0:
+            self.num_crossed += 1
+            for side_intents, side_value in ((buys, buy_value), (sells, sell_value)):
+                for intent in side_intents:
+                    amount = crossed * intent.value(price) / side_value
+                    intent.fill(amount / price, amount)
+                    intent.crossed = True
+
+        if buy_value > sell_value:
+            side, rest, remaining = BUY_SIDE, buys, buy_value - crossed
+        else:
+            side, rest, remaining = SELL_SIDE, sells, sell_value - crossed
+        done = [intent for intent in intents if intent not in rest or remaining <= 0]
+        for intent in done:
+            self.settle(intent, FILLED)
+        if remaining <= 0:
+            return None
+
+        # Each intent's share of the order is its share of what's left to trade
+        total = sum(intent.value(price) for intent in rest)
+        weights = [intent.value(price) / total for intent in rest]
+        if side == BUY_SIDE:
+            order = BrokerOrder(ticker, side, rest, weights, amount=remaining)
+        else:
+            order = BrokerOrder(ticker, side, rest, weights, shares=remaining / price)
+        for intent in rest:
+            intent.state = SENT
+            intent.order = order
+        return order
+
+    async def call(self, function, *args):
+        # A blocking broker call on the loop's thread pool, within the concurrency and rate limits
+        async with self.slots:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, self.limited_call, function, args)
+
+    def limited_call(self, function, args):
+        self.rate_limiter.acquire()
+        return function(*args)
+
+    async def execute(self, order):
+        self.open_orders.add(order)
+        self.num_orders += 1
+        order.sent_at = time.perf_counter()
+        try:
+            order.order_id = await self.call(self.broker.submit_order, order.ticker, order.side, order.amount,
+                                             order.shares)
+        except Exception as err:
+            print("Order for ", order.ticker, " was rejected: ", err)
+            order.state = REJECTED
+            self.num_rejected += 1
+        else:
+            order.acked_at = time.perf_counter()
+            self.observe('order_ack_seconds', order.acked_at - order.sent_at, order.ticker)
+            order.state = OPEN
+            await self.follow(order)
+        self.finish(order)
+
+    async def complete(self, order):
+        # An order acked before a restart, followed up on from where it was
+        self.open_orders.add(order)
+        await self.follow(order)
+        self.finish(order)
+
+    def finish(self, order):
+        self.open_orders.discard(order)
+        for intent in order.intents:
+            self.settle(intent, order.state)
+
+    async def follow(self, order):
+        # Polls the order until it's done, starting straight after the ack since most market orders
+        # fill right away. Once stopped, waits drain_timeout for it before cancelling, and after that
+        # gives up on a brokerage that doesn't answer.
+        cancelling = False
+        delay = 0.0
+        while order.state not in DONE_STATES:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            delay = min(max(delay * 2, FIRST_POLL_INTERVAL), self.poll_interval)
+            draining = not self.running and time.perf_counter() - self.stopped_at > self.drain_timeout
+            try:
+                if draining and not cancelling:
+                    print("Cancelling order ", order.order_id, " for ", order.ticker, " on shutdown")
+                    cancelling = True
+                    await self.call(self.broker.cancel_order, order.order_id)
+                order.update(await self.call(self.broker.order_status, order.order_id))
+            except Exception as err:
+                print("Status of order ", order.order_id, " for ", order.ticker, " failed: ", err)
+                if cancelling:
+                    order.state = CANCELLED
+
+    def settle(self, intent, state):
+        # Hands the engine whatever filled and lets it trade again
+        intent.state = state
+        if state == CANCELLED:
+            self.num_cancelled += 1
+        engine = intent.engine
+        if intent.side == SELL_SIDE and abs(intent.filled_shares - intent.shares) <= 1e-9 * intent.shares:
+            # The whole position, without the rounding from splitting fills over intents
+            intent.filled_shares = intent.shares
+        if intent.filled_shares > 0:
+            price = intent.filled_amount / intent.filled_shares
+            if intent.side == BUY_SIDE:
+                engine.fill_buy(price, self.clock(), intent.filled_shares, intent.filled_amount)
+            else:
+                engine.fill_sell(price, self.clock(), intent.filled_shares, intent.filled_amount)
+        if engine.pending_order is intent:
+            engine.pending_order = None
+        self.observe('order_settle_seconds', time.perf_counter() - intent.queued_at, intent.ticker)
+
+    def observe(self, name, seconds, ticker):
+        if self.metrics is not None:
+            self.metrics.histogram(name, ticker=ticker).observe(seconds)
+
+    def report(self):
+        print("Orders: ", self.num_intents, " intents, ", self.num_crossed, " crossed internally, ",
+              self.num_orders, " sent, ", self.num_rejected, " rejected, ", self.num_cancelled, " cancelled")
+
+
+class FakeBroker:
+    # Local stand-in for the brokerage's order API. Orders are acknowledged after ack_latency
+    # seconds and fill at get_price(ticker) over `num_fills` equal parts, one every fill_interval
+    # seconds after the ack. Tickers in `reject` are turned down. Broker calls come in on several
+    # threads at once, hence the lock.
+    def __init__(self, get_price, ack_latency=0.0, fill_interval=0.0, num_fills=1, reject=()):
+        self.get_price = get_price
+        self.ack_latency = ack_latency
+        self.fill_interval = fill_interval
+        self.num_fills = num_fills
+        self.reject = set(reject)
+        self.orders = {}
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.max_concurrent_calls = 0
+        self.concurrent_calls = 0
+
+    def enter(self):
+        with self.lock:
+            self.calls += 1
+            self.concurrent_calls += 1
+            self.max_concurrent_calls = max(self.max_concurrent_calls, self.concurrent_calls)
+
+    def leave(self):
+        with self.lock:
+            self.concurrent_calls -= 1
+
+    def submit_order(self, ticker, side, amount=None, shares=None):
+        self.enter()
+        try:
+            if self.ack_latency > 0:
+                time.sleep(self.ack_latency)
+            if ticker in self.reject:
+                raise Exception("order rejected for " + ticker)
+            with self.lock:
+                order_id = 'fake-' + str(next(self.ids))
+                self.orders[order_id] = {'ticker': ticker, 'side': side, 'amount': amount, 'shares': shares,
+                                         'acked_at': time.perf_counter(), 'fills': [], 'cancelled': False}
+            return order_id
+        finally:
+            self.leave()
+
+    def order_status(self, order_id):
+        self.enter()
+        try:
+            with self.lock:
+                order = self.orders[order_id]
+                due = self.num_fills
+                if self.fill_interval > 0:
+                    due = min(due, int((time.perf_counter() - order['acked_at']) / self.fill_interval) + 1)
+                while len(order['fills']) < due and not order['cancelled']:
+                    price = float(self.get_price(order['ticker']))
+                    if order['side'] == BUY_SIDE:
+                        amount = order['amount'] / self.num_fills
+                        order['fills'].append((amount / price, amount))
+                    else:
+                        shares = order['shares'] / self.num_fills
+                        order['fills'].append((shares, shares * price))
+                if len(order['fills']) == self.num_fills:
+                    state = FILLED
+                else:
+                    state = CANCELLED if order['cancelled'] else OPEN
+                return {'state': state,
+                        'shares': sum(shares for shares, _ in order['fills']),
+                        'amount': sum(amount for _, amount in order['fills'])}
+        finally:
+            self.leave()
+
+    def cancel_order(self, order_id):
+        with self.lock:
+            self.orders[order_id]['cancelled'] = True
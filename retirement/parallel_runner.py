@@ -0,0 +1,122 @@
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import quant
+import journal
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Memory-mapped histories already opened by this worker process, keyed by file path
+open_histories = {}
+
+# Workers only report results, trades don't need recording
+quiet_journal = journal.Journal(verbosity=journal.OFF)
+
+
+def engine_config(engine_class_name, **kwargs):
+    # A picklable description of an engine, e.g. engine_config('IthDerivBasedQuantEngine', deriv_dim=4)
+    return engine_class_name, kwargs
+
+
+def build_engine(config):
+    engine_class_name, kwargs = config
+    return getattr(quant, engine_class_name)(**kwargs)
+
+
+def load_history(path):
+    # Rows are (times, prices). Opened read-only and memory-mapped, so every worker shares the
+    # same pages from the OS cache instead of getting its own pickled copy
+    if path not in open_histories:
+        open_histories[path] = np.load(path, mmap_mode='r')
+    return open_histories[path]
+
+
+def silence_worker():
+    # Exit reports from a pool of workers are just noise
+    sys.stdout = open(os.devnull, 'w')
+
+
+def run_work_unit(work_unit):
+    ticker, history_path, config = work_unit
+    history = load_history(history_path)
+    engine = build_engine(config)
+    engine.journal = quiet_journal
+    engine.backtest(history[1], history[0])
+    engine.close()
+
+    return {
+        'ticker': ticker,
+        'name': engine.name,
+        'config': config,
+        'event_times': engine.ledger.times().copy(),
+        'event_values': engine.ledger.values().copy(),
+        'event_is_sale': engine.ledger.is_sale(),
+        'start': engine.seed_money,
+        'end': engine.funds_available,
+        'min': engine.min_fund_value,
+        'max': engine.max_fund_value,
+    }
+
+
+class ParallelBacktestRunner:
+    def __init__(self, max_workers=None, history_dir=None, quiet=True):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.quiet = quiet
+        self.owns_history_dir = history_dir is None
+        self.history_dir = history_dir or tempfile.mkdtemp(prefix='retirement_histories_')
+        self.history_paths = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.cleanup()
+
+    def cleanup(self):
+        if self.owns_history_dir and os.path.exists(self.history_dir):
+            shutil.rmtree(self.history_dir)
+
+    def add_history(self, ticker, prices, times):
+        # Write the history once to a .npy file the workers can memory-map
+        path = os.path.join(self.history_dir, ticker + '.npy')
+        history = np.vstack([np.asarray(times, dtype=np.float64), np.asarray(prices, dtype=np.float64)])
+        np.save(path, history)
+        self.history_paths[ticker] = path
+
+    def run(self, engine_configs, tickers=None):
+        # Every (ticker, engine config) pair is one work unit. Results come back sorted the same way
+        # Manager.close ranks engines: by final value, skipping engines that never traded.
+        if tickers is None:
+            tickers = list(self.history_paths.keys())
+
+        work_units = []
+        for ticker in tickers:
+            for config in engine_configs:
+                work_units.append((ticker, self.history_paths[ticker], config))
+        if len(work_units) == 0:
+            return []
+
+        # Hand out work in batches so per-task IPC stays small next to the backtests themselves
+        chunksize = max(1, len(work_units) // (self.max_workers * 4))
+        initializer = silence_worker if self.quiet else None
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=initializer) as executor:
+            results = list(executor.map(run_work_unit, work_units, chunksize=chunksize))
+
+        results = [result for result in results if len(result['event_values']) > 1]
+        results.sort(key=lambda result: result['event_values'][-1], reverse=True)
+        return results
+
+    @staticmethod
+    def print_summary(results):
+        for result in results:
+            values = result['event_values']
+            percent_diff = "%.2f" % ((values[-1] - values[0]) / values[0] * 100)
+            print(result['ticker'], " Engine (", result['name'], ") "
+                  " Start: ", result['start'],
+                  " End: ", result['end'],
+                  " Min: ", result['min'],
+                  " Max: ", result['max'],
+                  " (" + percent_diff + ")")
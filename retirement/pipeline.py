@@ -0,0 +1,100 @@
+import time
+import itertools
+import contextlib
+import numpy as np
+import history_cache
+
+
+# Chunked sources of (times, prices) bars for Manager.stream_history. A source is a function that
+# returns a fresh iterator of chunks each time it's called, so the history can be read more than
+# once (the sweep reads it, then the engines do) without ever being held in memory as a whole.
+
+DEFAULT_CHUNK_SIZE = 65536
+
+
+def array_chunks(times, prices, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Fixed size chunks of two arrays. Works on memory-mapped arrays too: only the chunk being
+    # handed out is read, and it's copied so nothing keeps the mapping's pages pinned.
+    for start in range(0, len(times), chunk_size):
+        yield (np.array(times[start:start + chunk_size], dtype=np.float64),
+               np.array(prices[start:start + chunk_size], dtype=np.float64))
+
+
+def record_chunks(history, chunk_size=DEFAULT_CHUNK_SIZE, time_key='time', price_key='price'):
+    # Chunks parsed from an iterable of history dicts, like rh_wrapper.get_crypto_history returns,
+    # chunk_size records at a time
+    history = iter(history)
+    while True:
+        records = list(itertools.islice(history, chunk_size))
+        if len(records) == 0:
+            return
+        yield history_cache.history_to_arrays(records, time_key=time_key, price_key=price_key)
+
+
+def array_source(times, prices, chunk_size=DEFAULT_CHUNK_SIZE):
+    return lambda: array_chunks(times, prices, chunk_size)
+
+
+def record_source(history, chunk_size=DEFAULT_CHUNK_SIZE):
+    # history has to be re-iterable (a list, not a generator) since the source may be read twice
+    return lambda: record_chunks(history, chunk_size)
+
+
+def cache_source(ticker, interval, since=None, chunk_size=DEFAULT_CHUNK_SIZE, cache=None):
+    # Bars straight out of the memory-mapped HistoryCache file
+    if cache is None:
+        cache = history_cache.HistoryCache()
+
+    def chunks():
+        times, prices = cache.load(ticker, interval, since)
+        return array_chunks(times, prices, chunk_size)
+    return chunks
+
+
+class StageCounters:
+    # Wall time, calls and bars per pipeline stage, to see where a replay spends its time
+    def __init__(self):
+        self.stages = []
+        self.seconds = {}
+        self.calls = {}
+        self.bars = {}
+
+    def add(self, stage, seconds, num_bars=0):
+        if stage not in self.seconds:
+            self.stages.append(stage)
+            self.seconds[stage] = 0.0
+            self.calls[stage] = 0
+            self.bars[stage] = 0
+        self.seconds[stage] += seconds
+        self.calls[stage] += 1
+        self.bars[stage] += num_bars
+
+    @contextlib.contextmanager
+    def stage(self, stage, num_bars=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, num_bars)
+
+    def timed(self, stage, chunks):
+        # Passes chunks through, counting the time spent producing each one (reading, parsing)
+        chunks = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            try:
+                times, prices = next(chunks)
+            except StopIteration:
+                return
+            self.add(stage, time.perf_counter() - start, len(times))
+            yield times, prices
+
+    def report(self):
+        total = sum(self.seconds.values())
+        print("Pipeline stages (%.3f s total):" % total)
+        for stage in self.stages:
+            seconds = self.seconds[stage]
+            share = seconds / total * 100 if total > 0 else 0.0
+            rate = self.bars[stage] / seconds if seconds > 0 else float('inf')
+            print("  %-10s %9.3f s  %5.1f%%  %8d calls  %12d bars  %12.0f bars/s"
+                  % (stage, seconds, share, self.calls[stage], self.bars[stage], rate))
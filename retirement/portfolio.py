@@ -0,0 +1,312 @@
+import sys
+import time
+import asyncio
+import argparse
+import functools
+import numpy as np
+import journal
+import metrics
+import monte_carlo
+
+from ledger import TradeLedger, COLUMNS, BUY_SIDE, SELL_SIDE
+from ring_buffer import PriceRingBuffer
+from features import FeatureStore
+from history_cache import HistoryCache
+
+
+# Portfolio mode: one process trading many tickers with many engines at once. Instead of an engine
+# object per ticker, the state lives in arrays:
+#   prices                          (tickers x ticks) in one shared PriceRingBuffer
+#   shares, invested, escape_level  (tickers x engines)
+#   cash                            (engines,), one pool per engine shared by all of its tickers
+# The engines handed in are templates. They say what to trade on (feature_signals) and how soon
+# (min_decision_samples, min_time_since_last_trade, escape_threshold), but are never fed prices
+# themselves. Every tick updates the features of all tickers together and then decides every
+# (ticker, engine) position in a handful of vectorized steps.
+#
+#   python portfolio.py BTC ETH DOGE LTC --interval hour
+
+
+class AllAvailable:
+    # how_much_to_buy's rule: everything the engine has. Tickers buying on the same tick split it.
+    def amounts(self, portfolio, buying, prices):
+        num_buying = np.maximum(buying.sum(axis=0), 1)
+        return np.where(buying, portfolio.cash / num_buying, 0.0)
+
+
+class TargetWeights:
+    # Each ticker may take up to its weight of the engine's equity (cash plus positions at current
+    # prices). weights maps ticker -> fraction, tickers left out get nothing. Defaults to an equal
+    # share for every ticker.
+    def __init__(self, weights=None):
+        self.weights = weights
+
+    def amounts(self, portfolio, buying, prices):
+        if self.weights is None:
+            weights = np.full(portfolio.num_tickers, 1.0 / portfolio.num_tickers)
+        else:
+            weights = np.array([self.weights.get(ticker, 0.0) for ticker in portfolio.tickers])
+        return np.where(buying, weights[:, None] * portfolio.equity(prices), 0.0)
+
+
+class PortfolioLedger(TradeLedger):
+    # Every position's trades in one ledger, with the ticker and engine (as indices) that made
+    # them. A tick's trades go in as one batch.
+    column_names = COLUMNS + ('ticker', 'engine')
+
+    def position(self, ticker_index, engine_index):
+        # One position's trades as a TradeLedger of its own
+        mask = (self.column('ticker') == ticker_index) & (self.column('engine') == engine_index)
+        position = TradeLedger()
+        position.extend(**{name: self.column(name)[mask] for name in COLUMNS})
+        return position
+
+    def trades_per_engine(self, num_engines):
+        return np.bincount(self.column('engine').astype(np.int64), minlength=num_engines)
+
+
+class Portfolio:
+    def __init__(self, tickers, engines, allowance=100.00, allocation=None):
+        self.tickers = list(tickers)
+        self.num_tickers = len(self.tickers)
+        self.engines = list(engines)
+        self.allocation = allocation or TargetWeights()
+        self.seed_money = allowance
+        shape = (self.num_tickers, len(self.engines))
+
+        capacity = max([2] + [engine.required_history() for engine in self.engines])
+        self.buffer = PriceRingBuffer(capacity, num_instruments=self.num_tickers)
+        self.features = FeatureStore(self.buffer)
+        for engine in self.engines:
+            for key in engine.required_features():
+                self.features.subscribe(key)
+
+        # Each engine's trading rules, one column per engine
+        self.min_samples = np.array([engine.min_decision_samples() for engine in self.engines])
+        self.min_seconds_between_trades = np.array([engine.min_time_since_last_trade * 60.0
+                                                    for engine in self.engines])
+        self.escape = np.array([np.nan if engine.escape_threshold() is None else engine.escape_threshold()
+                                for engine in self.engines], dtype=np.float64)
+
+        self.cash = np.full(len(self.engines), float(allowance))
+        self.shares = np.zeros(shape)
+        self.invested = np.zeros(shape, dtype=bool)
+        self.escape_level = np.full(shape, np.nan)  # nan never bails
+        self.buy_signal = np.zeros(shape, dtype=bool)
+        self.sell_signal = np.zeros(shape, dtype=bool)
+        self.num_ticks = 0
+        self.time_of_last_trade = None
+        self.last_prices = None
+
+        self.trades = PortfolioLedger()
+        self.journal = journal.Journal(verbosity=journal.OFF)
+        self.metrics = None
+
+        # Newest live quote per ticker, see subscribe
+        self.live_prices = np.full(self.num_tickers, np.nan)
+        self.live_fresh = np.zeros(self.num_tickers, dtype=bool)
+        self.live_time = 0.0
+
+    def position_name(self, ticker_index, engine_index):
+        return self.tickers[ticker_index] + ' ' + self.engines[engine_index].name
+
+    def enable_metrics(self, registry=None):
+        # Same idea as Manager.enable_metrics, for the whole portfolio's tick
+        self.metrics = registry or metrics.Metrics()
+        self.process_tick = metrics.timed_call(self.process_tick,
+                                               self.metrics.histogram('portfolio_tick_seconds'))
+        self.metrics.add_collector(self.collect_metrics)
+        return self.metrics
+
+    def collect_metrics(self, registry):
+        registry.set_gauge('portfolio_ticks', self.num_ticks)
+        for column, engine in enumerate(self.engines):
+            registry.set_gauge('portfolio_cash', self.cash[column], engine=engine.name)
+            registry.set_gauge('portfolio_positions', int(self.invested[:, column].sum()), engine=engine.name)
+
+    def equity(self, prices=None):
+        # Cash plus every open position at prices (the latest tick's by default), per engine
+        if prices is None:
+            prices = self.last_prices
+        if prices is None:
+            return self.cash.copy()
+        return self.cash + (self.shares * prices[:, None]).sum(axis=0)
+
+    def process_tick(self, prices, time_of_prices):
+        # One tick of every ticker end to end, prices in self.tickers order. The per-ticker engine
+        # rules (should_buy/should_sell, can_trade, the emergency escape) applied to every position
+        # at once. Returns the (tickers x engines) masks of positions bought and sold.
+        prices = np.asarray(prices, dtype=np.float64)
+        if self.num_ticks == 0:
+            # Same as an engine's first sample: counts as the time of the last trade
+            self.time_of_last_trade = time_of_prices
+        self.buffer.append(time_of_prices, prices)
+        self.features.update()
+        self.num_ticks += 1
+        self.last_prices = prices
+
+        for column, engine in enumerate(self.engines):
+            self.buy_signal[:, column], self.sell_signal[:, column] = engine.feature_signals(self.features)
+
+        ready = self.num_ticks >= self.min_samples
+        can_trade = ready & (time_of_prices - self.time_of_last_trade >= self.min_seconds_between_trades)
+        bailing = prices[:, None] <= self.escape_level
+        selling = self.invested & ((self.sell_signal & can_trade) | (bailing & ready))
+        buying = ~self.invested & self.buy_signal & can_trade
+
+        # Sales first, so their proceeds are in the pool for this tick's buys
+        if selling.any():
+            self.sell(selling, prices, time_of_prices)
+        if buying.any():
+            buying = self.buy(buying, prices, time_of_prices)
+        return buying, selling
+
+    def buy(self, buying, prices, time_of_prices):
+        amounts = self.allocation.amounts(self, buying, prices)
+
+        # Never spend more than an engine has: scale its buys down together to fit
+        totals = amounts.sum(axis=0)
+        over = totals > self.cash
+        if over.any():
+            amounts[:, over] *= self.cash[over] / totals[over]
+        buying = buying & (amounts > 0)
+
+        shares = amounts / prices[:, None]
+        self.cash = np.maximum(self.cash - amounts.sum(axis=0), 0.0)
+        self.shares += shares
+        self.invested |= buying
+        self.escape_level = np.where(buying, prices[:, None] * self.escape, self.escape_level)
+
+        self.record(buying, BUY_SIDE, journal.BUY, time_of_prices, prices, shares, amounts)
+        return buying
+
+    def sell(self, selling, prices, time_of_prices):
+        amounts = np.where(selling, self.shares * prices[:, None], 0.0)
+        shares = np.where(selling, self.shares, 0.0)
+        self.cash = self.cash + amounts.sum(axis=0)
+        self.shares -= shares
+        self.invested &= ~selling
+        self.escape_level[selling] = np.nan
+
+        self.record(selling, SELL_SIDE, journal.SELL, time_of_prices, prices, shares, amounts)
+
+    def record(self, trading, side, kind, time_of_trade, prices, shares, amounts):
+        ticker_indices, engine_indices = np.nonzero(trading)
+        if len(ticker_indices) == 0:
+            return
+        self.trades.extend(time=time_of_trade, price=prices[ticker_indices], shares=shares[trading], side=side,
+                           amount=amounts[trading], cash=self.cash[engine_indices], ticker=ticker_indices,
+                           engine=engine_indices)
+        if self.journal.verbosity >= journal.TRADES:
+            for ticker_index, engine_index in zip(ticker_indices.tolist(), engine_indices.tolist()):
+                self.journal.trade(self.position_name(ticker_index, engine_index), kind, time_of_trade,
+                                   prices[ticker_index], shares[ticker_index, engine_index],
+                                   amounts[ticker_index, engine_index])
+
+    def replay(self, prices, times):
+        # Tick by tick over a (tickers x bars) history, exactly as the live loop would see it
+        prices = np.asarray(prices, dtype=np.float64)
+        times = np.asarray(times, dtype=np.float64)
+        for bar in range(len(times)):
+            self.process_tick(prices[:, bar], times[bar])
+
+    def subscribe(self, feed):
+        # Live quotes arrive one ticker at a time. Each ticker's newest price is kept, and once every
+        # ticker has reported since the last tick, all of them are processed as the next one.
+        for ticker_index, ticker in enumerate(self.tickers):
+            feed.subscribe(ticker, functools.partial(self.handle_sample, ticker_index))
+
+    def handle_sample(self, ticker_index, price, time_of_price):
+        self.live_prices[ticker_index] = price
+        self.live_fresh[ticker_index] = True
+        self.live_time = max(self.live_time, time_of_price)
+        if self.live_fresh.all():
+            self.live_fresh[:] = False
+            self.process_tick(self.live_prices.copy(), self.live_time)
+            self.journal.flush()
+
+    def close(self):
+        # Liquidate every open position at the latest prices, like QuantEngine.close
+        if self.last_prices is not None and self.invested.any():
+            self.sell(self.invested.copy(), self.last_prices, float(self.buffer.latest_times(1)[0]))
+        self.journal.close()
+        self.report()
+
+    def report(self):
+        print("Portfolio of ", self.num_tickers, " tickers over ", self.num_ticks, " ticks:")
+        equity = self.equity()
+        trades_per_engine = self.trades.trades_per_engine(len(self.engines))
+        for column in np.argsort(-equity, kind='stable'):
+            num_trades = trades_per_engine[column]
+            print("%-45s Start: %9.2f  End: %9.2f  (%.2f%%)  Trades: %d  Open: %d"
+                  % (self.engines[column].name, self.seed_money, equity[column],
+                     (equity[column] - self.seed_money) / self.seed_money * 100, num_trades,
+                     int(self.invested[:, column].sum())))
+
+
+def align_histories(histories):
+    # (times, prices) for the bars every ticker has, prices as a (tickers x bars) array
+    times = functools.reduce(np.intersect1d, [np.asarray(history[0], dtype=np.float64) for history in histories])
+    prices = np.empty((len(histories), len(times)))
+    for row, (ticker_times, ticker_prices) in enumerate(histories):
+        prices[row] = np.asarray(ticker_prices, dtype=np.float64)[np.searchsorted(ticker_times, times)]
+    return times, prices
+
+
+def make_allocation(name):
+    if name == 'weights':
+        return TargetWeights()
+    if name == 'all':
+        return AllAvailable()
+    raise Exception("unknown allocation: " + name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Trade many tickers at once with every engine')
+    parser.add_argument('tickers', nargs='+')
+    parser.add_argument('--interval', default='hour')
+    parser.add_argument('--allowance', type=float, default=100.0)
+    parser.add_argument('--allocation', default='weights', choices=['weights', 'all'])
+    parser.add_argument('--live', action='store_true', help='keep trading on live quotes after the replay')
+    parser.add_argument('--update-interval', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    if args.live:
+        # Only a live run needs the brokerage
+        import rh_wrapper as rh
+        rh.rh_login()
+        histories = [rh.get_cached_crypto_history(ticker, interval=args.interval) for ticker in args.tickers]
+    else:
+        cache = HistoryCache()
+        histories = [cache.load(ticker, args.interval) for ticker in args.tickers]
+    times, prices = align_histories(histories)
+    print("Replaying ", len(times), " bars every ticker has in common")
+
+    portfolio = Portfolio(args.tickers, monte_carlo.default_engines(), args.allowance,
+                          make_allocation(args.allocation))
+    registry = portfolio.enable_metrics()
+    start = time.perf_counter()
+    portfolio.replay(prices, times)
+    tick_seconds = registry.histogram('portfolio_tick_seconds')
+    print("Replayed in %.2f s, per tick decision latency p50 <= %.0f us, p99 <= %.0f us"
+          % (time.perf_counter() - start, (tick_seconds.quantile(0.5) or 0) * 1e6,
+             (tick_seconds.quantile(0.99) or 0) * 1e6))
+
+    if args.live:
+        import live_feed
+        portfolio.journal = journal.Journal(verbosity=journal.TRADES, echo=True)
+        feed = live_feed.LiveFeed(live_feed.BatchedQuoteSource(rh.get_crypto_prices), args.tickers,
+                                  interval=args.update_interval, clock=rh.now, metrics=registry)
+        portfolio.subscribe(feed)
+        try:
+            asyncio.run(feed.run())
+        except KeyboardInterrupt:
+            pass
+        feed.report()
+
+    portfolio.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
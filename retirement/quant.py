@@ -1,22 +1,61 @@
 import time
 import numpy as np
 import datetime as dt
+import market_calendar
+import journal
+import metrics
+
+from ledger import TradeLedger, BUY_SIDE, SELL_SIDE
 
 
 class EventPoint:
+    __slots__ = ('price', 'time_of_event', 'is_sale')
+
     def __init__(self, price, time_of_event, is_sale=False):
         self.price = price
         self.time_of_event = time_of_event
         self.is_sale = is_sale
 
+class LazyDerivData(dict):
+    # Plot view of an engine's history. Nothing is stored: 'x'/'y' are whatever history the engine
+    # currently holds, and 'x_p'/'y_p' are only materialized when something actually asks for them
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+
+    def __missing__(self, key):
+        if key == 'x':
+            return self.engine.times
+        if key == 'y':
+            return self.engine.prices
+        if key == 'y_p':
+            return self.engine.materialize_derivs()
+        if key == 'x_p':
+            return self.engine.materialize_deriv_times()
+        raise KeyError(key)
+
+
 class QuantEngine:
+    # What checkpoint_state saves. Prices aren't part of it: they come back through the Manager's
+    # buffer, and the trades through the ledger.
+    checkpoint_attributes = ('name', 'seed_money', 'funds_available', 'shares_owned', 'invested',
+                             'last_purchase_price', 'max_fund_value', 'min_fund_value', 'min_samples',
+                             'min_time_since_last_trade', 'time_of_last_trade', 'emer_escape_threshold',
+                             'num_samples')
+
     def __init__(self, allowance=100.00, is_mock=True):
         self.is_mock = is_mock
+        # When set, price history is read from a shared PriceRingBuffer instead of our own lists
+        self.buffer = None
+        self.retention = None
+        self.num_samples = 0
+        self.signal_offset = 0  # bars seen before the ones compute_signals is looking at
         self.funds_available = allowance
         self.seed_money = allowance
         self.min_samples = 60  # minimum number of samples required to initiate trade
         self.min_time_since_last_trade = 1  # measured in minutes
-        self.time_of_last_trade = time.time()
+        self.clock = time.time  # what "now" is for the live checks, e.g. rh_wrapper.now when replaying
+        self.time_of_last_trade = self.clock()
         self.prices = []
         self.times = []
         self.data = {'x': [], 'y': [], 'x_p': [], 'y_p': []}
@@ -26,54 +65,180 @@ class QuantEngine:
         self.last_purchase_price = None  # Don't set until you buy
         self.max_fund_value = allowance
         self.min_fund_value = allowance
-        self.event_points = []
+        self.ledger = TradeLedger()
         self.name = "Unnamed"
+        # Market open/close windows, precomputed and shared by every engine
+        self.calendar = market_calendar.local_calendar()
+        # When set, per-tick features come from a FeatureStore shared with other engines
+        self.features = None
+        # Where trades and decisions get recorded (see journal.Journal)
+        self.journal = journal.default_journal()
+        # When set, live buys and sells become orders at the brokerage (see orders.OrderRouter) and
+        # only count once they fill. Backtests always fill at the bar's price.
+        self.orders = None
+        self.pending_order = None  # the order intent we're waiting on, if any
+
+    @property
+    def event_points(self):
+        # Trades as EventPoint objects, built from the ledger for code that still wants them
+        return [EventPoint(price=amount, time_of_event=time_of_trade, is_sale=is_sale)
+                for time_of_trade, amount, is_sale in zip(self.ledger.times().tolist(),
+                                                          self.ledger.values().tolist(),
+                                                          self.ledger.is_sale().tolist())]
+
+    @property
+    def prices(self):
+        if self.buffer is None:
+            return self.own_prices
+        return self.buffer.latest_prices(self.retention)
+
+    @prices.setter
+    def prices(self, prices):
+        self.own_prices = prices
+
+    @property
+    def times(self):
+        if self.buffer is None:
+            return self.own_times
+        return self.buffer.latest_times(self.retention)
+
+    @times.setter
+    def times(self, times):
+        self.own_times = times
+
+    def required_history(self):
+        # How many of the newest samples this engine needs to make its decisions
+        return self.min_samples
+
+    def attach_buffer(self, buffer, retention=None):
+        # Read prices/times as zero-copy views of the newest `retention` samples of a shared buffer.
+        # The owner of the buffer appends each sample once, before calling update_model.
+        if retention is None:
+            retention = self.required_history()
+        if retention > buffer.capacity:
+            raise Exception("buffer too small for engine " + self.name)
+        self.retention = retention
+        self.buffer = buffer
+
+        # Our own copies are dead weight from here on
+        self.own_prices = []
+        self.own_times = []
+
+    def required_features(self):
+        # FeatureStore keys this engine reads each tick
+        return []
+
+    def attach_features(self, features):
+        # Read per-tick features from a shared FeatureStore instead of computing them ourselves. The
+        # store's owner updates it once per tick, before calling update_model.
+        for key in self.required_features():
+            features.subscribe(key)
+        self.features = features
+
+    def instrument(self, registry, **labels):
+        # Time every update_model/should_buy/should_sell call into per-engine histograms. The timed
+        # versions shadow the methods on this instance only; engines nobody instruments are untouched.
+        for method_name in ('update_model', 'should_buy', 'should_sell'):
+            histogram = registry.histogram('engine_' + method_name + '_seconds', engine=self.name, **labels)
+            setattr(self, method_name, metrics.timed_call(getattr(self, method_name), histogram))
+
+    def checkpoint_state(self):
+        # This engine's state as plain values, enough to pick up where it left off (see checkpoint.py)
+        state = {}
+        for attribute in self.checkpoint_attributes:
+            value = getattr(self, attribute)
+            state[attribute] = value.tolist() if isinstance(value, np.generic) else value
+        # An order still out at the brokerage is picked up again once the engine is routed (see
+        # orders.OrderRouter.register)
+        state['pending_order'] = None
+        if self.pending_order is not None:
+            state['pending_order'] = self.pending_order.checkpoint_state()
+        return state
+
+    def restore_checkpoint_state(self, state):
+        for attribute in self.checkpoint_attributes:
+            setattr(self, attribute, state[attribute])
+        if state.get('pending_order') is not None:
+            import orders  # only engines that were trading live have one
+            self.pending_order = orders.OrderIntent.from_checkpoint(self, state['pending_order'])
+
+    def record_sample(self, price, time_of_price):
+        if self.num_samples == 0:
+            # First data entry. Set as time of first trade
+            self.time_of_last_trade = time_of_price
+        self.num_samples += 1
+
+        if self.buffer is None:
+            self.own_prices.append(price)
+            self.own_times.append(time_of_price)
 
     def should_buy(self):
         # This needs to be overridden by child
         raise Exception("not implemented")
 
     def buy(self):
+        if self.pending_order is not None:
+            self.journal.decision(self.name, journal.ORDER_PENDING, self.times[-1], self.prices[-1])
+            return
+
         if self.invested:
-            print("ERROR: trying to buy when you already bought")
+            self.journal.decision(self.name, journal.ALREADY_INVESTED)
+            return
+
+        if self.orders is not None:
+            self.pending_order = self.orders.submit(self, BUY_SIDE, self.prices[-1], self.times[-1],
+                                                    amount=self.how_much_to_buy())
             return
 
+        self.buy_at(self.prices[-1], self.times[-1])
+
+    def buy_at(self, price, time_of_price):
         amount_to_buy_in_dollars = self.how_much_to_buy()
+        self.fill_buy(price, time_of_price, amount_to_buy_in_dollars/price, amount_to_buy_in_dollars)
+
+    def fill_buy(self, price, time_of_price, shares, amount_to_buy_in_dollars):
+        # A purchase of shares for amount_to_buy_in_dollars, price being what they went for on average
         self.update_funds_available(amount_to_buy_in_dollars*-1)
-        shares = amount_to_buy_in_dollars/(self.prices[-1])
         self.update_shares_owned(shares)
         self.invested = True
-        self.last_purchase_price = self.prices[-1]
+        self.last_purchase_price = price
 
-        print("Buying ", shares, " shares at ", self.prices[-1], " for $", amount_to_buy_in_dollars)
-
-        event = EventPoint(price=amount_to_buy_in_dollars,
-                           time_of_event=self.times[-1],
-                           is_sale=False)
-        self.event_points.append(event)
+        self.journal.trade(self.name, journal.BUY, time_of_price, price, shares, amount_to_buy_in_dollars)
+        self.ledger.append(time_of_price, price, shares, BUY_SIDE, amount_to_buy_in_dollars, self.funds_available)
 
     def sell(self):
+        if self.pending_order is not None:
+            self.journal.decision(self.name, journal.ORDER_PENDING, self.times[-1], self.prices[-1])
+            return
+
         if not self.invested:
-            print("ERROR: trying to sell when you ain't got none")
+            self.journal.decision(self.name, journal.NOT_INVESTED)
+            return
+
+        if self.orders is not None:
+            self.pending_order = self.orders.submit(self, SELL_SIDE, self.prices[-1], self.times[-1],
+                                                    shares=self.shares_owned)
             return
 
-        amount_to_sell_in_dollars = self.shares_owned * self.prices[-1]
+        self.sell_at(self.prices[-1], self.times[-1])
+
+    def sell_at(self, price, time_of_price):
+        self.fill_sell(price, time_of_price, self.shares_owned, self.shares_owned * price)
+
+    def fill_sell(self, price, time_of_price, shares_sold, amount_to_sell_in_dollars):
+        # Still invested after a partial fill, with whatever shares are left
         self.update_funds_available(amount_to_sell_in_dollars)
-        shares_sold = self.shares_owned
-        self.update_shares_owned(self.shares_owned*-1)
-        self.invested = False
+        self.update_shares_owned(shares_sold*-1)
+        self.invested = self.shares_owned > 0
 
         if amount_to_sell_in_dollars > self.max_fund_value:
             self.max_fund_value = amount_to_sell_in_dollars
         if amount_to_sell_in_dollars < self.min_fund_value:
             self.min_fund_value = amount_to_sell_in_dollars
 
-        print("Sold ", shares_sold, " shares at ", self.prices[-1], " for $", amount_to_sell_in_dollars)
-
-        event = EventPoint(price=amount_to_sell_in_dollars,
-                           time_of_event=self.times[-1],
-                           is_sale=True)
-        self.event_points.append(event)
+        self.journal.trade(self.name, journal.SELL, time_of_price, price, shares_sold, amount_to_sell_in_dollars)
+        self.ledger.append(time_of_price, price, shares_sold, SELL_SIDE, amount_to_sell_in_dollars,
+                           self.funds_available)
 
     def should_sell(self):
         # This needs to be overridden by child
@@ -82,18 +247,139 @@ class QuantEngine:
     def can_trade(self):
         # First make sure we have enough samples to decide
         if len(self.prices) < self.min_samples:
-            msg = "Not enough samples to trade - num samples: " + len(self.prices)
+            msg = "Not enough samples to trade - num samples: " + str(len(self.prices))
             return msg
 
         # Next make sure that enough time has passed since the last trade
-        time_now = time.time()
-        elapsed_time_min = (time_now - self.time_of_last_trade)/60.0
+        elapsed_time_min = self.minutes_since_last_trade()
         if elapsed_time_min < self.min_time_since_last_trade:
-            msg = "Not enough time since last trade - time elapsed: " + elapsed_time_min
+            msg = "Not enough time since last trade - time elapsed: " + str(elapsed_time_min)
             return msg
 
         return ""
 
+    def record_blocked(self, buying):
+        # Journals a wanted trade that can_trade held back, under whichever limit held it
+        if len(self.prices) < self.min_samples:
+            code = journal.BUY_TOO_FEW_SAMPLES if buying else journal.SELL_TOO_FEW_SAMPLES
+        else:
+            code = journal.BUY_TOO_SOON if buying else journal.SELL_TOO_SOON
+        self.journal.decision(self.name, code, self.times[-1], self.prices[-1])
+
+    def minutes_since_last_trade(self):
+        time_now = self.clock()
+        return (time_now - self.time_of_last_trade)/60.0
+
+    def backtest(self, prices, times):
+        # Whole-series equivalent of calling update_model/should_buy/should_sell/buy/sell per bar.
+        # Signals are computed for every bar at once and the buy/sell state machine then only
+        # visits the bars where a trade actually happens.
+        if self.num_samples != 0:
+            raise Exception("backtest needs an engine without any history")
+        return self.backtest_chunk(prices, times)
+
+    def backtest_chunk(self, prices, times):
+        # Continues a backtest with the next bars of the series. Backtesting a series chunk by chunk
+        # gives the same trades as one backtest over all of it. Whatever the signals need to look
+        # back on comes from self.prices, so a shared buffer must only get the chunk afterwards.
+        prices = np.asarray(prices, dtype=np.float64)
+        times = np.asarray(times, dtype=np.float64)
+        num_samples = len(prices)
+        if num_samples == 0:
+            return self.ledger
+
+        if self.num_samples == 0:
+            # First data entry. Set as time of first trade
+            self.time_of_last_trade = times[0]
+
+        num_context = min(self.signal_lookback(), self.num_samples)
+        if num_context > 0:
+            context_prices = np.concatenate([np.asarray(self.prices[-num_context:], dtype=np.float64), prices])
+            context_times = np.concatenate([np.asarray(self.times[-num_context:], dtype=np.float64), times])
+        else:
+            context_prices, context_times = prices, times
+        self.signal_offset = self.num_samples - num_context
+        buy_signal, sell_signal = self.compute_signals(context_prices, context_times)
+        self.signal_offset = 0
+        buy_indices = np.flatnonzero(buy_signal[num_context:])
+        sell_indices = np.flatnonzero(sell_signal[num_context:])
+
+        i = 0
+        while True:
+            if not self.invested:
+                # Next bar at or after i where we'd buy
+                k = buy_indices.searchsorted(i)
+                if k == len(buy_indices):
+                    break
+                buy_index = buy_indices[k]
+                self.buy_at(prices[buy_index], times[buy_index])
+                i = buy_index + 1
+
+            # Next bar at or after i (so strictly after the purchase) where we'd sell
+            k = sell_indices.searchsorted(i)
+            sell_index = sell_indices[k] if k < len(sell_indices) else num_samples
+            sell_index = self.emergency_escape_index(prices, i, sell_index)
+            if sell_index >= num_samples:
+                break
+            self.sell_at(prices[sell_index], times[sell_index])
+            i = sell_index + 1
+
+        self.load_history(prices, times)
+        return self.ledger
+
+    def signal_lookback(self):
+        # How many bars before a chunk compute_signals needs to get the chunk's signals right
+        return 0
+
+    def compute_signals(self, prices, times):
+        # Returns (buy_signal, sell_signal) boolean arrays, one entry per bar. A True entry means
+        # should_buy/should_sell would say yes on that bar (given we're out/in the market). prices
+        # may also be a 2-D array of price paths over the same times, one path per row; the signals
+        # then come back in that shape.
+        raise Exception("not implemented")
+
+    def feature_signals(self, features):
+        # (buy_signal, sell_signal) for the newest tick, from a FeatureStore's values. Over a
+        # multi-instrument store these are arrays with one entry per instrument (see portfolio.py).
+        # Only the market conditions: readiness, trade timing and the emergency escape are left to
+        # the caller, see min_decision_samples and escape_threshold.
+        raise Exception("not implemented")
+
+    def min_decision_samples(self):
+        # Samples needed before should_buy/should_sell can say yes
+        return max(self.min_samples, self.signal_lookback() + 1)
+
+    def emergency_escape_index(self, prices, start, stop):
+        # First bar in [start, stop) that would trigger emergency_escape_bail, or stop if none would
+        if self.escape_threshold() is None:
+            return stop
+        return self.first_bail_index(prices, start, stop)
+
+    def escape_threshold(self):
+        # Fraction of the purchase price at which backtests bail out of a position. Engines that
+        # bail on losses override this; None means no early exit.
+        return None
+
+    def first_bail_index(self, prices, start, stop):
+        # Vectorized emergency_escape_bail over prices[start:stop]
+        bail = prices[start:stop] <= self.last_purchase_price * self.emer_escape_threshold
+        if bail.any():
+            return start + int(np.argmax(bail))
+        return stop
+
+    def ready_mask(self, num_samples, min_len=1):
+        # True for bars where the engine has collected enough samples to make a decision. Counts
+        # from signal_offset when the bars continue an earlier chunk.
+        sample_counts = np.arange(self.signal_offset + 1, self.signal_offset + num_samples + 1)
+        return sample_counts >= max(self.min_samples, min_len)
+
+    def load_history(self, prices, times):
+        # Bring the per-tick state in line with a finished backtest so live updates can carry on
+        self.num_samples += len(prices)
+        if self.buffer is None:
+            self.own_prices.extend(prices.tolist())
+            self.own_times.extend(times.tolist())
+
     def how_much_to_buy(self):
         # Get amount to buy. Probably all available.
         return self.funds_available
@@ -117,7 +403,7 @@ class QuantEngine:
 
     def emergency_escape_bail(self, current_price):
         if not self.last_purchase_price:
-            print("ERROR: last purchase price not initialized")
+            self.journal.decision(self.name, journal.NO_PURCHASE_PRICE)
             return False
         if current_price <= self.last_purchase_price * self.emer_escape_threshold:
             return True
@@ -131,19 +417,23 @@ class QuantEngine:
             return start_time <= datetime_object <= end_time
         else:
             # Over midnight:
-            return now_time >= start_time or now_time <= end_time
+            return datetime_object >= start_time or datetime_object <= end_time
 
     def markets_just_closed(self):
-        return self.is_time_in_window(dt.time(16, 00),
-                                      dt.time(16, 30),
-                                      self.times[-1])
+        if self.features is not None:
+            return self.features.latest(('window', 'just_closed'))
+        return self.calendar.in_window('just_closed', self.times[-1])
 
     def markets_just_opened(self):
-        return self.is_time_in_window(dt.time(8, 00),
-                                      dt.time(8, 30),
-                                      self.times[-1])
+        if self.features is not None:
+            return self.features.latest(('window', 'just_opened'))
+        return self.calendar.in_window('just_opened', self.times[-1])
 
     def close(self):
+        # Values whatever is still held at the last price, as a sale. Live orders have stopped by
+        # now (see retirement.run_live), so this one is simulated rather than sent to a router that
+        # would turn it down.
+        self.orders = None
         self.sell()
         self.exit_report()
 
@@ -152,19 +442,59 @@ class QuantEngine:
               " Start: ",  self.seed_money,
               " End: ", self.funds_available,
               " Min: ", self.min_fund_value,
-              " Max: ", self.max_fund_value)
+              " Max: ", self.max_fund_value,
+              " Trades: ", self.ledger.num_trades(),
+              " Max drawdown: ", "%.2f" % (self.ledger.max_drawdown()*100), "%",
+              " Win rate: ", "%.2f" % (self.ledger.win_rate()*100), "%")
 
 
 class IthDerivBasedQuantEngine(QuantEngine):
-    def __init__(self, deriv_dim=1, buy_threshold=0.01, sell_threshold=0):
+    checkpoint_attributes = QuantEngine.checkpoint_attributes + ('deriv_dim', 'buy_threshold', 'sell_threshold',
+                                                                 'diff_state', 'latest_deriv')
+
+    def __init__(self, deriv_dim=1, buy_threshold=0.01, sell_threshold=0, emer_escape_threshold=None):
         super().__init__()
         self.deriv_dim = deriv_dim
         self.buy_threshold = buy_threshold  # No idea if this is right or not
         self.sell_threshold = sell_threshold  # No idea if this is right or not
+        # None leaves the emergency escape off, which is how these engines have always traded
+        self.emer_escape_threshold = emer_escape_threshold
         self.name = str(self.deriv_dim) + 'thDeriv_buy:' + "%.2f" % buy_threshold + ',sell:' + "%.2f" % sell_threshold
 
+        # Rolling finite difference state. diff_state[i] holds the most recent ith order difference,
+        # so each tick only touches deriv_dim values instead of re-diffing the whole history
+        self.diff_state = []
+        self.latest_deriv = None
+        self.data = LazyDerivData(self)
+
+    def checkpoint_state(self):
+        if self.features is not None:
+            # Trading off a shared FeatureStore leaves our own difference chain where it was when the
+            # store was attached, so bring it up to date from the latest prices first
+            self.rebuild_diffs(self.prices[-(self.deriv_dim + 1):])
+        state = super().checkpoint_state()
+        state['diff_state'] = list(self.diff_state)  # advance_diffs updates it in place
+        return state
+
+    def required_history(self):
+        return self.min_samples + self.deriv_dim
+
+    def signal_lookback(self):
+        return self.deriv_dim
+
+    def required_features(self):
+        return [('diff', self.deriv_dim)]
+
+    def current_deriv(self):
+        if self.features is not None:
+            return self.features.latest(('diff', self.deriv_dim))
+        return self.latest_deriv
+
+    def has_deriv(self):
+        return self.current_deriv() is not None and len(self.prices) >= self.min_samples
+
     def should_buy(self):
-        if len(self.data['y_p']) < 1:
+        if not self.has_deriv():
             return False
 
         if self.invested:
@@ -172,9 +502,9 @@ class IthDerivBasedQuantEngine(QuantEngine):
 
         trade_err_msg = self.can_trade()
 
-        if self.data['y_p'][-1] >= self.buy_threshold:
+        if self.current_deriv() >= self.buy_threshold:
             if trade_err_msg != "":
-                print("Want to buy, but can't because: ", trade_err_msg)
+                self.record_blocked(buying=True)
                 return False
             else:
                 return True
@@ -182,7 +512,7 @@ class IthDerivBasedQuantEngine(QuantEngine):
         return False
 
     def should_sell(self):
-        if len(self.data['y_p']) < 1:
+        if not self.has_deriv():
             return False
 
         if not self.invested:
@@ -190,9 +520,12 @@ class IthDerivBasedQuantEngine(QuantEngine):
 
         trade_err_msg = self.can_trade()
 
-        if self.data['y_p'][-1] <= self.sell_threshold:
+        if self.emer_escape_threshold is not None and self.emergency_escape_bail(self.prices[-1]):
+            self.journal.decision(self.name, journal.EMERGENCY_SALE, self.times[-1], self.prices[-1])
+            return True
+        elif self.current_deriv() <= self.sell_threshold:
             if trade_err_msg != "":
-                print("Want to sell, but can't because: ", trade_err_msg)
+                self.record_blocked(buying=False)
                 return False
             else:
                 return True
@@ -200,34 +533,84 @@ class IthDerivBasedQuantEngine(QuantEngine):
         return False
 
     def update_model(self, price, time_of_price):
-        if len(self.times) == 0:
-            # First data entry. Set as time of first trade
-            self.time_of_last_trade = time_of_price
-
-        self.prices.append(price)
-        self.times.append(time_of_price)
-
-        if len(self.prices) >= self.min_samples:
-            self.data = {
-                'x': self.times,
-                'y': self.prices
-            }
-            # self.data['y_p'] = list(np.diff(self.data['y']) / np.diff(self.data['x']))
-            # self.data['x_p'] = list((np.array(self.data['x'])[:-1] + np.array(self.data['x'])[1:]) / 2)
-
-            self.data['y_p'] = list(np.diff(self.data['y'], self.deriv_dim))
+        self.record_sample(price, time_of_price)
+
+        # With a shared FeatureStore the differences are already advanced for us
+        if self.features is None:
+            self.advance_diffs(price)
+
+    def advance_diffs(self, price):
+        # Walk the new price down through each difference order. Same operation order as np.diff
+        # so the result matches np.diff(prices, deriv_dim)[-1] exactly
+        value = price
+        for order in range(len(self.diff_state)):
+            prev_value = self.diff_state[order]
+            self.diff_state[order] = value
+            value = value - prev_value
+
+        if len(self.diff_state) < self.deriv_dim:
+            self.diff_state.append(value)
+        else:
+            self.latest_deriv = value
+
+    def compute_signals(self, prices, times):
+        num_samples = prices.shape[-1]
+        buy_signal = np.zeros(prices.shape, dtype=bool)
+        sell_signal = np.zeros(prices.shape, dtype=bool)
+        if num_samples <= self.deriv_dim or self.minutes_since_last_trade() < self.min_time_since_last_trade:
+            return buy_signal, sell_signal
+
+        derivs = np.diff(prices, self.deriv_dim)
+        buy_signal[..., self.deriv_dim:] = derivs >= self.buy_threshold
+        sell_signal[..., self.deriv_dim:] = derivs <= self.sell_threshold
+
+        ready = self.ready_mask(num_samples)
+        return buy_signal & ready, sell_signal & ready
+
+    def feature_signals(self, features):
+        derivs = features.latest(('diff', self.deriv_dim))
+        if derivs is None:
+            return False, False
+        return derivs >= self.buy_threshold, derivs <= self.sell_threshold
+
+    def escape_threshold(self):
+        return self.emer_escape_threshold
+
+    def load_history(self, prices, times):
+        super().load_history(prices, times)
+
+        self.rebuild_diffs(prices[-(self.deriv_dim + 1):])
+
+    def rebuild_diffs(self, prices):
+        # The latest ith difference only depends on the last deriv_dim + 1 prices. Fewer than that
+        # just carry on from the state the previous ones left.
+        if len(prices) > self.deriv_dim:
+            self.diff_state = []
+            self.latest_deriv = None
+        for price in np.asarray(prices, dtype=np.float64).tolist():
+            self.advance_diffs(price)
+
+    def materialize_derivs(self):
+        # Full derivative series - O(n), only meant for plotting
+        if len(self.prices) < self.min_samples:
+            return []
+        return list(np.diff(self.prices, self.deriv_dim))
 
-            # Need to normalize derivative with respect to time units
-            self.data['x_p'] = self.times[:-self.deriv_dim]
+    def materialize_deriv_times(self):
+        # Need to normalize derivative with respect to time units
+        if len(self.prices) < self.min_samples:
+            return []
+        return self.times[:-self.deriv_dim]
 
 
 class TimeBasedQuantEngine(QuantEngine):
     def __init__(self):
         super().__init__()
         self.name = 'TimeBasedQuantEngine'
+        self.data = LazyDerivData(self)
 
     def should_buy(self):
-        if len(self.data['y_p']) < 1:
+        if not self.has_history():
             return False
 
         if self.invested:
@@ -237,7 +620,7 @@ class TimeBasedQuantEngine(QuantEngine):
 
         if self.markets_just_closed():
             if trade_err_msg != "":
-                print("Want to buy, but can't because: ", trade_err_msg)
+                self.record_blocked(buying=True)
                 return False
             else:
                 return True
@@ -245,7 +628,7 @@ class TimeBasedQuantEngine(QuantEngine):
         return False
 
     def should_sell(self):
-        if len(self.data['y_p']) < 1:
+        if not self.has_history():
             return False
 
         if not self.invested:
@@ -254,39 +637,70 @@ class TimeBasedQuantEngine(QuantEngine):
         trade_err_msg = self.can_trade()
 
         if self.emergency_escape_bail(self.prices[-1]):
-            print("Initiating sale for emergency escape")
+            self.journal.decision(self.name, journal.EMERGENCY_SALE, self.times[-1], self.prices[-1])
             return True
         elif self.markets_just_opened():
             if trade_err_msg != "":
-                print("Want to sell, but can't because: ", trade_err_msg)
+                self.record_blocked(buying=False)
                 return False
             else:
-                print("Initiating sale for market open")
+                self.journal.decision(self.name, journal.MARKET_OPEN_SALE, self.times[-1], self.prices[-1])
                 return True
 
         return False
 
     def update_model(self, price, time_of_price):
-        if len(self.times) == 0:
-            # First data entry. Set as time of first trade
-            self.time_of_last_trade = time_of_price
+        self.record_sample(price, time_of_price)
+
+    def required_history(self):
+        return max(self.min_samples, 2)
+
+    def required_features(self):
+        return [('window', 'just_closed'), ('window', 'just_opened')]
+
+    def has_history(self):
+        # Same point at which the time derivative in data['y_p'] becomes available
+        return len(self.prices) >= self.required_history()
+
+    def materialize_derivs(self):
+        if len(self.prices) < self.min_samples:
+            return []
+        return list(np.diff(self.prices) / np.diff(self.times))
+
+    def materialize_deriv_times(self):
+        if len(self.prices) < self.min_samples:
+            return []
+        return list((np.array(self.times)[:-1] + np.array(self.times)[1:]) / 2)
+
+    def compute_signals(self, prices, times):
+        num_samples = prices.shape[-1]
+        ready = self.ready_mask(num_samples, min_len=2)
+        if self.minutes_since_last_trade() < self.min_time_since_last_trade:
+            # can_trade would block every buy, so there's never anything to escape from either
+            no_signal = np.zeros(prices.shape, dtype=bool)
+            return no_signal, no_signal
 
-        self.prices.append(price)
-        self.times.append(time_of_price)
+        # Only depends on the times, so every path gets the same signals
+        buy_signal = ready & self.calendar.window_mask('just_closed', times)
+        sell_signal = ready & self.calendar.window_mask('just_opened', times)
+        return np.broadcast_to(buy_signal, prices.shape), np.broadcast_to(sell_signal, prices.shape)
 
-        if len(self.prices) >= self.min_samples:
-            self.data = {
-                'x': self.times,
-                'y': self.prices
-            }
-            self.data['y_p'] = list(np.diff(self.data['y']) / np.diff(self.data['x']))
-            self.data['x_p'] = list((np.array(self.data['x'])[:-1] + np.array(self.data['x'])[1:]) / 2)
+    def feature_signals(self, features):
+        return features.latest(('window', 'just_closed')), features.latest(('window', 'just_opened'))
+
+    def min_decision_samples(self):
+        return self.required_history()
+
+    def escape_threshold(self):
+        # Purchases only happen once the engine is ready, so every bar after one can bail
+        return self.emer_escape_threshold
 
 
 class BaselineQuantEngine(QuantEngine):
     def __init__(self):
         super().__init__()
         self.name = 'BaselineQuantEngine'
+        self.min_time_since_last_trade = 0  # buys right away, see should_buy
 
     def should_buy(self):
         # Buy immediately
@@ -300,9 +714,19 @@ class BaselineQuantEngine(QuantEngine):
         return False
 
     def update_model(self, price, time_of_price):
-        if len(self.times) == 0:
-            # First data entry. Set as time of first trade
-            self.time_of_last_trade = time_of_price
+        self.record_sample(price, time_of_price)
+
+    def compute_signals(self, prices, times):
+        # Buy on the very first bar and hold
+        return np.ones(prices.shape, dtype=bool), np.zeros(prices.shape, dtype=bool)
+
+    def feature_signals(self, features):
+        return True, False
+
+    def min_decision_samples(self):
+        return 1
+
 
-        self.prices.append(price)
-        self.times.append(time_of_price)
\ No newline at end of file
+def builtin_engines():
+    # The engines a Manager runs unless the caller brings their own
+    return [TimeBasedQuantEngine(), BaselineQuantEngine(), IthDerivBasedQuantEngine()]
@@ -0,0 +1,300 @@
+import sys
+import json
+import time
+import argparse
+import threading
+import requests
+import metrics
+
+from requests.adapters import HTTPAdapter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+# Crypto quotes straight from the brokerage's HTTP API, for the live loop. Compared to going
+# through robin_stocks one symbol at a time (which also looks the symbol's id up again on every
+# call), this:
+#   - keeps one pool of keep-alive connections per host, so polling doesn't reconnect every time
+#   - resolves symbol ids once and asks for every polled symbol in a single request
+#   - retries connection errors, 429s and 5xx responses with exponential backoff
+#   - sends everything through one rate limiter shared by the whole process
+# base_url and pairs_url can point at LocalQuoteServer, a stand-in for testing and measuring:
+#
+#   python quote_client.py --tickers 20 --latency 0.002
+
+API_URL = 'https://api.robinhood.com'
+PAIRS_URL = 'https://nummus.robinhood.com/currency_pairs/'
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class SessionExpired(Exception):
+    # The brokerage stopped accepting our token (401); log in again and retry
+    pass
+
+
+class RateLimiter:
+    # Token bucket: up to `burst` requests at once, refilled at `rate` a second. Thread safe, since
+    # quotes are fetched from the event loop's thread pool.
+    def __init__(self, rate=10.0, burst=10):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.waited += wait
+            time.sleep(wait)
+
+
+# Every client in this process shares one limiter unless given its own
+shared_limiters = {}
+
+
+def shared_rate_limiter():
+    if 'default' not in shared_limiters:
+        shared_limiters['default'] = RateLimiter()
+    return shared_limiters['default']
+
+
+class QuoteClient:
+    def __init__(self, session=None, base_url=API_URL, pairs_url=PAIRS_URL, pool_size=10, rate_limiter=None,
+                 max_retries=3, backoff=0.25, timeout=5.0):
+        # session defaults to a fresh one; pass robin_stocks' to send its login token along
+        self.session = session if session is not None else requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.base_url = base_url.rstrip('/')
+        self.pairs_url = pairs_url
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.batching = True  # off for good if the API turns out not to take several ids at once
+        self.ids = {}
+        self.latency = metrics.Histogram()  # per request, retries included
+        self.num_requests = 0
+        self.num_retries = 0
+
+    def get_json(self, url, params=None):
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                response = None
+                error = err
+            self.num_requests += 1
+
+            if response is not None and response.status_code == 401:
+                raise SessionExpired(url)
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                self.latency.observe(time.perf_counter() - start)
+                response.raise_for_status()
+                return response.json()
+
+            if attempt >= self.max_retries:
+                if response is None:
+                    raise error
+                response.raise_for_status()
+            # Wait as long as the server asks, or back off exponentially
+            retry_after = response.headers.get('Retry-After') if response is not None else None
+            delay = float(retry_after) if retry_after is not None else self.backoff * 2 ** attempt
+            time.sleep(delay)
+            attempt += 1
+            self.num_retries += 1
+
+    def pair_ids(self, tickers):
+        # Currency pair id for each ticker, e.g. DOGE -> the DOGE-USD pair. Looked up once.
+        missing = [ticker for ticker in tickers if ticker not in self.ids]
+        if missing:
+            for pair in self.get_json(self.pairs_url)['results']:
+                code = pair['asset_currency']['code']
+                if code not in self.ids:
+                    self.ids[code] = pair['id']
+            for ticker in missing:
+                if ticker not in self.ids:
+                    raise Exception("no currency pair for " + ticker)
+        return [self.ids[ticker] for ticker in tickers]
+
+    def get_quotes(self, tickers):
+        # {ticker: quote dict} for every ticker, in one request where the API allows it
+        tickers = list(tickers)
+        ids = self.pair_ids(tickers)
+        tickers_by_id = dict(zip(ids, tickers))
+        if self.batching and len(ids) > 1:
+            try:
+                results = self.get_json(self.base_url + '/marketdata/forex/quotes/', {'ids': ','.join(ids)})
+                return {tickers_by_id[quote['id']]: quote for quote in results['results'] if quote is not None}
+            except requests.HTTPError as err:
+                if err.response is None or err.response.status_code not in (400, 404):
+                    raise
+                print("Batched quotes not supported, fetching them one at a time")
+                self.batching = False
+        return {ticker: self.get_json(self.base_url + '/marketdata/forex/quotes/' + pair_id + '/')
+                for ticker, pair_id in zip(tickers, ids)}
+
+    def get_prices(self, tickers):
+        return {ticker: float(quote['mark_price']) for ticker, quote in self.get_quotes(tickers).items()}
+
+    def get_price(self, ticker):
+        return self.get_prices([ticker])[ticker]
+
+    def report(self):
+        print("Quote requests: ", self.num_requests, " retries: ", self.num_retries,
+              " p50 <= %.2f ms, p99 <= %.2f ms" % ((self.latency.quantile(0.5) or 0) * 1e3,
+                                                    (self.latency.quantile(0.99) or 0) * 1e3),
+              " rate limited for %.2f s" % self.rate_limiter.waited)
+
+
+class LocalQuoteServer:
+    # Stand-in for the two endpoints QuoteClient uses, on localhost. Prices are whatever
+    # prices[ticker] holds. Every response waits `latency` seconds first, and the next `failures`
+    # requests get failure_status (a 503, say, or a 429 carrying retry_after) instead. Counts
+    # requests and the connections they came in on, so tests can see whether connections were reused.
+    def __init__(self, prices, latency=0.0, failures=0, batching=True, port=0, failure_status=503,
+                 retry_after=None):
+        self.prices = prices
+        self.latency = latency
+        self.failures = failures
+        self.failure_status = failure_status
+        self.retry_after = retry_after
+        self.batching = batching
+        self.num_requests = 0
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:' + str(self.server.server_address[1])
+
+    @property
+    def pairs_url(self):
+        return self.base_url + '/currency_pairs/'
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def quote(self, ticker):
+        return {'id': ticker + '-id', 'symbol': ticker + 'USD', 'mark_price': repr(float(self.prices[ticker]))}
+
+    def respond(self, path, query):
+        # (status, body)
+        with self.lock:
+            self.num_requests += 1
+            if self.failures > 0:
+                self.failures -= 1
+                return self.failure_status, {'detail': 'try again'}
+        if path == '/currency_pairs/':
+            return 200, {'results': [{'id': ticker + '-id', 'asset_currency': {'code': ticker}}
+                                     for ticker in self.prices]}
+        if path == '/marketdata/forex/quotes/':
+            if not self.batching:
+                return 400, {'detail': 'ids not supported'}
+            tickers = [pair_id[:-len('-id')] for pair_id in query.get('ids', [''])[0].split(',')]
+            return 200, {'results': [self.quote(ticker) for ticker in tickers]}
+        if path.startswith('/marketdata/forex/quotes/'):
+            return 200, self.quote(path.split('/')[-2][:-len('-id')])
+        return 404, {'detail': 'not found'}
+
+    def make_handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+            # Headers and body go out as separate writes; without this, Nagle's algorithm holds the
+            # body back for the client's delayed ACK on every reused connection
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with stand_in.lock:
+                    stand_in.connections.add(self.client_address)
+                if stand_in.latency > 0:
+                    time.sleep(stand_in.latency)
+                url = urlparse(self.path)
+                status, body = stand_in.respond(url.path, parse_qs(url.query))
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                if status == 429 and stand_in.retry_after is not None:
+                    self.send_header('Retry-After', str(stand_in.retry_after))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *_):
+                pass
+
+        return Handler
+
+
+def measure(label, fetch, num_calls):
+    # Wall time per fetch() call
+    histogram = metrics.Histogram()
+    for _ in range(num_calls):
+        start = time.perf_counter()
+        fetch()
+        histogram.observe(time.perf_counter() - start)
+    print("%-42s mean %7.2f ms  p50 <= %6.2f ms  p99 <= %6.2f ms"
+          % (label, histogram.sum / histogram.count * 1e3, histogram.quantile(0.5) * 1e3,
+             histogram.quantile(0.99) * 1e3))
+    return histogram
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Quote polling latency against a local stand-in')
+    parser.add_argument('--tickers', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.002, help='server side delay per request, seconds')
+    parser.add_argument('--calls', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    tickers = ['T' + str(index) for index in range(args.tickers)]
+    with LocalQuoteServer({ticker: 1.0 + index for index, ticker in enumerate(tickers)},
+                          latency=args.latency) as server:
+        unlimited = RateLimiter(rate=1e9, burst=10 ** 9)
+
+        def reconnecting():
+            # What polling without a session does: a new connection and an id lookup per symbol
+            for ticker in tickers:
+                pairs = requests.get(server.pairs_url).json()['results']
+                pair_id = [pair['id'] for pair in pairs if pair['asset_currency']['code'] == ticker][0]
+                requests.get(server.base_url + '/marketdata/forex/quotes/' + pair_id + '/').json()
+
+        pooled = QuoteClient(base_url=server.base_url, pairs_url=server.pairs_url, rate_limiter=unlimited)
+        pooled.batching = False
+        batched = QuoteClient(base_url=server.base_url, pairs_url=server.pairs_url, rate_limiter=unlimited)
+
+        print("Polling ", len(tickers), " tickers, ", args.latency * 1e3, " ms server latency:")
+        measure("new connection + id lookup per symbol", reconnecting, args.calls)
+        connections_before = len(server.connections)
+        measure("pooled connection, one request per symbol", lambda: pooled.get_prices(tickers), args.calls)
+        measure("pooled connection, one batched request", lambda: batched.get_prices(tickers), args.calls)
+        print("Connections opened by the pooled clients: ", len(server.connections) - connections_before)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,116 +1,362 @@
 import rh_wrapper as rh
 import quant
+import sweep
+import journal
+import ledger
+import downsample
+import pipeline
+import metrics
+import monte_carlo
+import checkpoint
+from ring_buffer import PriceRingBuffer
+from features import FeatureStore
+import os
 import time
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mtick
-
-from matplotlib.widgets import Button
-from datetime import datetime
 
 
 class Manager:
-    def __init__(self):
+    def __init__(self, ticker='DOGE', plotting=True, engines=None):
         # style.use('fivethirtyeight')
         # Create a queue to store stock prices
         self.prices = []
         self.times = []
 
         self.MAX_SAMPLES = 50
+        self.CHECKPOINT_SUMMARY_POINTS = 4096  # older prices kept (as a min/max summary) in checkpoints
         self.UPDATE_INTERVAL = 1
-        self.FIG_INITIALIZED = False
         self.data = {'x': [], 'y': [], 'x_p': [], 'y_p': []}
         self.ani = None
         self.ax1 = None
-        self.button = None
+        self.renderer = None  # LiveRenderer drawing the live plots, see main
         self.engines = []
-        self.plotting = True
+        self.plotting = plotting
         self.continue_live = False  # Set to true for live graphs
         self.stop = False
-        self.ticker = 'DOGE'
-
-        if self.plotting:
-            self.fig = plt.figure(figsize=(13, 9))
-
-        # Add any quant engines you'd like to exercise here
-        self.engines.append(quant.TimeBasedQuantEngine())
-        self.engines.append(quant.BaselineQuantEngine())
-        self.engines.append(quant.IthDerivBasedQuantEngine())
-
-        # Set up a whole bunch of these dudes to compare
-        num_steps_buy = 5
-        num_steps_sell = 5
-        buy_start = -.1
-        buy_end = .1
-        sell_start = -.1
-        sell_end = .1
-        for buy_thresh in np.arange(buy_start, buy_end, (buy_end - buy_start)/num_steps_buy):
-            for sell_thresh in np.arange(sell_start, sell_end, (sell_end - sell_start)/num_steps_sell):
-                self.engines.append(quant.IthDerivBasedQuantEngine(deriv_dim=4,
-                                                                   buy_threshold=buy_thresh,
-                                                                   sell_threshold=sell_thresh))
-
-    def initialize_plot(self):
-        if self.FIG_INITIALIZED:
-            return
+        self.ticker = ticker
+        self.metrics = None  # Metrics registry once enable_metrics is called
+        self.router = None  # orders.OrderRouter the engines' live trades go through, see route_orders
+
+        # Created when something first draws (see LiveRenderer.build and close), so backtests that
+        # never plot don't need a display or even matplotlib
+        self.fig = None
+
+        # Replaying history doesn't record anything, see start_live_journal for live runs
+        self.journal = journal.Journal(verbosity=journal.OFF)
+
+        # Add any quant engines you'd like to exercise here, unless the caller brought their own
+        if engines is None:
+            engines = quant.builtin_engines()
+        for engine in engines:
+            self.add_engine(engine)
+
+        # Set up a whole bunch of these dudes to compare. The grid is swept in one batch once the
+        # history is in (see set_data) and only the best few become real engines
+        (self.sweep_deriv_dims, self.sweep_buy_thresholds, self.sweep_sell_thresholds,
+         self.sweep_emer_escape_thresholds) = sweep.default_grid()
+        self.num_swept_engines = 5
+
+        # Shared store of the newest live samples and the features computed from them, created once
+        # the engines are known (see set_arrays)
+        self.buffer = None
+        self.features = None
+
+        # Min/max summary of prices streamed through stream_history, which doesn't keep them all
+        self.summary_times = []
+        self.summary_prices = []
+
+    def add_engine(self, engine):
+        engine.journal = self.journal
+        engine.clock = rh.now
+        if self.metrics is not None:
+            engine.instrument(self.metrics, ticker=self.ticker)
+        if self.router is not None:
+            self.router.register(engine, self.ticker)
+        self.engines.append(engine)
+
+    def enable_metrics(self, registry=None):
+        # Opt-in timing of every engine (now and later ones) and of each live tick, into a Metrics
+        # registry that can be shared between managers. Returns the registry.
+        self.metrics = registry or metrics.Metrics()
+        for engine in self.engines:
+            engine.instrument(self.metrics, ticker=self.ticker)
+        self.process_sample = metrics.timed_call(self.process_sample,
+                                                 self.metrics.histogram('tick_seconds', ticker=self.ticker))
+        self.metrics.add_collector(self.collect_metrics)
+        return self.metrics
 
-        # this is the call to matplotlib that allows dynamic plotting
-        plt.ion()
+    def collect_metrics(self, registry):
+        for engine in self.engines:
+            registry.set_gauge('engine_trades', len(engine.ledger), ticker=self.ticker, engine=engine.name)
+            registry.set_gauge('engine_samples', engine.num_samples, ticker=self.ticker, engine=engine.name)
+            registry.set_gauge('engine_funds', engine.funds_available, ticker=self.ticker, engine=engine.name)
 
-        # Create and label top graph (stock price)
-        plt.subplot(211)
-        plt.ylabel('Share Price')
-        plt.title(self.ticker+' Share Price Over Time: {}'.format(''))
+    def start_live_journal(self, path):
+        # Live trades and decisions get echoed like they always have, and written to disk in the background
+        self.journal = journal.Journal(path, verbosity=journal.DECISIONS, echo=True)
+        for engine in self.engines:
+            engine.journal = self.journal
 
-        # Create and label bottom graph (rate of change)
-        plt.subplot(212)
-        plt.ylabel('Deriv Price')
-        plt.title('Deriv Share Price Over Time: {}'.format(''))
+    def route_orders(self, router):
+        # From now on the engines' trades are orders at the brokerage, and only count once filled
+        self.router = router
+        for engine in self.engines:
+            router.register(engine, self.ticker)
 
-        self.FIG_INITIALIZED = True
+    def drop_pending_orders(self):
+        # Orders restored from a checkpoint that no router is going to follow up on. Without this the
+        # engines would wait on them forever.
+        for engine in self.engines:
+            if engine.pending_order is not None:
+                print("Forgetting the order ", engine.name, " had in flight for ", self.ticker)
+                engine.pending_order = None
 
     def set_data(self, data):
-        # Assume data passed in is a dict of tuples of price, time
-        for entry in data:
-            price = entry.get('price')
-            time_at_price = entry.get('time')
-            utc_time = datetime.strptime(time_at_price, "%Y-%m-%dT%H:%M:%SZ")
-            epoch_time = (utc_time - datetime(1970, 1, 1)).total_seconds()
-            self.prices.append(float(price))
-            self.times.append(epoch_time)
+        # Assume data passed in is a dict of tuples of price, time. It's parsed and replayed a chunk
+        # at a time; already parsed arrays can skip this and go straight to set_arrays
+        self.stream_history(pipeline.record_source(data))
+
+    def set_arrays(self, prices, times):
+        # Same as set_data for history that's already parsed, e.g. straight from the local cache
+        prices = np.asarray(prices, dtype=np.float64)
+        times = np.asarray(times, dtype=np.float64)
+        self.prices.extend(prices.tolist())
+        self.times.extend(times.tolist())
+
+        # Replay the whole history through each engine in one vectorized pass
+        for engine in self.engines:
+            engine.backtest(prices, times)
+
+        self.add_swept_engines(prices, times)
+        self.share_buffer()
+
+    def stream_history(self, source, counters=None, summary_points=64):
+        # set_arrays for histories too big to hold in memory, e.g. years of 15 second bars out of the
+        # memory-mapped cache. source returns a fresh iterator of (times, prices) chunks each call
+        # (see pipeline.py): one pass sweeps the thresholds, a second runs every engine chunk by chunk
+        # against the fixed size live buffer. Nothing grows with the length of the history except
+        # the trades and a min/max summary of the prices (summary_points per chunk) for plotting.
+        if counters is None:
+            counters = pipeline.StageCounters()
+
+        if self.num_swept_engines > 0:
+            sweep_run = sweep.IthDerivSweep(self.sweep_deriv_dims,
+                                            self.sweep_buy_thresholds,
+                                            self.sweep_sell_thresholds,
+                                            self.sweep_emer_escape_thresholds,
+                                            clock=rh.now)
+            for times, prices in counters.timed('read', source()):
+                with counters.stage('sweep', len(times)):
+                    sweep_run.update(prices, times)
+            self.build_swept_engines(sweep_run.results())
+
+        self.attach_buffer()
+        for times, prices in counters.timed('read', source()):
+            self.replay_chunk(times, prices, counters, summary_points)
+        self.attach_features()
+
+        counters.report()
+        return counters
+
+    def replay_chunk(self, times, prices, counters, summary_points=64):
+        # Engines look back on the buffer, so they go first and the chunk goes in after
+        with counters.stage('engines', len(times)):
             for engine in self.engines:
-                engine.update_model(float(price), epoch_time)
-                if engine.should_buy():
-                    engine.buy()
-                elif engine.should_sell():
-                    engine.sell()
+                engine.backtest_chunk(prices, times)
+        with counters.stage('buffer', len(times)):
+            self.buffer.extend(times, prices)
+        with counters.stage('journal', len(times)):
+            self.journal.flush()
+        with counters.stage('summary', len(times)):
+            summary_times, summary_prices = downsample.min_max(times, prices, summary_points)
+            self.summary_times.append(summary_times)
+            self.summary_prices.append(summary_prices)
+
+    def catch_up(self, source, counters=None, summary_points=64):
+        # stream_history for a Manager that already has engines and history, e.g. one restored
+        # from a checkpoint: only the bars newer than anything it has seen are run through the
+        # engines. No sweep, the engines stay as they are. Returns how many bars were new.
+        if counters is None:
+            counters = pipeline.StageCounters()
+        if self.buffer is None:
+            self.attach_buffer()
+
+        num_new = 0
+        for times, prices in counters.timed('read', source()):
+            newer = times > self.last_time()
+            if newer.any():
+                self.replay_chunk(times[newer], prices[newer], counters, summary_points)
+                num_new += int(np.count_nonzero(newer))
+        self.attach_features()
+        return num_new
+
+    def last_time(self):
+        # Time of the newest sample the engines have seen, or -inf before any
+        if self.buffer is not None and len(self.buffer):
+            return float(self.buffer.latest_times(1)[0])
+        if len(self.times):
+            return float(self.times[-1])
+        if len(self.summary_times):
+            return float(self.summary_times[-1][-1])
+        return -np.inf
+
+    def share_buffer(self):
+        # One fixed size buffer for the live loop, big enough for the engine that needs the longest
+        # history. Engines read it through views instead of growing their own lists forever.
+        self.attach_buffer()
+        self.buffer.extend(self.times[-self.buffer.capacity:], self.prices[-self.buffer.capacity:])
+        self.attach_features()
+
+    def attach_buffer(self):
+        capacity = max([self.MAX_SAMPLES] + [engine.required_history() for engine in self.engines])
+        self.buffer = PriceRingBuffer(capacity)
+        for engine in self.engines:
+            engine.attach_buffer(self.buffer)
+
+    def attach_features(self):
+        # Features like "4th diff" get computed once per tick no matter how many engines want them.
+        # Built from whatever is in the buffer, so call this once it's filled.
+        self.features = FeatureStore(self.buffer)
+        for engine in self.engines:
+            engine.attach_features(self.features)
+
+    def add_swept_engines(self, prices, times):
+        results = sweep.sweep_ith_deriv(prices, times,
+                                        self.sweep_deriv_dims,
+                                        self.sweep_buy_thresholds,
+                                        self.sweep_sell_thresholds,
+                                        self.sweep_emer_escape_thresholds,
+                                        clock=rh.now)
+        for engine in self.build_swept_engines(results):
+            engine.backtest(prices, times)
+
+    def build_swept_engines(self, results):
+        # Real engines for the best few rows of the sweep, not yet run over anything
+        sweep.print_sweep_results(results)
+
+        engines = []
+        for row in results[:self.num_swept_engines]:
+            escape = None if np.isnan(row['emer_escape_threshold']) else float(row['emer_escape_threshold'])
+            engine = quant.IthDerivBasedQuantEngine(deriv_dim=int(row['deriv_dim']),
+                                                    buy_threshold=float(row['buy_threshold']),
+                                                    sell_threshold=float(row['sell_threshold']),
+                                                    emer_escape_threshold=escape)
+            self.add_engine(engine)
+            engines.append(engine)
+        return engines
 
     def get_current_data(self, ticker):
         # Get the stock price
         current_price = float(rh.get_crypto_price(ticker))
+        current_time = rh.now()
 
         # print the stock value
         print("Current price: ", current_price)
-        print("Current time: ", time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())))
+        print("Current time: ", time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(current_time)))
 
-        self.prices.append(current_price)
-        self.times.append(time.time())
-        for engine in self.engines:
-            engine.update_model(current_price, time.time())
+        self.update_engines(current_price, current_time)
 
-        if len(self.prices) > self.MAX_SAMPLES:
-            self.prices.pop(0)
-            self.times.pop(0)
+    def update_engines(self, current_price, current_time):
+        if self.buffer is None:
+            self.share_buffer()
+        self.buffer.append(current_time, current_price)
+        self.features.update()
+        for engine in self.engines:
+            engine.update_model(current_price, current_time)
 
-        if len(self.prices) >= self.MAX_SAMPLES:
+        if len(self.buffer) >= self.MAX_SAMPLES:
+            # Copies, since matplotlib holds on to whatever arrays it's given
             self.data = {
-                'x': self.times,
-                'y': self.prices
+                'x': self.buffer.latest_times(self.MAX_SAMPLES).copy(),
+                'y': self.buffer.latest_prices(self.MAX_SAMPLES).copy()
             }
-            self.data['y_p'] = list(np.diff(self.data['y'], 4))
+            self.data['y_p'] = np.diff(self.data['y'], 4)
 
             # Need to normalize derivative with respect to time units
-            self.data['x_p'] = self.times[:-4]
+            self.data['x_p'] = self.data['x'][:-4]
+
+    def process_sample(self, current_price, current_time):
+        # One live sample end to end: update every engine, then let each one trade
+        self.update_engines(current_price, current_time)
+
+        for engine in self.engines:
+            if engine.should_buy():
+                engine.buy()
+            elif engine.should_sell():
+                engine.sell()
+
+        # Hands anything new to the journal's writer thread, nothing blocks on disk here
+        self.journal.flush()
+
+    def price_history(self):
+        # Loaded (or streamed and summarized) history plus whatever live samples the buffer still holds
+        times = np.concatenate(self.summary_times + [np.array(self.times, dtype=np.float64)])
+        prices = np.concatenate(self.summary_prices + [np.array(self.prices, dtype=np.float64)])
+        if self.buffer is not None:
+            live_times = self.buffer.latest_times()
+            live = live_times > times[-1] if len(times) else np.ones(len(live_times), dtype=bool)
+            times = np.concatenate([times, live_times[live]])
+            prices = np.concatenate([prices, self.buffer.latest_prices()[live]])
+        return times, prices
+
+    def monte_carlo(self, num_paths=10000, method='bootstrap', num_bars=None, times=None, prices=None,
+                    block_size=24, seed=0):
+        # Every engine's strategy over num_paths synthetic histories ('bootstrap' or 'gbm') modelled
+        # on this one. Streamed (or checkpointed) histories only keep a min/max summary of their
+        # prices, which would model the wrong returns, so those need the real times and prices.
+        if prices is None:
+            if self.summary_prices:
+                raise Exception("price history was streamed and only summarized, pass times and prices")
+            times, prices = self.price_history()
+        elif times is None:
+            raise Exception("pass the times that go with prices")
+        num_bars = num_bars or len(prices)
+        paths = monte_carlo.make_paths(prices, method, num_paths, num_bars, block_size, seed)
+        results = monte_carlo.simulate(self.engines, paths, monte_carlo.path_times(times, num_bars))
+        rows = monte_carlo.summarize(results)
+        monte_carlo.print_summary(rows)
+        return rows
+
+    def checkpoint_state(self):
+        # (meta, arrays) for checkpoint.write_checkpoint: every engine's state, the live buffer and
+        # a summary of the older prices for the closing chart. Everything is copied, so it can be
+        # written out on another thread while the live loop carries on.
+        arrays = {}
+        meta = {
+            'ticker': self.ticker,
+            'last_time': self.last_time(),
+            'engines': [checkpoint.engine_state(engine, index, arrays) for index, engine in enumerate(self.engines)],
+        }
+        times = np.concatenate(self.summary_times + [np.array(self.times, dtype=np.float64)])
+        prices = np.concatenate(self.summary_prices + [np.array(self.prices, dtype=np.float64)])
+        arrays['summary_times'], arrays['summary_prices'] = downsample.min_max(times, prices,
+                                                                               self.CHECKPOINT_SUMMARY_POINTS)
+        if self.buffer is not None:
+            arrays['buffer_times'] = self.buffer.latest_times().copy()
+            arrays['buffer_prices'] = self.buffer.latest_prices().copy()
+        return meta, arrays
+
+    def save_checkpoint(self, path):
+        checkpoint.write_checkpoint(path, *self.checkpoint_state())
+
+    @classmethod
+    def from_checkpoint(cls, path, **kwargs):
+        # Warm start: the Manager and engines as checkpoint_state left them, or None if there's no
+        # usable checkpoint at path. Follow up with catch_up for whatever came in since.
+        saved = checkpoint.read_checkpoint(path)
+        if saved is None:
+            return None
+        meta, arrays = saved
+        engines = [checkpoint.restore_engine(state, index, arrays) for index, state in enumerate(meta['engines'])]
+        manager = cls(meta['ticker'], engines=engines, **kwargs)
+        manager.summary_times = [arrays['summary_times']]
+        manager.summary_prices = [arrays['summary_prices']]
+        if 'buffer_times' in arrays:
+            manager.attach_buffer()
+            manager.buffer.extend(arrays['buffer_times'], arrays['buffer_prices'])
+            manager.attach_features()
+        print("Restored ", len(engines), " engines for ", manager.ticker, " from ", path)
+        return manager
 
     def stop_pressed(self, _):
         self.stop = True
@@ -124,140 +370,215 @@ class Manager:
             new_data.append(time.strftime("%a, %d %b %Y %H:%M:%S %Z", time.localtime(this_time)))
         return new_data
 
-    def live_plotter(self, x_data, y_data, this_plot, plot, pause_time=0.1):
-        if x_data != [] and len(x_data) >= self.MAX_SAMPLES - 1:
-            # Figure out which graph to update
-            if plot == 'price':
-                axis = plt.subplot(211)
-            else:
-                axis = plt.subplot(212)
-
-            if not this_plot:
-                if plot == 'price':
-                    this_plot, = axis.plot(x_data, y_data, '-o', alpha=0.8)
-                else:
-                    this_plot, = axis.plot(x_data, y_data, '-o', alpha=0.8)
-
-                # This works to get an axis labelled initially, but doesn't update over time
-                plt.gcf().autofmt_xdate()
-                plt.gca().xaxis.set_major_locator(plt.MaxNLocator(15))
-                plt.gca().xaxis.set_major_formatter(
-                    mtick.FuncFormatter(lambda pos, _: time.strftime("%m/%d/%Y %H:%M:%S", time.localtime(pos)))
-                )
-                return this_plot
-
-            self.initialize_plot()
-
-            # after the figure, axis, and line are created, we only need to update the y-data
-            this_plot.set_ydata(y_data)
-
-            # adjust limits if new data goes beyond bounds
-            current_min = np.min(y_data)
-            last_min = this_plot.axes.get_ylim()[0]
-            current_max = np.max(y_data)
-            last_max = this_plot.axes.get_ylim()[1]
-            if current_min <= last_min or current_max >= last_max:
-                axis.set_ylim([np.min(y_data) - np.std(y_data), np.max(y_data) + np.std(y_data)])
-
-            # Put a stop button in place
-            button_pos = plt.axes([0.81, 0.05, 0.1, 0.075])
-            self.button = Button(button_pos, 'Stop')
-            self.button.on_clicked(self.stop_pressed)
-
-            # this pauses the data so the figure/axis can catch up - the amount of pause can be altered above
-            plt.pause(pause_time)
-
-        # return line so we can update it again in the next iteration
-        return this_plot
-
-    def close(self):
+    def close(self, top_k=10, image_path=None, downsample_method='lttb'):
+        # Summary chart of the top_k engines (None for all of them) against the normalized price.
+        # Every series is downsampled to about the chart's pixel width first. With image_path the
+        # chart is rendered straight to that file, without a display or an interactive backend. With
+        # neither an image_path nor plotting, only the engines' exit reports. matplotlib is only
+        # imported once a chart is actually drawn.
         for engine in self.engines:
             engine.close()
-
-        if self.plotting:
+        self.journal.close()
+
+        if image_path is not None:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            fig = Figure(figsize=(13, 9))
+            FigureCanvasAgg(fig)
+        elif self.plotting:
+            import matplotlib.pyplot as plt
             print("Clearing current plot...")
             plt.close()
-            self.fig = plt.figure(figsize=(13, 9))
+            self.fig = fig = plt.figure(figsize=(13, 9))
         else:
-            exit(0)
+            return
+        import matplotlib.ticker as mtick
 
         # First sort engines based on final performance or remove if no data
-        tmp_engines = []
-        for engine in self.engines:
-            if len(engine.event_points) > 1:
-                tmp_engines.append(engine)
-        self.engines = tmp_engines
-
-        self.engines.sort(key=lambda x: x.event_points[-1].price, reverse=True)
-
-        for engine in self.engines:
-            x_vals = []
-            y_vals = []
-            for event in engine.event_points:
-                x_vals.append(event.time_of_event)
-                y_vals.append(event.price)
+        ranking = ledger.rank([engine.ledger for engine in self.engines])
+        self.engines = [self.engines[i] for i in ranking]
+
+        axis = fig.add_subplot(111)
+        num_points = int(fig.get_figwidth() * fig.dpi)
+        shown_engines = self.engines if top_k is None else self.engines[:top_k]
+        for engine in shown_engines:
+            x_vals, y_vals = downsample.downsample(*engine.ledger.equity_curve(), num_points=num_points,
+                                                   method=downsample_method)
             legend_val = engine.name
             # Append % difference to legend name
-            percent_diff = "%.2f" % ((y_vals[-1]-y_vals[0])/y_vals[0]*100)
+            percent_diff = "%.2f" % (engine.ledger.total_return()*100)
             legend_val = legend_val + " (" + percent_diff + ")"
-            plt.plot(x_vals, y_vals, label=legend_val)
+            axis.plot(x_vals, y_vals, label=legend_val)
+        if len(shown_engines) < len(self.engines):
+            print("Plotting the top ", len(shown_engines), " of ", len(self.engines), " engines")
 
         # Normalize the stock for comparison
-        normalized_prices = []
-        initial_stock_val = self.prices[0]
-        initial_value = self.engines[0].event_points[0].price
+        times, prices = self.price_history()
+        initial_stock_val = prices[0]
+        initial_value = self.engines[0].ledger.values()[0]
 
-        for price in self.prices:
-            normalized_prices.append(price*(initial_value/initial_stock_val))
         # Append % difference to legend name
-        percent_diff = "%.2f" % ((self.prices[-1] - self.prices[0]) / self.prices[0] * 100)
+        percent_diff = "%.2f" % ((prices[-1] - prices[0]) / prices[0] * 100)
+        times, prices = downsample.downsample(times, prices, num_points=num_points, method=downsample_method)
+        normalized_prices = prices*(initial_value/initial_stock_val)
         legend_val = "Normalized price for comp" + " (" + percent_diff + ")"
-        plt.plot(self.times, normalized_prices, label=legend_val)
-        plt.legend()
-        plt.title('Quant Engines over time for '+self.ticker+': {}'.format(''))
+        axis.plot(times, normalized_prices, label=legend_val)
+        axis.legend()
+        axis.set_title('Quant Engines over time for '+self.ticker+': {}'.format(''))
 
         # These lines make it so that the x-axis have human readable labels
-        plt.gcf().autofmt_xdate()
-        plt.gca().xaxis.set_major_locator(plt.MaxNLocator(15))
-        plt.gca().xaxis.set_major_formatter(
+        fig.autofmt_xdate()
+        axis.xaxis.set_major_locator(mtick.MaxNLocator(15))
+        axis.xaxis.set_major_formatter(
             mtick.FuncFormatter(lambda pos, _: time.strftime("%m/%d/%Y %H:%M:%S", time.localtime(pos)))
         )
 
-        plt.show(block=True)
-
+        if image_path is not None:
+            fig.savefig(image_path)
+            print("Saved summary chart to ", image_path)
+        else:
+            plt.show(block=True)
+
+CHECKPOINT_DIR = os.path.join(os.path.expanduser("~"), '.retirement', 'checkpoints')
+
+
+def main(tickers=('DOGE',), backend=None, continue_live=None, metrics_dir=None, checkpoint_dir=CHECKPOINT_DIR,
+         place_orders=False):
+    # backend swaps out the brokerage, e.g. backends.ReplayBackend to replay recorded bars offline.
+    # continue_live overrides the Manager default when given. With metrics_dir, engine and live loop
+    # timings are exported there as metrics.json and metrics.prom every few seconds.
+    #
+    # Managers are snapshotted to checkpoint_dir once the history is in, every few minutes while
+    # live, and on the way out. A restart picks up from those snapshots and only replays the bars
+    # that came in since. Pass checkpoint_dir=None to always start cold (e.g. for replays).
+    #
+    # With place_orders, live trades become real orders at the backend (see orders.py) instead of
+    # only being simulated.
+    #
+    # The live loop's modules (asyncio, matplotlib) are imported where they're first needed, so
+    # headless backtests that only use the Manager (see backtest.py) start fast.
+    import asyncio
+    import live_feed
+
+    if backend is not None:
+        rh.set_backend(backend)
+
+    registry = None
+    exporter = None
+    if metrics_dir is not None:
+        registry = metrics.Metrics()
+        exporter = metrics.PeriodicExporter(registry,
+                                            json_path=os.path.join(metrics_dir, 'metrics.json'),
+                                            prometheus_path=os.path.join(metrics_dir, 'metrics.prom'))
 
-def main():
     # Login
     rh.rh_login()
 
-    manager = Manager()
-    share_plot = []
-    deriv_plot = []
-
-    prev_data = rh.get_crypto_history(manager.ticker, interval='hour', span='3month')
-
-    manager.set_data(prev_data)
-
-    if not manager.continue_live:
-        manager.close()
+    managers = {}
+    for ticker in tickers:
+        manager = None
+        if checkpoint_dir is not None:
+            manager = Manager.from_checkpoint(checkpoint.checkpoint_path(checkpoint_dir, ticker))
+        warm_start = manager is not None
+        if not warm_start:
+            manager = Manager(ticker)
+        if continue_live is not None:
+            manager.continue_live = continue_live
+        if registry is not None:
+            manager.enable_metrics(registry)
+        prev_times, prev_prices = rh.get_cached_crypto_history(manager.ticker, interval='hour', span='3month')
+        if warm_start:
+            if not (place_orders and manager.continue_live):
+                manager.drop_pending_orders()
+            num_new = manager.catch_up(pipeline.array_source(prev_times, prev_prices))
+            print("Caught up on ", num_new, " bars since the checkpoint for ", ticker)
+        else:
+            manager.stream_history(pipeline.array_source(prev_times, prev_prices))
+        managers[ticker] = manager
+
+    checkpointer = None
+    if checkpoint_dir is not None:
+        checkpointer = checkpoint.PeriodicCheckpoint(list(managers.values()), checkpoint_dir)
+        checkpointer.save()
+
+    if not any(manager.continue_live for manager in managers.values()):
+        if exporter is not None:
+            exporter.export()
+        for manager in managers.values():
+            manager.close()
         exit(0)
 
-    while not manager.stop:
-        manager.get_current_data(manager.ticker)
-
-        for engine in manager.engines:
-            if engine.should_buy():
-                engine.buy()
-            elif engine.should_sell():
-                engine.sell()
-
-        if manager.plotting:
-            share_plot = manager.live_plotter(manager.data['x'], manager.data['y'], share_plot, 'price')
-            deriv_plot = manager.live_plotter(manager.data['x_p'], manager.data['y_p'], deriv_plot, 'deriv')
+    # A replay runs its clock faster than real time, so poll faster to match (or as fast as
+    # possible when it has no fixed speed)
+    interval = managers[tickers[0]].UPDATE_INTERVAL
+    speed = getattr(rh.get_backend(), 'speed', 1.0)
+    interval = 0 if speed is None else interval / speed
+
+    feed = live_feed.LiveFeed(live_feed.BatchedQuoteSource(rh.get_crypto_prices),
+                              [ticker for ticker in tickers if managers[ticker].continue_live],
+                              interval=interval,
+                              clock=rh.now,
+                              metrics=registry)
+    router = None
+    if place_orders:
+        import orders
+        router = orders.OrderRouter(rh.get_backend(), clock=rh.now, metrics=registry)
+        for ticker in feed.tickers:
+            managers[ticker].route_orders(router)
+    from live_renderer import LiveRenderer
+    for ticker in feed.tickers:
+        managers[ticker].start_live_journal(os.path.join(os.path.expanduser("~"), '.retirement', 'journal',
+                                                         ticker + '.bin'))
+        feed.subscribe(ticker, make_live_handler(managers[ticker], feed))
+        if managers[ticker].plotting:
+            managers[ticker].renderer = LiveRenderer(managers[ticker], backlog=feed.backlog)
+
+    asyncio.run(run_live(feed, [managers[ticker].renderer for ticker in feed.tickers
+                                if managers[ticker].renderer is not None], exporter, checkpointer, router))
+    feed.report()
+    if router is not None:
+        router.report()
+
+    for manager in managers.values():
+        manager.close()
 
-        time.sleep(manager.UPDATE_INTERVAL)
 
-    manager.close()
+async def run_live(feed, renderers, exporter=None, checkpointer=None, router=None):
+    # Quotes, frames, metric exports, checkpoints and orders share the event loop, each on its own
+    # schedule. Everything else stops with the feed, once the open orders are settled so the last
+    # checkpoint has their fills.
+    import asyncio
+    background = list(renderers)
+    for task in (exporter, checkpointer):
+        if task is not None:
+            background.append(task)
+    tasks = [asyncio.ensure_future(task.run()) for task in background]
+    router_task = asyncio.ensure_future(router.run()) if router is not None else None
+    try:
+        await feed.run()
+    finally:
+        if router_task is not None:
+            router.stop()
+            await router_task
+        for task in background:
+            task.stop()
+        await asyncio.gather(*tasks)
+    for renderer in renderers:
+        renderer.report()
+
+
+def make_live_handler(manager, feed):
+    def handle_sample(price, time_of_price):
+        manager.process_sample(price, time_of_price)
+
+        # Just flags the plots as stale, the renderer draws on its own schedule
+        if manager.renderer is not None:
+            manager.renderer.mark_dirty()
+
+        if manager.stop or rh.get_backend().exhausted():
+            feed.stop()
+
+    return handle_sample
 
 
 if __name__ == "__main__":
@@ -1,14 +1,149 @@
-import robin_stocks.robinhood as rs
-from pyotp import TOTP as otp
 from os.path import expanduser
+from history_cache import HistoryCache, SPAN_SECONDS, history_to_arrays
+from backends import MarketBackend
+from ledger import BUY_SIDE
+import time
 import os
 
 robin_user = os.environ.get("RH_USR")
 robin_pass = os.environ.get("RH_PWD")
 
+# Everything below goes through this backend. Defaults to the real brokerage; swap in e.g. a
+# backends.ReplayBackend with set_backend to run offline.
+active_backend = None
 
-def rh_login():
-    clear_pickles()
+
+def set_backend(backend):
+    global active_backend
+    active_backend = backend
+
+
+def get_backend():
+    global active_backend
+    if active_backend is None:
+        active_backend = RobinhoodBackend()
+    return active_backend
+
+
+def robinhood():
+    # robin_stocks (and pyotp, see robinhood_login) are only imported once something actually talks
+    # to the brokerage, so offline runs and replays never pay for loading them
+    import robin_stocks.robinhood as rs
+    return rs
+
+
+def rh_login(fresh=False):
+    # fresh=True throws away the stored session and logs in from scratch
+    get_backend().login(fresh)
+
+
+def now():
+    return get_backend().now()
+
+
+def rh_execute_trade(ticker, amount_in_dollars=5):
+    return get_backend().execute_trade(ticker, amount_in_dollars)
+
+
+def get_crypto_price(ticker):
+    return get_backend().get_price(ticker)
+
+
+def get_crypto_prices(tickers):
+    # {ticker: price}, fetched together where the backend can
+    return get_backend().get_prices(tickers)
+
+
+def get_crypto_history(ticker, interval='15second', span='hour'):
+    return get_backend().get_history(ticker, interval, span)
+
+
+def get_crypto_history_arrays(ticker, interval='15second', span='hour'):
+    return get_backend().get_history_arrays(ticker, interval, span)
+
+
+class RobinhoodBackend(MarketBackend):
+    def __init__(self):
+        self.quote_client = None
+
+    def login(self, fresh=False):
+        robinhood_login(fresh)
+
+    def quotes(self):
+        # Quotes go over robin_stocks' session (and so its login token), but through a pooled,
+        # batching, rate limited client instead of robin_stocks' one-symbol-per-call helpers
+        if self.quote_client is None:
+            import quote_client
+            self.quote_client = quote_client.QuoteClient(session=robinhood().globals.SESSION)
+        return self.quote_client
+
+    def get_prices(self, tickers):
+        import quote_client
+        try:
+            return self.quotes().get_prices(tickers)
+        except quote_client.SessionExpired:
+            # The stored session has run out: log in again and retry once
+            print("RobinHood session expired")
+            robinhood_login(fresh=True)
+            return self.quotes().get_prices(tickers)
+
+    def get_price(self, ticker):
+        return self.get_prices([ticker])[ticker]
+
+    def get_history(self, ticker, interval, span):
+        return robinhood_history(ticker, interval, span)
+
+    def get_history_arrays(self, ticker, interval, span):
+        return robinhood_history_arrays(ticker, interval, span)
+
+    def execute_trade(self, ticker, amount_in_dollars):
+        # This example for buying a little bit of litecoin ('LTC') actually worked!
+        return robinhood().orders.order_buy_crypto_by_price(ticker,
+                                                            amount_in_dollars,
+                                                            timeInForce='gtc')
+
+    def submit_order(self, ticker, side, amount=None, shares=None):
+        if side == BUY_SIDE:
+            order = robinhood().orders.order_buy_crypto_by_price(ticker, amount, timeInForce='gtc')
+        else:
+            order = robinhood().orders.order_sell_crypto_by_quantity(ticker, shares, timeInForce='gtc')
+        if not order or 'id' not in order:
+            raise Exception(str(order))
+        return order['id']
+
+    def order_status(self, order_id):
+        order = robinhood().orders.get_crypto_order_info(order_id)
+        executions = order.get('executions') or []
+        return {
+            'state': ROBINHOOD_ORDER_STATES.get(order.get('state'), 'open'),
+            'shares': sum(float(execution['quantity']) for execution in executions),
+            'amount': sum(float(execution['quantity']) * float(execution['effective_price'])
+                          for execution in executions),
+        }
+
+    def cancel_order(self, order_id):
+        robinhood().orders.cancel_crypto_order(order_id)
+
+
+# Robinhood's crypto order states, as the ones MarketBackend.order_status uses. Anything else
+# ('unconfirmed', 'confirmed', 'queued', 'partially_filled', ...) is still open.
+ROBINHOOD_ORDER_STATES = {
+    'filled': 'filled',
+    'canceled': 'cancelled',
+    'cancelled': 'cancelled',
+    'rejected': 'rejected',
+    'failed': 'rejected',
+}
+
+
+def robinhood_login(fresh=False):
+    # robin_stocks keeps the session in ~/.tokens/robinhood.pickle and reuses it while it's still
+    # accepted, which skips the whole OAuth + MFA round trip on restarts. Only clear it when asked
+    # to, or once the brokerage has rejected it.
+    from pyotp import TOTP as otp
+    rs = robinhood()
+    if fresh:
+        clear_pickles()
     print("Logging in to RobinHood...")
 
     # For this you'll need to set up MFA in robinhood
@@ -22,7 +157,8 @@ def rh_login():
     rs.authentication.login(
         username=os.environ.get('RH_USR'),
         password=os.environ.get('RH_PWD'),
-        mfa_code=totp
+        mfa_code=totp,
+        store_session=True
     )
     print("Login Successful")
 
@@ -35,18 +171,7 @@ def clear_pickles():
         os.remove(full_path)
 
 
-def rh_execute_trade(ticker):
-    # This example for buying a little bit of litecoin ('LTC') actually worked!
-    rs.orders.order_buy_crypto_by_price(ticker,
-                                        5,
-                                        timeInForce='gtc')
-
-
-def get_crypto_price(ticker):
-    return rs.crypto.get_crypto_quote(ticker).get('mark_price')
-
-
-def get_crypto_history(ticker, interval='15second', span='hour'):
+def robinhood_history(ticker, interval='15second', span='hour'):
 
     # interval: The time between data points.
     #       Can be '15second', '5minute', '10minute', 'hour', 'day', or 'week'. Default is 'hour'.
@@ -55,7 +180,7 @@ def get_crypto_history(ticker, interval='15second', span='hour'):
     # param info: Will filter the results to have a list of the values that correspond to key that matches info.
 
     print("Getting historical data for Symbol: ", ticker, " , interval: ", interval, " , span: ", span)
-    history = rs.crypto.get_crypto_historicals(ticker, interval=interval, span=span)
+    history = robinhood().crypto.get_crypto_historicals(ticker, interval=interval, span=span)
 
     # We don't need to return all that extra info. Just return a list of tuples of times and prices
     res = []
@@ -65,3 +190,33 @@ def get_crypto_history(ticker, interval='15second', span='hour'):
         res.append({'price': price, 'time': time_at_price})
     print("History fetch completed successfully with ", len(res), " results.")
     return res
+
+
+def robinhood_history_arrays(ticker, interval='15second', span='hour'):
+    # Same as robinhood_history, but goes straight from the raw historicals to (times, prices) arrays
+    # without building the intermediate list of dicts
+    print("Getting historical data for Symbol: ", ticker, " , interval: ", interval, " , span: ", span)
+    history = robinhood().crypto.get_crypto_historicals(ticker, interval=interval, span=span)
+    times, prices = history_to_arrays(history, time_key='begins_at', price_key='open_price')
+    print("History fetch completed successfully with ", len(times), " results.")
+    return times, prices
+
+
+def get_cached_crypto_history(ticker, interval='hour', span='3month', cache=None):
+    # Same history as get_crypto_history, but served from the local cache. Only the bars newer than
+    # the last cached one are fetched. Returns (times, prices) arrays covering the requested span.
+    if not get_backend().cacheable:
+        return get_crypto_history_arrays(ticker, interval=interval, span=span)
+    if cache is None:
+        cache = HistoryCache()
+
+    time_now = time.time()
+    fetch_span = cache.fetch_span(ticker, interval, span, time_now)
+    if fetch_span is None:
+        print("History for ", ticker, " is up to date in the local cache")
+    else:
+        times, prices = get_crypto_history_arrays(ticker, interval=interval, span=fetch_span)
+        num_new = cache.append(ticker, interval, times, prices)
+        print("Cached ", num_new, " new bars for ", ticker)
+
+    return cache.load(ticker, interval, since=time_now - SPAN_SECONDS[span])
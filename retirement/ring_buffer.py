@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class PriceRingBuffer:
+    # Fixed-capacity store of (time, price) samples. Every sample is written twice, at i and
+    # i + capacity, so the newest k samples are always one contiguous slice and can be handed out
+    # as zero-copy NumPy views. Views alias the buffer: they're meant to be read within the tick that
+    # asked for them, not kept around.
+    #
+    # With num_instruments, every sample is a whole row of prices taken at one time, one per
+    # instrument (see portfolio.py). Prices then come back as (instruments x samples) views.
+    def __init__(self, capacity, num_instruments=None):
+        if capacity < 1:
+            raise Exception("ring buffer capacity must be at least 1")
+        self.capacity = capacity
+        self.num_instruments = num_instruments
+        self.time_data = np.zeros(2 * capacity, dtype=np.float64)
+        if num_instruments is None:
+            self.price_data = np.zeros(2 * capacity, dtype=np.float64)
+        else:
+            self.price_data = np.zeros((num_instruments, 2 * capacity), dtype=np.float64)
+        self.num_written = 0
+
+    def __len__(self):
+        return min(self.num_written, self.capacity)
+
+    def append(self, time_of_price, price):
+        index = self.num_written % self.capacity
+        self.time_data[index] = time_of_price
+        self.time_data[index + self.capacity] = time_of_price
+        self.price_data[..., index] = price
+        self.price_data[..., index + self.capacity] = price
+        self.num_written += 1
+
+    def extend(self, times, prices):
+        # Only the newest `capacity` samples can survive, so don't bother writing the rest
+        times = np.asarray(times, dtype=np.float64)[-self.capacity:]
+        prices = np.asarray(prices, dtype=np.float64)[..., -self.capacity:]
+        if self.num_instruments is not None:
+            prices = prices.T
+        for time_of_price, price in zip(times.tolist(), prices.tolist()):
+            self.append(time_of_price, price)
+
+    def window(self, num_samples=None):
+        # (start, stop) into the doubled arrays for the newest num_samples samples
+        available = len(self)
+        if num_samples is None or num_samples > available:
+            num_samples = available
+        stop = (self.num_written - 1) % self.capacity + 1 + self.capacity if self.num_written else 0
+        return stop - num_samples, stop
+
+    def latest_times(self, num_samples=None):
+        start, stop = self.window(num_samples)
+        return self.time_data[start:stop]
+
+    def latest_prices(self, num_samples=None):
+        start, stop = self.window(num_samples)
+        return self.price_data[..., start:stop]
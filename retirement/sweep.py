@@ -0,0 +1,328 @@
+import time
+import numpy as np
+
+
+# Columns of the ranked results table returned by sweep_ith_deriv
+SWEEP_RESULT_DTYPE = np.dtype([
+    ('deriv_dim', np.int64),
+    ('buy_threshold', np.float64),
+    ('sell_threshold', np.float64),
+    ('emer_escape_threshold', np.float64),  # nan when the emergency escape is off
+    ('final_value', np.float64),
+    ('min_fund_value', np.float64),
+    ('max_fund_value', np.float64),
+    ('num_trades', np.int64),
+])
+
+
+def default_grid():
+    # The thresholds the Manager sweeps unless told otherwise, as (deriv_dims, buy_thresholds,
+    # sell_thresholds, emer_escape_thresholds). Fresh arrays each call, so callers can change theirs.
+    num_steps_buy = 5
+    num_steps_sell = 5
+    buy_start = -.1
+    buy_end = .1
+    sell_start = -.1
+    sell_end = .1
+    return ([4],
+            np.arange(buy_start, buy_end, (buy_end - buy_start)/num_steps_buy),
+            np.arange(sell_start, sell_end, (sell_end - sell_start)/num_steps_sell),
+            [None])
+
+
+def sweep_ith_deriv(prices, times, deriv_dims, buy_thresholds, sell_thresholds, emer_escape_thresholds=(None,),
+                    allowance=100.00, min_samples=60, min_time_since_last_trade=1, clock=time.time):
+    # Evaluates every (deriv_dim, buy, sell, emergency escape) combination of IthDerivBasedQuantEngine
+    # over one price history without building an engine per combination. Each derivative order is
+    # computed once and all threshold combinations for it advance together as one NumPy batch.
+    #
+    # Results follow the engines exactly: the same trades, the same fund values, with whatever is
+    # still invested sold at the last price the way QuantEngine.close does. num_trades counts
+    # event points including that closing sale. clock is what "now" is for the trade spacing check,
+    # like QuantEngine.clock.
+    #
+    # Returns a structured array (see SWEEP_RESULT_DTYPE) sorted best final_value first.
+    sweep = IthDerivSweep(deriv_dims, buy_thresholds, sell_thresholds, emer_escape_thresholds,
+                          allowance, min_samples, min_time_since_last_trade, clock)
+    sweep.update(prices, times)
+    return sweep.results()
+
+
+class IthDerivSweep:
+    # sweep_ith_deriv fed one chunk of history at a time, for histories too big to hold at once.
+    # Sweeping consecutive chunks with update() and then calling results() gives exactly what
+    # sweep_ith_deriv returns for the whole series. Only the last few prices are kept between chunks.
+    def __init__(self, deriv_dims, buy_thresholds, sell_thresholds, emer_escape_thresholds=(None,),
+                 allowance=100.00, min_samples=60, min_time_since_last_trade=1, clock=time.time):
+        buy_thresholds = np.asarray(buy_thresholds, dtype=np.float64)
+        sell_thresholds = np.asarray(sell_thresholds, dtype=np.float64)
+        emer_escape_thresholds = np.array([np.nan if thresh is None else thresh
+                                           for thresh in emer_escape_thresholds], dtype=np.float64)
+
+        # One row per threshold combination, buy varying slowest
+        buy_grid, sell_grid, emer_grid = np.meshgrid(buy_thresholds, sell_thresholds, emer_escape_thresholds,
+                                                     indexing='ij')
+        buy_grid = buy_grid.ravel()
+        sell_grid = sell_grid.ravel()
+        emer_grid = emer_grid.ravel()
+
+        self.deriv_dims = sorted(set(int(dim) for dim in deriv_dims))
+        self.batches = [SweepBatch(deriv_dim, buy_grid, sell_grid, emer_grid, allowance)
+                        for deriv_dim in self.deriv_dims]
+        self.min_samples = min_samples
+        self.min_time_since_last_trade = min_time_since_last_trade
+        self.clock = clock
+        self.time_blocked = None
+        self.num_samples = 0
+        self.last_price = None
+        self.tail = np.zeros(0)  # the last few prices, to diff across chunk boundaries
+
+    def update(self, prices, times, derivs_by_dim=None):
+        # derivs_by_dim optionally maps deriv_dim to that order's differences already lined up with
+        # prices (entry i is np.diff(all_prices, deriv_dim) ending at prices[i]), e.g. computed once
+        # for a whole history and sliced per window. Those orders aren't diffed again.
+        prices = np.asarray(prices, dtype=np.float64)
+        times = np.asarray(times, dtype=np.float64)
+        if len(prices) == 0:
+            return
+
+        if self.time_blocked is None:
+            # Same rule as QuantEngine.can_trade: the first bar counts as the last trade
+            self.time_blocked = (self.clock() - times[0]) / 60.0 < self.min_time_since_last_trade
+
+        num_context = len(self.tail)
+        derivs = np.concatenate([self.tail, prices])
+        deriv_order = 0
+        for batch in self.batches:
+            if derivs_by_dim is not None and batch.deriv_dim in derivs_by_dim:
+                chunk_derivs = derivs_by_dim[batch.deriv_dim]
+            else:
+                # Each order is built from the previous one, so every order is only diffed once
+                while deriv_order < batch.deriv_dim:
+                    derivs = np.diff(derivs)
+                    deriv_order += 1
+
+                # chunk_derivs[i] is the derivative at prices[i], padded for bars too early to have one
+                missing = batch.deriv_dim - num_context
+                if missing > 0:
+                    chunk_derivs = np.concatenate([np.full(missing, np.nan), derivs])
+                else:
+                    chunk_derivs = derivs[-missing:]
+
+            first_bar = max(self.min_samples - 1, batch.deriv_dim) - self.num_samples
+            if self.time_blocked:
+                first_bar = len(prices)
+            batch.run(prices, chunk_derivs, max(first_bar, 0))
+
+        self.num_samples += len(prices)
+        self.last_price = prices[-1]
+        max_dim = self.deriv_dims[-1] if self.deriv_dims else 0
+        self.tail = np.concatenate([self.tail, prices])[-max_dim:] if max_dim > 0 else self.tail
+
+    def results(self):
+        if len(self.batches) == 0:
+            return np.zeros(0, dtype=SWEEP_RESULT_DTYPE)
+
+        tables = [batch.table(self.last_price) for batch in self.batches]
+        results = np.concatenate(tables)
+        return results[np.argsort(-results['final_value'], kind='stable')]
+
+
+class SweepBatch:
+    # Buy/sell state machine for every threshold combination of one deriv_dim at once. Signals for
+    # every combination and bar come out of a few 2-D array ops (a block of bars at a time, to bound
+    # memory), and only the trades themselves are walked one by one to keep the engines' arithmetic.
+    #
+    # Without the emergency escape, whether a combination is invested after a bar follows from the
+    # signals alone: a bar that only says buy leaves it invested, one that only says sell leaves it
+    # out, and a bar saying both (thresholds overlap) flips whatever it was. So the state is the last
+    # one-sided bar's, flipped once per two-sided bar since, and trades are where it changes. With the
+    # escape on, when to sell depends on the purchase price, so those combinations hop from trade to
+    # trade like QuantEngine.backtest, looking the next signal up instead of searching for it.
+    BLOCK_SIZE = 1 << 20  # combinations x bars per block
+
+    def __init__(self, deriv_dim, buy_grid, sell_grid, emer_grid, allowance):
+        num_combos = len(buy_grid)
+        self.deriv_dim = deriv_dim
+        self.buy_grid = buy_grid
+        self.sell_grid = sell_grid
+        self.emer_grid = emer_grid
+        self.funds = np.full(num_combos, allowance)
+        self.shares = np.zeros(num_combos)
+        self.invested = np.zeros(num_combos, dtype=bool)
+        self.last_purchase = np.zeros(num_combos)
+        self.min_fund = np.full(num_combos, allowance)
+        self.max_fund = np.full(num_combos, allowance)
+        self.num_trades = np.zeros(num_combos, dtype=np.int64)
+
+        # price * nan is never <= anything, so disabled escapes simply never fire
+        self.escape_level = np.full(num_combos, np.nan)
+        self.plain_combos = np.flatnonzero(np.isnan(emer_grid))
+        self.escape_combos = np.flatnonzero(~np.isnan(emer_grid))
+
+    def run(self, prices, derivs, first_bar):
+        # derivs[i] is the deriv_dim-th difference at prices[i]; bars before first_bar can't trade
+        if len(self.buy_grid) == 0 or first_bar >= len(prices):
+            return
+        prices = prices[first_bar:]
+        derivs = derivs[first_bar:]
+        block = max(self.BLOCK_SIZE // len(self.buy_grid), 1)
+        for start in range(0, len(prices), block):
+            block_prices = prices[start:start + block]
+            block_derivs = derivs[start:start + block]
+            price_list = block_prices.tolist()
+            if len(self.plain_combos):
+                for combo, bars in self.plain_trades(self.plain_combos, block_derivs):
+                    self.trade(combo, bars, price_list)
+            for combo in self.escape_combos.tolist():
+                self.trade(combo, self.escape_trades(combo, block_prices, block_derivs, price_list), price_list)
+
+    def plain_trades(self, combos, derivs):
+        # (combo, bars it trades on) for combinations without the emergency escape
+        num_bars = len(derivs)
+        wants_buy = derivs >= self.buy_grid[combos, None]
+        wants_sell = derivs <= self.sell_grid[combos, None]
+        one_sided = wants_buy != wants_sell
+        flips = np.cumsum(wants_buy & wants_sell, axis=1)
+
+        # Last one-sided bar at or before each bar, or -1 for none yet in this block
+        last = np.maximum.accumulate(np.where(one_sided, np.arange(num_bars), -1), axis=1)
+        rows = np.arange(len(combos))[:, None]
+        seen = last >= 0
+        last = np.maximum(last, 0)
+        state = np.where(seen, wants_buy[rows, last], self.invested[combos, None])
+        state ^= ((flips - np.where(seen, flips[rows, last], 0)) & 1).astype(bool)
+
+        changes = np.empty_like(state)
+        changes[:, 0] = state[:, 0] != self.invested[combos]
+        np.not_equal(state[:, 1:], state[:, :-1], out=changes[:, 1:])
+        for row in np.flatnonzero(changes.any(axis=1)).tolist():
+            yield int(combos[row]), np.flatnonzero(changes[row]).tolist()
+
+    def escape_trades(self, combo, prices, derivs, price_list):
+        # Bars the combination trades on, with its emergency escape
+        num_bars = len(prices)
+        next_buy = next_true(derivs >= self.buy_grid[combo])
+        next_sell = next_true(derivs <= self.sell_grid[combo])
+        emer = float(self.emer_grid[combo])
+        invested = bool(self.invested[combo])
+        escape_level = float(self.escape_level[combo])
+        bars = []
+        bar = 0
+        while bar < num_bars:
+            if not invested:
+                bar = next_buy[bar]
+                if bar >= num_bars:
+                    break
+                escape_level = price_list[bar] * emer
+            else:
+                stop = next_sell[bar]
+                # Holds are usually a few bars, which a plain loop checks faster than a NumPy call
+                if stop - bar <= 64:
+                    for index in range(bar, min(stop, num_bars)):
+                        if price_list[index] <= escape_level:
+                            stop = index
+                            break
+                else:
+                    bails = np.flatnonzero(prices[bar:stop] <= escape_level)
+                    if len(bails):
+                        stop = bar + int(bails[0])
+                if stop >= num_bars:
+                    break
+                bar = stop
+            bars.append(bar)
+            invested = not invested
+            bar += 1
+        return bars
+
+    def trade(self, combo, bars, prices):
+        # Alternating buys and sells on those bars, with the same arithmetic as QuantEngine.buy_at
+        # (how_much_to_buy being all available funds) and sell_at
+        if not bars:
+            return
+        funds = float(self.funds[combo])
+        shares = float(self.shares[combo])
+        invested = bool(self.invested[combo])
+        last_purchase = float(self.last_purchase[combo])
+        min_fund = float(self.min_fund[combo])
+        max_fund = float(self.max_fund[combo])
+        emer = float(self.emer_grid[combo])
+        for bar in bars:
+            price = prices[bar]
+            if not invested:
+                amounts = funds
+                funds = amounts - amounts
+                shares = shares + amounts / price
+                last_purchase = price
+                invested = True
+            else:
+                amounts = shares * price
+                funds = funds + amounts
+                shares = shares - shares
+                min_fund = min(min_fund, amounts)
+                max_fund = max(max_fund, amounts)
+                invested = False
+        self.funds[combo] = funds
+        self.shares[combo] = shares
+        self.invested[combo] = invested
+        self.last_purchase[combo] = last_purchase
+        self.min_fund[combo] = min_fund
+        self.max_fund[combo] = max_fund
+        self.escape_level[combo] = last_purchase * emer if invested else np.nan
+        self.num_trades[combo] += len(bars)
+
+    def table(self, last_price):
+        # Results as if whatever is still held were sold at last_price, like QuantEngine.close.
+        # The batch itself is left as is, so it can keep going.
+        funds = self.funds.copy()
+        shares = self.shares.copy()
+        invested = self.invested.copy()
+        min_fund = self.min_fund.copy()
+        max_fund = self.max_fund.copy()
+        num_trades = self.num_trades.copy()
+        if last_price is not None:
+            sell_position(invested.copy(), last_price, funds, shares, invested, self.escape_level.copy(),
+                          min_fund, max_fund, num_trades)
+
+        table = np.zeros(len(self.buy_grid), dtype=SWEEP_RESULT_DTYPE)
+        table['deriv_dim'] = self.deriv_dim
+        table['buy_threshold'] = self.buy_grid
+        table['sell_threshold'] = self.sell_grid
+        table['emer_escape_threshold'] = self.emer_grid
+        table['final_value'] = funds
+        table['min_fund_value'] = min_fund
+        table['max_fund_value'] = max_fund
+        table['num_trades'] = num_trades
+        return table
+
+
+def next_true(mask):
+    # As a list, the first index at or after each index where mask is set, or len(mask) for none;
+    # one entry longer than mask so len(mask) itself can be looked up too
+    num_bars = len(mask)
+    indices = np.where(mask, np.arange(num_bars), num_bars)
+    return np.minimum.accumulate(indices[::-1])[::-1].tolist() + [num_bars]
+
+
+def sell_position(selling, price, funds, shares, invested, escape_level, min_fund, max_fund, num_trades):
+    # Same arithmetic as QuantEngine.sell_at
+    amounts = shares[selling] * price
+    funds[selling] = funds[selling] + amounts
+    shares[selling] = shares[selling] - shares[selling]
+    min_fund[selling] = np.minimum(min_fund[selling], amounts)
+    max_fund[selling] = np.maximum(max_fund[selling], amounts)
+    escape_level[selling] = np.nan
+    invested[selling] = False
+    num_trades[selling] += 1
+
+
+def print_sweep_results(results, num_rows=10):
+    print("Top ", min(num_rows, len(results)), " of ", len(results), " combinations:")
+    for row in results[:num_rows]:
+        escape = "off" if np.isnan(row['emer_escape_threshold']) else "%.2f" % row['emer_escape_threshold']
+        print(str(row['deriv_dim']) + 'thDeriv_buy:' + "%.4f" % row['buy_threshold'] +
+              ',sell:' + "%.4f" % row['sell_threshold'] + ',escape:' + escape,
+              " End: ", row['final_value'],
+              " Min: ", row['min_fund_value'],
+              " Max: ", row['max_fund_value'],
+              " Trades: ", row['num_trades'])
@@ -0,0 +1,310 @@
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import quant
+import sweep
+import market_calendar
+import parallel_runner
+
+from concurrent.futures import ProcessPoolExecutor
+from history_cache import HistoryCache
+
+
+# Walk-forward validation: optimize engine parameters on a training window, then see how the
+# winners do on the window right after it, which they've never seen. The windows roll forward
+# through the history and every fold runs in its own worker process.
+#
+# Everything the folds have in common is computed once up front and shared through memory-mapped
+# files: the price history, every swept derivative order over the whole history, and the calendar
+# window masks. Overlapping training windows just slice them.
+#
+#   python walk_forward.py DOGE --interval hour --train-bars 720 --test-bars 168
+
+FEATURE_WINDOWS = ('just_opened', 'just_closed')
+
+
+def walk_forward_windows(num_bars, train_bars, test_bars, step_bars=None):
+    # (train_start, train_stop, test_stop) for each fold. Test windows follow their training window
+    # directly and, by default, don't overlap each other.
+    step_bars = step_bars or test_bars
+    windows = []
+    train_start = 0
+    while train_start + train_bars + test_bars <= num_bars:
+        windows.append((train_start, train_start + train_bars, train_start + train_bars + test_bars))
+        train_start += step_bars
+    return windows
+
+
+def aligned_derivs(prices, deriv_dim):
+    # np.diff(prices, deriv_dim) lined up so entry i is the difference ending at bar i
+    derivs = np.full(len(prices), np.nan)
+    derivs[deriv_dim:] = np.diff(prices, deriv_dim)
+    return derivs
+
+
+class PrecomputedWindows:
+    # Stands in for a SessionCalendar on an engine backtesting a slice of a history whose window
+    # masks were computed once for the whole thing. Anything else goes to the real calendar.
+    def __init__(self, times, masks, calendar=None):
+        self.times = times
+        self.masks = masks
+        self.calendar = calendar or market_calendar.local_calendar()
+
+    def window_mask(self, name, epoch_times):
+        if len(epoch_times) == 0:
+            return np.zeros(0, dtype=bool)
+        start = int(np.searchsorted(self.times, epoch_times[0], side='left'))
+        return np.asarray(self.masks[name][start:start + len(epoch_times)], dtype=bool)
+
+    def in_window(self, name, epoch_time):
+        return self.calendar.in_window(name, epoch_time)
+
+
+def ith_deriv_grid(deriv_dims=(1, 2, 4), buy_thresholds=None, sell_thresholds=None, emer_escape_thresholds=(None,)):
+    if buy_thresholds is None:
+        buy_thresholds = np.linspace(-.01, .01, 9)
+    if sell_thresholds is None:
+        sell_thresholds = np.linspace(-.01, .01, 9)
+    return {
+        'deriv_dims': list(deriv_dims),
+        'buy_thresholds': list(buy_thresholds),
+        'sell_thresholds': list(sell_thresholds),
+        'emer_escape_thresholds': list(emer_escape_thresholds),
+    }
+
+
+def time_based_grid(emer_escape_thresholds=(0.85, 0.9, 0.95, 0.98), min_samples=(60,)):
+    return {
+        'emer_escape_thresholds': list(emer_escape_thresholds),
+        'min_samples': list(min_samples),
+    }
+
+
+def build_ith_deriv(params):
+    return quant.IthDerivBasedQuantEngine(deriv_dim=params['deriv_dim'],
+                                          buy_threshold=params['buy_threshold'],
+                                          sell_threshold=params['sell_threshold'],
+                                          emer_escape_threshold=params['emer_escape_threshold'])
+
+
+def build_time_based(params):
+    engine = quant.TimeBasedQuantEngine()
+    engine.set_emer_escape_threshold(params['emer_escape_threshold'])
+    engine.min_samples = params['min_samples']
+    return engine
+
+
+def evaluate(engine, prices, times, calendar=None, warmup=None):
+    # Backtest, liquidate like Manager.close does, and boil it down to a few numbers. warmup is
+    # (prices, times) of bars right before the window that the engine only looks at, so it's ready
+    # to trade from the window's first bar instead of spending the window's start on min_samples.
+    engine.journal = parallel_runner.quiet_journal
+    if calendar is not None:
+        engine.calendar = calendar
+    if warmup is not None and len(warmup[0]) > 0:
+        warm_prices, warm_times = warmup
+        # The first bar counts as the last trade, like it does in record_sample
+        engine.time_of_last_trade = warm_times[0]
+        engine.load_history(warm_prices, warm_times)
+    engine.backtest_chunk(prices, times)
+    engine.close()
+    return {
+        'final_value': float(engine.funds_available),
+        'return': float((engine.funds_available - engine.seed_money) / engine.seed_money),
+        'num_trades': engine.ledger.num_trades(),
+        'max_drawdown': engine.ledger.max_drawdown(),
+    }
+
+
+def optimize_ith_deriv(prices, times, derivs_by_dim, grid):
+    # Every grid combination in one vectorized sweep over the window, reusing the shared derivatives
+    run = sweep.IthDerivSweep(grid['deriv_dims'], grid['buy_thresholds'], grid['sell_thresholds'],
+                              grid['emer_escape_thresholds'])
+    run.update(prices, times, derivs_by_dim)
+    best = run.results()[0]
+    params = {
+        'deriv_dim': int(best['deriv_dim']),
+        'buy_threshold': float(best['buy_threshold']),
+        'sell_threshold': float(best['sell_threshold']),
+        'emer_escape_threshold': None if np.isnan(best['emer_escape_threshold'])
+        else float(best['emer_escape_threshold']),
+    }
+    return params, float(best['final_value'])
+
+
+def optimize_time_based(prices, times, calendar, grid):
+    # Few enough combinations to just backtest each one. The calendar masks are shared.
+    best_params = None
+    best_value = None
+    for escape in grid['emer_escape_thresholds']:
+        for min_samples in grid['min_samples']:
+            params = {'emer_escape_threshold': escape, 'min_samples': min_samples}
+            value = evaluate(build_time_based(params), prices, times, calendar)['final_value']
+            if best_value is None or value > best_value:
+                best_params, best_value = params, value
+    return best_params, best_value
+
+
+def warmup_bars(engine, prices, times, train_start, train_stop):
+    # The end of the training window, as much of it as the engine needs to make its first decision
+    start = max(train_start, train_stop - engine.required_history())
+    return np.asarray(prices[start:train_stop]), np.asarray(times[start:train_stop])
+
+
+def run_fold(fold):
+    ticker, paths, window, ith_grid, time_grid = fold
+    train_start, train_stop, test_stop = window
+    history = parallel_runner.load_history(paths['history'])
+    times, prices = history[0], history[1]
+    derivs = {deriv_dim: parallel_runner.load_history(path) for deriv_dim, path in paths['derivs'].items()}
+    masks = {name: parallel_runner.load_history(path) for name, path in paths['masks'].items()}
+    calendar = PrecomputedWindows(times, masks)
+
+    train = slice(train_start, train_stop)
+    test = slice(train_stop, test_stop)
+    result = {
+        'ticker': ticker,
+        'window': window,
+        'train_times': (float(times[train_start]), float(times[train_stop - 1])),
+        'test_times': (float(times[train_stop]), float(times[test_stop - 1])),
+        'buy_and_hold': float((prices[test_stop - 1] - prices[train_stop]) / prices[train_stop]),
+    }
+
+    if ith_grid is not None:
+        params, in_sample = optimize_ith_deriv(np.asarray(prices[train]), np.asarray(times[train]),
+                                               {deriv_dim: derivs[deriv_dim][train] for deriv_dim in derivs},
+                                               ith_grid)
+        engine = build_ith_deriv(params)
+        result['ith_deriv'] = {
+            'params': params,
+            'in_sample_value': in_sample,
+            'out_of_sample': evaluate(engine, np.asarray(prices[test]), np.asarray(times[test]),
+                                      warmup=warmup_bars(engine, prices, times, train_start, train_stop)),
+        }
+
+    if time_grid is not None:
+        params, in_sample = optimize_time_based(np.asarray(prices[train]), np.asarray(times[train]), calendar,
+                                                time_grid)
+        engine = build_time_based(params)
+        result['time_based'] = {
+            'params': params,
+            'in_sample_value': in_sample,
+            'out_of_sample': evaluate(engine, np.asarray(prices[test]), np.asarray(times[test]), calendar,
+                                      warmup=warmup_bars(engine, prices, times, train_start, train_stop)),
+        }
+    return result
+
+
+class WalkForwardRunner:
+    def __init__(self, max_workers=None, work_dir=None, quiet=True):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.quiet = quiet
+        self.owns_work_dir = work_dir is None
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix='retirement_walk_forward_')
+        self.histories = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.cleanup()
+
+    def cleanup(self):
+        if self.owns_work_dir and os.path.exists(self.work_dir):
+            shutil.rmtree(self.work_dir)
+
+    def add_history(self, ticker, prices, times, deriv_dims=(1, 2, 4)):
+        # Writes the history and the features every fold shares, once, for the workers to map
+        times = np.asarray(times, dtype=np.float64)
+        prices = np.asarray(prices, dtype=np.float64)
+        paths = {
+            'history': os.path.join(self.work_dir, ticker + '.npy'),
+            'derivs': {},
+            'masks': {},
+        }
+        np.save(paths['history'], np.vstack([times, prices]))
+        for deriv_dim in sorted(set(int(dim) for dim in deriv_dims)):
+            paths['derivs'][deriv_dim] = os.path.join(self.work_dir, ticker + '_diff' + str(deriv_dim) + '.npy')
+            np.save(paths['derivs'][deriv_dim], aligned_derivs(prices, deriv_dim))
+        calendar = market_calendar.local_calendar()
+        for name in FEATURE_WINDOWS:
+            paths['masks'][name] = os.path.join(self.work_dir, ticker + '_' + name + '.npy')
+            np.save(paths['masks'][name], calendar.window_mask(name, times))
+        self.histories[ticker] = (len(times), paths)
+
+    def run(self, train_bars, test_bars, step_bars=None, ith_grid=None, time_grid=None, tickers=None):
+        # One work unit per (ticker, fold). Pass ith_grid=False or time_grid=False to skip an engine.
+        if ith_grid is None:
+            ith_grid = ith_deriv_grid()
+        if time_grid is None:
+            time_grid = time_based_grid()
+        ith_grid = ith_grid or None
+        time_grid = time_grid or None
+        if tickers is None:
+            tickers = list(self.histories.keys())
+
+        folds = []
+        for ticker in tickers:
+            num_bars, paths = self.histories[ticker]
+            if ith_grid is not None and set(int(dim) for dim in ith_grid['deriv_dims']) - set(paths['derivs']):
+                raise Exception("add_history for " + ticker + " didn't precompute every swept deriv_dim")
+            for window in walk_forward_windows(num_bars, train_bars, test_bars, step_bars):
+                folds.append((ticker, paths, window, ith_grid, time_grid))
+        if len(folds) == 0:
+            return []
+
+        initializer = parallel_runner.silence_worker if self.quiet else None
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=initializer) as executor:
+            return list(executor.map(run_fold, folds))
+
+    @staticmethod
+    def print_summary(results):
+        for engine_key in ('ith_deriv', 'time_based'):
+            folds = [result for result in results if engine_key in result]
+            if len(folds) == 0:
+                continue
+            print("Walk-forward ", engine_key, " over ", len(folds), " folds:")
+            for result in folds:
+                fold = result[engine_key]
+                print("  ", result['ticker'], " test from ", result['test_times'][0],
+                      " params: ", fold['params'],
+                      " in sample: %.2f" % fold['in_sample_value'],
+                      " out of sample: %.2f%%" % (fold['out_of_sample']['return'] * 100),
+                      " (buy and hold %.2f%%)" % (result['buy_and_hold'] * 100))
+
+            # Chaining the test windows gives the return of actually trading this way
+            compounded = np.prod([1 + result[engine_key]['out_of_sample']['return'] for result in folds]) - 1
+            buy_and_hold = np.prod([1 + result['buy_and_hold'] for result in folds]) - 1
+            print("  Compounded out of sample: %.2f%%  buy and hold: %.2f%%" % (compounded * 100, buy_and_hold * 100))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Walk-forward optimization over cached history')
+    parser.add_argument('tickers', nargs='+')
+    parser.add_argument('--interval', default='hour')
+    parser.add_argument('--train-bars', type=int, default=24 * 30)
+    parser.add_argument('--test-bars', type=int, default=24 * 7)
+    parser.add_argument('--step-bars', type=int, default=None)
+    parser.add_argument('--deriv-dims', nargs='+', type=int, default=[1, 2, 4])
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    cache = HistoryCache()
+    with WalkForwardRunner(max_workers=args.workers) as runner:
+        for ticker in args.tickers:
+            times, prices = cache.load(ticker, args.interval)
+            if len(times) == 0:
+                print("Nothing cached for ", ticker, " at interval ", args.interval)
+                continue
+            runner.add_history(ticker, prices, times, args.deriv_dims)
+        results = runner.run(args.train_bars, args.test_bars, args.step_bars,
+                             ith_grid=ith_deriv_grid(args.deriv_dims))
+        runner.print_summary(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules under retirement/ import each other by bare name, the way they're run
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'retirement'))
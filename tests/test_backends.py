@@ -0,0 +1,83 @@
+import time
+import numpy as np
+import pytest
+import backends
+
+from ledger import BUY_SIDE, SELL_SIDE
+
+
+# Replays of 60 second bars, priced 1.0, 1.1, 1.2, ... so a price says which bar it came from
+
+def make_replay(num_bars=20, **kwargs):
+    times = 1.6e9 + 60.0 * np.arange(num_bars)
+    prices = 1.0 + 0.1 * np.arange(num_bars)
+    return backends.ReplayBackend({'A': (times, prices)}, **kwargs)
+
+
+def test_warmup_bars_are_history_and_the_rest_are_replayed():
+    backend = make_replay(warmup_bars=5, speed=None)
+    times, prices = backend.get_history_arrays('A', 'hour', 'day')
+    np.testing.assert_array_equal(prices, [1.0, 1.1, 1.2, 1.3, 1.4])
+    assert [backend.get_price('A') for _ in range(3)] == pytest.approx([1.5, 1.6, 1.7])
+    assert backend.now() == times[-1] + 3 * 60.0
+    assert not backend.exhausted()
+
+
+def test_direct_trade_fills_at_the_price_after_the_latency_without_waiting():
+    backend = make_replay(speed=None, fill_latency=120.0)
+    backend.get_price('A')
+    start = time.perf_counter()
+    fill = backend.execute_trade('A', 100.0)
+    assert time.perf_counter() - start < 0.05
+    assert fill['price'] == pytest.approx(1.2)  # two bars on
+    assert fill['shares'] == pytest.approx(100.0 / 1.2)
+    assert fill['time'] == backend.now() + 120.0
+
+
+def test_order_stays_open_until_the_latency_goes_by_on_the_replay_clock():
+    backend = make_replay(speed=None, fill_latency=120.0)
+    backend.get_price('A')
+    order_id = backend.submit_order('A', BUY_SIDE, amount=100.0)
+    assert backend.order_status(order_id) == {'state': 'open', 'shares': 0.0, 'amount': 0.0}
+    backend.get_price('A')
+    assert backend.order_status(order_id)['state'] == 'open'
+    backend.get_price('A')
+    status = backend.order_status(order_id)
+    assert status['state'] == 'filled'
+    assert status['amount'] == 100.0 and status['shares'] == pytest.approx(100.0 / 1.2)
+    assert len(backend.fills) == 1
+
+
+def test_latency_is_scaled_by_the_replay_speed():
+    # A minute of latency is 60ms of wall time at 1000x
+    backend = make_replay(speed=1000.0, fill_latency=60.0)
+    backend.start()
+    order_id = backend.submit_order('A', SELL_SIDE, shares=10.0)
+    assert backend.order_status(order_id)['state'] == 'open'
+    deadline = time.perf_counter() + 1.0
+    while backend.order_status(order_id)['state'] == 'open':
+        assert time.perf_counter() < deadline
+        time.sleep(0.005)
+    assert backend.fills[0]['time'] == backend.orders[order_id]['due']
+
+
+def test_order_still_open_when_the_replay_runs_out_fills_at_the_last_price():
+    backend = make_replay(num_bars=3, speed=None, fill_latency=600.0)
+    backend.get_price('A')
+    order_id = backend.submit_order('A', SELL_SIDE, shares=10.0)
+    backend.get_price('A')
+    backend.get_price('A')
+    assert backend.exhausted()
+    status = backend.order_status(order_id)
+    assert status['state'] == 'filled' and status['amount'] == pytest.approx(12.0)
+
+
+def test_cancelled_order_never_fills():
+    backend = make_replay(speed=None, fill_latency=120.0)
+    backend.get_price('A')
+    order_id = backend.submit_order('A', BUY_SIDE, amount=100.0)
+    backend.cancel_order(order_id)
+    for _ in range(5):
+        backend.get_price('A')
+    assert backend.order_status(order_id)['state'] == 'cancelled'
+    assert backend.fills == []
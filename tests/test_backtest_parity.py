@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+import quant
+import journal
+import benchmark
+
+from ledger import COLUMNS
+
+
+# QuantEngine.backtest and backtest_chunk have to trade exactly like feeding the same bars one at a
+# time through update_model / should_buy / should_sell, which is what the live loop does.
+
+NUM_BARS = 3000
+
+
+def make_engines(clock):
+    engines = [quant.TimeBasedQuantEngine(), quant.BaselineQuantEngine(), quant.IthDerivBasedQuantEngine()]
+    escaping = quant.TimeBasedQuantEngine()
+    escaping.set_emer_escape_threshold(0.98)
+    engines.append(escaping)
+    for buy_threshold in (-0.004, 0.0, 0.004):
+        for sell_threshold in (-0.004, 0.0, 0.004):
+            engines.append(quant.IthDerivBasedQuantEngine(deriv_dim=4, buy_threshold=buy_threshold,
+                                                          sell_threshold=sell_threshold))
+    engines.append(quant.IthDerivBasedQuantEngine(deriv_dim=2, buy_threshold=0.001, sell_threshold=-0.001,
+                                                  emer_escape_threshold=0.97))
+    for engine in engines:
+        engine.journal = journal.Journal(verbosity=journal.OFF)
+        # The trade spacing check looks at the clock, so pin it
+        engine.clock = clock
+    return engines
+
+
+def tick_by_tick(engines, times, prices):
+    for price, time_of_price in zip(prices.tolist(), times.tolist()):
+        for engine in engines:
+            engine.update_model(price, time_of_price)
+            if engine.should_buy():
+                engine.buy()
+            elif engine.should_sell():
+                engine.sell()
+
+
+def uneven_chunks(num_bars, seed):
+    rng = np.random.default_rng(seed)
+    start = 0
+    while start < num_bars:
+        stop = start + int(rng.choice([1, 2, 3, 7, 50, 400, 1500]))
+        yield start, stop
+        start = stop
+
+
+def assert_same_trades(expected, actual):
+    for engine, other in zip(expected, actual):
+        assert engine.funds_available == pytest.approx(other.funds_available, rel=1e-12), engine.name
+        assert engine.shares_owned == pytest.approx(other.shares_owned, rel=1e-12), engine.name
+        assert engine.invested == other.invested, engine.name
+        assert len(engine.ledger) == len(other.ledger), engine.name
+        for name in COLUMNS:
+            np.testing.assert_allclose(engine.ledger.column(name), other.ledger.column(name), rtol=1e-12,
+                                       err_msg=engine.name + ' ' + name)
+
+
+@pytest.mark.parametrize('regime,bar_seconds', [('random_walk', 3600), ('mean_reverting', 900),
+                                                ('trending', 15)])
+def test_backtest_matches_tick_by_tick(regime, bar_seconds):
+    times, prices = benchmark.synthetic_prices(NUM_BARS, regime, bar_seconds, seed=bar_seconds)
+    clock = lambda: times[-1] + 3600.0
+
+    ticked = make_engines(clock)
+    tick_by_tick(ticked, times, prices)
+
+    backtested = make_engines(clock)
+    for engine in backtested:
+        engine.backtest(prices, times)
+
+    chunked = make_engines(clock)
+    for start, stop in uneven_chunks(NUM_BARS, bar_seconds):
+        for engine in chunked:
+            engine.backtest_chunk(prices[start:stop], times[start:stop])
+
+    # Something has to actually trade for this to mean anything
+    assert sum(len(engine.ledger) for engine in ticked) > 20
+    assert_same_trades(ticked, backtested)
+    assert_same_trades(ticked, chunked)
+
+
+def test_backtest_blocked_by_recent_trade_matches_tick_by_tick():
+    # With the last trade too recent on the clock, nothing that needs trade spacing trades either way
+    times, prices = benchmark.synthetic_prices(500, 'random_walk', 60, seed=3)
+    clock = lambda: times[0] + 1.0
+
+    ticked = make_engines(clock)
+    tick_by_tick(ticked, times, prices)
+    backtested = make_engines(clock)
+    for engine in backtested:
+        engine.backtest(prices, times)
+
+    assert_same_trades(ticked, backtested)
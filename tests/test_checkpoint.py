@@ -0,0 +1,107 @@
+import json
+import time
+import asyncio
+import numpy as np
+import quant
+import orders
+import journal
+import pipeline
+import benchmark
+import checkpoint
+
+from ledger import COLUMNS
+from quote_client import RateLimiter
+from retirement import Manager
+
+
+# A Manager restored from a checkpoint and caught up has to end up trading exactly like one that
+# streamed the whole history in the first place.
+
+def test_restored_manager_catches_up_like_an_uninterrupted_one(tmp_path, capsys):
+    times, prices = benchmark.synthetic_prices(6000, 'mean_reverting', 900, seed=5)
+    cut = 4500
+    path = str(tmp_path / 'DOGE.npz')
+
+    uninterrupted = Manager('DOGE', plotting=False)
+    uninterrupted.stream_history(pipeline.array_source(times[:cut], prices[:cut], chunk_size=1000))
+    uninterrupted.save_checkpoint(path)
+    restored = Manager.from_checkpoint(path, plotting=False)
+
+    assert uninterrupted.catch_up(pipeline.array_source(times, prices)) == len(times) - cut
+    assert restored.catch_up(pipeline.array_source(times, prices)) == len(times) - cut
+    for tick in range(100):
+        price, time_of_price = prices[-1] * (1 + 0.01 * np.sin(tick)), times[-1] + 15.0 * (tick + 1)
+        uninterrupted.process_sample(price, time_of_price)
+        restored.process_sample(price, time_of_price)
+
+    assert [engine.name for engine in restored.engines] == [engine.name for engine in uninterrupted.engines]
+    assert sum(len(engine.ledger) for engine in uninterrupted.engines) > 0
+    for engine, other in zip(uninterrupted.engines, restored.engines):
+        assert engine.funds_available == other.funds_available, engine.name
+        assert engine.shares_owned == other.shares_owned, engine.name
+        for name in COLUMNS:
+            np.testing.assert_array_equal(engine.ledger.column(name), other.ledger.column(name),
+                                          err_msg=engine.name + ' ' + name)
+
+
+def test_engines_trading_off_features_checkpoint_their_latest_diffs(capsys):
+    times, prices = benchmark.synthetic_prices(3000, 'random_walk', 900, seed=2)
+    manager = Manager('DOGE', plotting=False)
+    manager.stream_history(pipeline.array_source(times[:2000], prices[:2000], chunk_size=500))
+    for price, time_of_price in zip(prices[2000:].tolist(), times[2000:].tolist()):
+        manager.process_sample(price, time_of_price)
+
+    meta, _ = manager.checkpoint_state()
+    for engine, state in zip(manager.engines, meta['engines']):
+        if isinstance(engine, quant.IthDerivBasedQuantEngine):
+            assert engine.features is not None
+            assert state['latest_deriv'] == np.diff(prices, engine.deriv_dim)[-1], engine.name
+            assert len(state['diff_state']) == engine.deriv_dim
+
+
+def test_order_in_flight_is_followed_up_after_a_restart():
+    # The engine's order is acked and partly filled when the checkpoint is taken, then the process
+    # goes away. The restored engine waits on the same order instead of forgetting it or sending
+    # another one.
+    broker = orders.FakeBroker(lambda ticker: 2.0, num_fills=2, fill_interval=3600.0)
+    engine = quant.BaselineQuantEngine()
+    engine.journal = journal.Journal(verbosity=journal.OFF)
+    engine.update_model(2.0, 1.0)
+    saved = {}
+
+    async def crash():
+        router = orders.OrderRouter(broker, rate_limiter=RateLimiter(rate=1e9, burst=10 ** 9), poll_interval=0.01)
+        router.register(engine, 'A')
+        asyncio.ensure_future(router.run())
+        await asyncio.sleep(0)
+        engine.buy()
+        deadline = time.perf_counter() + 5.0
+        while engine.pending_order.filled_shares == 0:
+            assert time.perf_counter() < deadline
+            await asyncio.sleep(0.005)
+        arrays = {}
+        saved['state'] = json.loads(json.dumps(checkpoint.engine_state(engine, 0, arrays)))
+        saved['arrays'] = arrays
+
+    asyncio.run(crash())
+    restored = checkpoint.restore_engine(saved['state'], 0, saved['arrays'])
+    restored.journal = journal.Journal(verbosity=journal.OFF)
+    assert restored.pending_order is not None and not restored.invested
+    broker.fill_interval = 0.0  # the rest fills while we're down
+
+    async def resume():
+        router = orders.OrderRouter(broker, rate_limiter=RateLimiter(rate=1e9, burst=10 ** 9), poll_interval=0.01)
+        router.register(restored, 'A')
+        task = asyncio.ensure_future(router.run())
+        deadline = time.perf_counter() + 5.0
+        while restored.pending_order is not None:
+            assert time.perf_counter() < deadline
+            await asyncio.sleep(0.005)
+        router.stop()
+        await task
+
+    asyncio.run(resume())
+    assert len(broker.orders) == 1
+    assert restored.invested and restored.shares_owned == 50.0
+    assert restored.funds_available == 0.0
+    assert len(restored.ledger) == 1
@@ -0,0 +1,37 @@
+import quant
+import journal
+
+
+def always_buying_engine():
+    engine = quant.IthDerivBasedQuantEngine(deriv_dim=1, buy_threshold=-1e9, sell_threshold=-1e9)
+    engine.journal = journal.Journal(verbosity=journal.DECISIONS)
+    return engine
+
+
+def recorded_codes(engine):
+    return engine.journal.records()['code'].tolist()
+
+
+def test_default_journal_keeps_trades_quietly():
+    default = journal.default_journal()
+    assert default.verbosity == journal.TRADES
+    assert not default.echo
+
+
+def test_buy_held_back_by_trade_spacing_says_so():
+    engine = always_buying_engine()
+    start = 1.6e9
+    engine.clock = lambda: start + 30.0  # half a minute after the first sample
+    for bar in range(engine.min_samples + 1):
+        engine.update_model(1.0 + bar * 0.01, start + bar * 0.1)
+    assert not engine.should_buy()
+    assert recorded_codes(engine) == [journal.BUY_TOO_SOON]
+
+
+def test_trade_held_back_by_sample_count_says_so():
+    engine = always_buying_engine()
+    engine.update_model(1.0, 1.6e9)
+    engine.record_blocked(buying=True)
+    engine.record_blocked(buying=False)
+    assert recorded_codes(engine) == [journal.BUY_TOO_FEW_SAMPLES, journal.SELL_TOO_FEW_SAMPLES]
+    assert all(kind == journal.DECISION for kind in engine.journal.records()['kind'].tolist())
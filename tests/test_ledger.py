@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from ledger import TradeLedger, BUY_SIDE, SELL_SIDE
+
+
+def ledger_of(*trades):
+    # trades are (price, shares, side) starting from 100 in cash
+    ledger = TradeLedger()
+    cash = 100.0
+    for index, (price, shares, side) in enumerate(trades):
+        amount = price * shares
+        cash -= side * amount
+        ledger.append(float(index), price, shares, side, amount, cash)
+    return ledger
+
+
+def test_win_rate_counts_round_trips_filled_in_parts():
+    ledger = ledger_of((1.0, 30.0, BUY_SIDE), (1.0, 70.0, BUY_SIDE),  # 100 in, in two fills
+                       (1.2, 50.0, SELL_SIDE), (0.9, 50.0, SELL_SIDE),  # 105 out: a win
+                       (1.0, 105.0, BUY_SIDE),
+                       (0.5, 105.0, SELL_SIDE))  # a loss
+    sides, amounts = ledger.legs()
+    assert sides.tolist() == [BUY_SIDE, SELL_SIDE, BUY_SIDE, SELL_SIDE]
+    np.testing.assert_allclose(amounts, [100.0, 105.0, 105.0, 52.5])
+    assert ledger.win_rate() == 0.5
+
+
+def test_win_rate_without_a_round_trip():
+    assert np.isnan(TradeLedger().win_rate())
+    assert np.isnan(ledger_of((1.0, 10.0, BUY_SIDE)).win_rate())
+
+
+def test_max_drawdown_follows_cash_plus_position():
+    # Only half the cash goes in, so the account drops 25% when the price halves, not 50%
+    ledger = ledger_of((1.0, 50.0, BUY_SIDE), (0.5, 50.0, SELL_SIDE))
+    np.testing.assert_allclose(ledger.equity(), [100.0, 75.0])
+    assert ledger.max_drawdown() == pytest.approx(0.25)
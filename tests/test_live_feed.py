@@ -0,0 +1,74 @@
+import asyncio
+import itertools
+import live_feed
+
+
+def test_full_queue_drops_the_oldest_sample():
+    feed = live_feed.LiveFeed(live_feed.FakeQuoteSource({'A': [1.0]}), ['A'], queue_size=2)
+
+    async def main():
+        feed.queues = {'A': asyncio.Queue(maxsize=2)}
+        for sample in [(1.0, 0.0), (2.0, 1.0), (3.0, 2.0)]:
+            feed.enqueue('A', sample)
+        return [feed.queues['A'].get_nowait() for _ in range(feed.queues['A'].qsize())]
+
+    assert asyncio.run(main()) == [(2.0, 1.0), (3.0, 2.0)]
+    assert feed.stats['A'].dropped == 1
+
+
+def test_samples_arrive_in_order_stamped_by_the_clock():
+    ticks = itertools.count(100)
+    feed = live_feed.LiveFeed(live_feed.FakeQuoteSource({'A': [1.0, 2.0, 3.0]}), ['A'], interval=0,
+                              clock=lambda: float(next(ticks)))
+    received = []
+    feed.subscribe('A', lambda price, time_of_price: received.append((price, time_of_price)))
+    asyncio.run(feed.run(max_ticks=5))
+
+    assert received == [(1.0, 100.0), (2.0, 101.0), (3.0, 102.0), (3.0, 103.0), (3.0, 104.0)]
+    assert feed.stats['A'].samples == 5
+    assert feed.stats['A'].dropped == 0
+
+
+def test_slow_quote_skips_ticks_instead_of_piling_up():
+    source = live_feed.FakeQuoteSource({'A': [1.0]}, latency=0.05)
+    feed = live_feed.LiveFeed(source, ['A'], interval=0.01)
+    asyncio.run(feed.run(max_ticks=10))
+
+    stats = feed.stats['A']
+    assert stats.skipped_polls > 0
+    assert stats.polls + stats.skipped_polls == feed.num_ticks
+    assert source.num_calls['A'] == stats.polls
+
+
+def test_failing_subscriber_is_counted_and_does_not_stop_the_feed():
+    feed = live_feed.LiveFeed(live_feed.FakeQuoteSource({'A': [1.0], 'B': [2.0]}), ['A', 'B'],
+                              interval=0, queue_size=1)
+    received = []
+
+    def broken(price, time_of_price):
+        raise ValueError("boom")
+
+    feed.subscribe('A', broken)
+    feed.subscribe('A', lambda price, time_of_price: received.append(price))
+
+    async def main():
+        # Shutdown must not wait on a queue nobody will read
+        await asyncio.wait_for(feed.run(max_ticks=20), timeout=5.0)
+
+    asyncio.run(main())
+
+    stats = feed.stats['A']
+    assert stats.callback_errors == len(received) > 0
+    assert len(received) + stats.dropped == stats.samples
+    assert feed.stats['B'].callback_errors == 0
+
+
+def test_shutdown_keeps_the_samples_still_queued():
+    # The last quote lands in a full queue just as the feed stops; the end marker waits behind it
+    feed = live_feed.LiveFeed(live_feed.FakeQuoteSource({'A': [1.0]}), ['A'], interval=0, queue_size=1)
+    received = []
+    feed.subscribe('A', lambda price, time_of_price: received.append(price))
+    asyncio.run(asyncio.wait_for(feed.run(max_ticks=1), timeout=5.0))
+
+    assert received == [1.0]
+    assert feed.stats['A'].dropped == 0
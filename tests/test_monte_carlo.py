@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import quant
+import sweep
+import journal
+import pipeline
+import benchmark
+import monte_carlo
+
+from retirement import Manager
+
+
+# simulate_engine walks every path at once; each path has to come out the same as running a real
+# engine's backtest over it and closing the position, like the Manager does at the end.
+
+def make_engines():
+    engines = quant.builtin_engines()
+    escaping = quant.TimeBasedQuantEngine()
+    escaping.set_emer_escape_threshold(0.98)
+    engines.append(escaping)
+    engines.append(quant.IthDerivBasedQuantEngine(deriv_dim=4, buy_threshold=-0.004, sell_threshold=0.004))
+    engines.append(quant.IthDerivBasedQuantEngine(deriv_dim=2, buy_threshold=0.001, sell_threshold=-0.001,
+                                                  emer_escape_threshold=0.97))
+    for engine in engines:
+        engine.journal = journal.Journal(verbosity=journal.OFF)
+    return engines
+
+
+def test_simulated_paths_match_engine_backtests(capsys):
+    times, prices = benchmark.synthetic_prices(1500, 'mean_reverting', 3600, seed=9)
+    paths = monte_carlo.block_bootstrap_paths(prices, 8, seed=1)
+    paths[0] = prices
+
+    for index, engine in enumerate(make_engines()):
+        result = monte_carlo.simulate_engine(engine, paths, times)
+        for path in range(len(paths)):
+            real = make_engines()[index]
+            real.clock = lambda: times[-1] + 3600.0
+            real.backtest(paths[path], times)
+            real.close()
+            assert result['final_value'][path] == pytest.approx(real.funds_available, rel=1e-12), engine.name
+            assert result['num_trades'][path] == len(real.ledger), engine.name
+            assert result['max_drawdown'][path] == pytest.approx(real.ledger.max_drawdown(), abs=1e-12), engine.name
+
+
+def test_default_engines_cover_the_managers_grid():
+    deriv_dims, buy_thresholds, sell_thresholds, emer_escape_thresholds = sweep.default_grid()
+    grid_size = len(deriv_dims) * len(buy_thresholds) * len(sell_thresholds) * len(emer_escape_thresholds)
+    engines = monte_carlo.default_engines()
+    manager = Manager(plotting=False)
+
+    assert len(engines) == len(manager.engines) + grid_size
+    assert [engine.name for engine in engines[:len(manager.engines)]] == [engine.name for engine in manager.engines]
+    assert {(engine.buy_threshold, engine.sell_threshold) for engine in engines[len(manager.engines):]} == \
+        {(float(buy), float(sell)) for buy in manager.sweep_buy_thresholds for sell in manager.sweep_sell_thresholds}
+
+
+def test_streamed_manager_needs_the_real_prices(capsys):
+    times, prices = benchmark.synthetic_prices(3000, 'random_walk', 900, seed=3)
+    manager = Manager(plotting=False, engines=[quant.BaselineQuantEngine()])
+    manager.num_swept_engines = 0
+    manager.stream_history(pipeline.array_source(times, prices, chunk_size=500))
+
+    with pytest.raises(Exception, match='summarized'):
+        manager.monte_carlo(num_paths=10)
+    rows = manager.monte_carlo(num_paths=10, times=times, prices=prices)
+    assert len(rows) == 1
@@ -0,0 +1,208 @@
+import asyncio
+import time
+import numpy as np
+import pytest
+import quant
+import orders
+import journal
+import backends
+
+from ledger import BUY_SIDE, SELL_SIDE
+from quote_client import RateLimiter
+
+
+def unlimited():
+    return RateLimiter(rate=1e9, burst=10 ** 9)
+
+
+def make_engine(name, funds=100.0, shares=0.0, price=2.0):
+    engine = quant.BaselineQuantEngine()
+    engine.name = name
+    engine.funds_available = funds
+    engine.shares_owned = shares
+    engine.invested = shares > 0
+    engine.journal = journal.Journal(verbosity=journal.DECISIONS)
+    engine.update_model(price, 1.0)
+    return engine
+
+
+def run_router(broker, tickers_by_engine, body, **kwargs):
+    # Starts a router, registers the engines, runs body(router) and stops it once that's done
+    kwargs.setdefault('rate_limiter', unlimited())
+    kwargs.setdefault('poll_interval', 0.01)
+    router = orders.OrderRouter(broker, **kwargs)
+    for engine, ticker in tickers_by_engine.items():
+        router.register(engine, ticker)
+
+    async def main():
+        task = asyncio.ensure_future(router.run())
+        await asyncio.sleep(0)
+        await body(router)
+        router.stop()
+        await task
+
+    asyncio.run(main())
+    return router
+
+
+async def until_settled(engines, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while any(engine.pending_order is not None for engine in engines):
+        assert time.perf_counter() < deadline
+        await asyncio.sleep(0.005)
+
+
+def test_opposite_intents_cross_and_the_rest_is_merged():
+    prices = {'A': 2.0}
+    broker = orders.FakeBroker(lambda ticker: prices[ticker])
+    buyer, small_buyer = make_engine('buyer', 100.0), make_engine('small_buyer', 50.0)
+    seller = make_engine('seller', 0.0, shares=10.0)  # worth 20 at 2.0
+    engines = [buyer, small_buyer, seller]
+
+    async def body(router):
+        buyer.buy()
+        small_buyer.buy()
+        seller.sell()
+        await until_settled(engines)
+
+    router = run_router(broker, {engine: 'A' for engine in engines}, body)
+
+    # 150 of buys minus the 20 crossed against the sale is one order for 130
+    assert router.num_crossed == 1
+    assert router.num_orders == 1
+    assert [order['amount'] for order in broker.orders.values()] == [pytest.approx(130.0)]
+    assert buyer.shares_owned == pytest.approx(50.0)
+    assert small_buyer.shares_owned == pytest.approx(25.0)
+    assert buyer.funds_available == pytest.approx(0.0) and small_buyer.funds_available == pytest.approx(0.0)
+    assert seller.shares_owned == 0.0 and not seller.invested
+    assert seller.funds_available == pytest.approx(20.0)
+    assert [len(engine.ledger) for engine in engines] == [1, 1, 1]
+
+
+def test_fully_crossed_intents_never_reach_the_broker():
+    broker = orders.FakeBroker(lambda ticker: 2.0)
+    buyer = make_engine('buyer', 20.0)
+    seller = make_engine('seller', 0.0, shares=10.0)
+
+    async def body(router):
+        buyer.buy()
+        seller.sell()
+        await until_settled([buyer, seller])
+
+    router = run_router(broker, {buyer: 'A', seller: 'A'}, body)
+    assert router.num_orders == 0 and broker.calls == 0
+    assert buyer.shares_owned == pytest.approx(10.0)
+    assert seller.funds_available == pytest.approx(20.0)
+
+
+def test_partial_fills_add_up_and_pending_engines_wait():
+    prices = {'A': 4.0}
+    broker = orders.FakeBroker(lambda ticker: prices[ticker], ack_latency=0.02, fill_interval=0.01, num_fills=4)
+    engine = make_engine('engine', 100.0)
+
+    async def body(router):
+        engine.buy()
+        assert engine.pending_order is not None
+        engine.buy()  # still waiting on the first one
+        await until_settled([engine])
+
+    router = run_router(broker, {engine: 'A'}, body)
+    assert router.num_intents == 1
+    assert engine.shares_owned == pytest.approx(25.0)
+    assert engine.funds_available == pytest.approx(0.0)
+    assert len(engine.ledger) == 1
+    assert engine.journal.num_recorded == 2  # the ORDER_PENDING decision and the trade
+    assert engine.journal.buffer[0]['code'] == journal.ORDER_PENDING
+
+
+def test_rejected_orders_leave_the_engine_as_it_was():
+    broker = orders.FakeBroker(lambda ticker: 1.0, reject={'B'})
+    engine = make_engine('engine', 100.0)
+
+    async def body(router):
+        engine.buy()
+        await until_settled([engine])
+
+    router = run_router(broker, {engine: 'B'}, body)
+    assert router.num_rejected == 1
+    assert engine.funds_available == 100.0 and engine.shares_owned == 0.0 and not engine.invested
+    assert engine.pending_order is None
+
+
+def test_orders_for_different_tickers_go_out_concurrently():
+    broker = orders.FakeBroker(lambda ticker: 1.0, ack_latency=0.1)
+    engines = [make_engine('engine' + str(index)) for index in range(4)]
+
+    async def body(router):
+        for engine in engines:
+            engine.buy()
+        await until_settled(engines)
+
+    start = time.perf_counter()
+    run_router(broker, {engine: 'T' + str(index) for index, engine in enumerate(engines)}, body)
+    assert broker.max_concurrent_calls > 1
+    assert time.perf_counter() - start < 0.35  # not four acks one after the other
+    assert all(engine.invested for engine in engines)
+
+
+def test_stop_cancels_open_orders_after_draining():
+    broker = orders.FakeBroker(lambda ticker: 2.0, fill_interval=0.05, num_fills=100)
+    engine = make_engine('engine', 100.0)
+
+    async def body(router):
+        engine.buy()
+        await asyncio.sleep(0.02)
+
+    router = run_router(broker, {engine: 'A'}, body, drain_timeout=0.1)
+    assert all(order['cancelled'] for order in broker.orders.values())
+    assert engine.pending_order is None
+    # What filled before the cancel is kept
+    assert 0 < engine.shares_owned < 50.0
+    assert engine.funds_available == pytest.approx(100.0 - engine.shares_owned * 2.0)
+    assert router.num_orders == 1
+
+
+def test_submitting_without_a_running_router_is_rejected():
+    engine = make_engine('engine')
+    router = orders.OrderRouter(orders.FakeBroker(lambda ticker: 1.0), rate_limiter=unlimited())
+    router.register(engine, 'A')
+    engine.buy()
+    assert engine.pending_order is None and engine.funds_available == 100.0
+
+
+def test_full_speed_replay_orders_settle_without_waiting():
+    # A replay at full speed fills on submission and has no poll interval, so the engine only
+    # misses the bars that go by while the order is on the thread pool
+    times = 1.6e9 + 60.0 * np.arange(100)
+    backend = backends.ReplayBackend({'A': (times, np.linspace(1.0, 2.0, 100))}, speed=None)
+    engine = make_engine('engine', 100.0)
+
+    async def body(router):
+        assert router.poll_interval == 0.0
+        start = time.perf_counter()
+        engine.buy()
+        await until_settled([engine])
+        assert time.perf_counter() - start < orders.FIRST_POLL_INTERVAL
+
+    run_router(backend, {engine: 'A'}, body, poll_interval=None)
+    assert engine.invested and len(backend.fills) == 1
+
+
+def test_closing_after_the_router_stopped_values_the_position():
+    # Shutdown stops the router before the Manager closes its engines; whatever is still held is
+    # sold at the last price for the exit report, not dropped by the stopped router
+    prices = {'A': 2.0}
+    engine = make_engine('engine', 100.0)
+
+    async def body(router):
+        engine.buy()
+        await until_settled([engine])
+
+    router = run_router(orders.FakeBroker(lambda ticker: prices[ticker]), {engine: 'A'}, body)
+    assert engine.invested and not router.running
+
+    engine.update_model(3.0, 2.0)
+    engine.close()
+    assert not engine.invested
+    assert engine.funds_available == pytest.approx(150.0)
+    assert engine.ledger.column('side').tolist() == [BUY_SIDE, SELL_SIDE]
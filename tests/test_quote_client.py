@@ -0,0 +1,93 @@
+import time
+import pytest
+import quote_client
+
+from quote_client import QuoteClient, LocalQuoteServer, RateLimiter, SessionExpired
+
+
+PRICES = {'BTC': 30000.0, 'DOGE': 0.25, 'ETH': 2000.0}
+
+
+def make_client(server, **kwargs):
+    kwargs.setdefault('rate_limiter', RateLimiter(rate=1e9, burst=10 ** 9))
+    return QuoteClient(base_url=server.base_url, pairs_url=server.pairs_url, **kwargs)
+
+
+def test_batched_quotes_reuse_one_connection():
+    with LocalQuoteServer(PRICES) as server:
+        client = make_client(server)
+        for _ in range(5):
+            assert client.get_prices(list(PRICES)) == PRICES
+        # one id lookup, then one request per poll
+        assert server.num_requests == 6
+        assert len(server.connections) == 1
+        assert client.batching
+
+
+def test_falls_back_to_one_request_per_ticker_when_batching_is_refused():
+    with LocalQuoteServer(PRICES, batching=False) as server:
+        client = make_client(server)
+        assert client.get_prices(list(PRICES)) == PRICES
+        assert not client.batching
+        assert server.num_requests == 1 + 1 + len(PRICES)  # ids, the refused batch, one per ticker
+
+        server.num_requests = 0
+        assert client.get_prices(list(PRICES)) == PRICES
+        assert server.num_requests == len(PRICES)  # doesn't try the batch again
+
+
+def test_falls_back_on_404_too(monkeypatch):
+    with LocalQuoteServer(PRICES) as server:
+        respond = server.respond
+
+        def no_batch_endpoint(path, query):
+            if path == '/marketdata/forex/quotes/':
+                return 404, {'detail': 'not found'}
+            return respond(path, query)
+
+        monkeypatch.setattr(server, 'respond', no_batch_endpoint)
+        client = make_client(server)
+        assert client.get_prices(['BTC', 'ETH']) == {'BTC': 30000.0, 'ETH': 2000.0}
+        assert not client.batching
+
+
+def test_retries_5xx_with_backoff():
+    with LocalQuoteServer(PRICES, failures=2) as server:
+        client = make_client(server, backoff=0.01)
+        assert client.get_price('DOGE') == 0.25
+        assert client.num_retries == 2
+
+
+def test_429_waits_as_long_as_retry_after_says(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(quote_client.time, 'sleep', sleeps.append)
+    with LocalQuoteServer(PRICES, failures=1, failure_status=429, retry_after=7) as server:
+        client = make_client(server, backoff=0.01)
+        assert client.get_price('ETH') == 2000.0
+        assert sleeps == [7.0]
+
+
+def test_gives_up_after_max_retries():
+    with LocalQuoteServer(PRICES, failures=10) as server:
+        client = make_client(server, max_retries=2, backoff=0.001)
+        with pytest.raises(quote_client.requests.HTTPError):
+            client.get_price('BTC')
+        assert server.num_requests == 3
+
+
+def test_401_means_log_in_again(monkeypatch):
+    with LocalQuoteServer(PRICES) as server:
+        monkeypatch.setattr(server, 'respond', lambda path, query: (401, {'detail': 'expired'}))
+        client = make_client(server)
+        with pytest.raises(SessionExpired):
+            client.get_price('BTC')
+        assert client.num_retries == 0
+
+
+def test_rate_limiter_spaces_requests_past_the_burst():
+    limiter = RateLimiter(rate=100.0, burst=2)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    # two free, then four at 100 a second
+    assert time.monotonic() - start >= 0.035
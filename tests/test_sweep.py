@@ -0,0 +1,92 @@
+import numpy as np
+import quant
+import sweep
+import journal
+import benchmark
+
+
+# The sweep (SweepBatch.run under IthDerivSweep) has to come out exactly like backtesting a real
+# IthDerivBasedQuantEngine per grid row and closing it.
+
+DERIV_DIMS = [1, 2, 4]
+BUY_THRESHOLDS = np.linspace(-0.005, 0.005, 5)
+SELL_THRESHOLDS = np.linspace(-0.005, 0.005, 4)
+EMER_ESCAPE_THRESHOLDS = (None, 0.97, 0.9)
+
+
+def history():
+    return benchmark.synthetic_prices(2000, 'random_walk', 3600, seed=2)
+
+
+def engine_result(row, times, prices, clock):
+    escape = None if np.isnan(row['emer_escape_threshold']) else float(row['emer_escape_threshold'])
+    engine = quant.IthDerivBasedQuantEngine(deriv_dim=int(row['deriv_dim']), buy_threshold=float(row['buy_threshold']),
+                                            sell_threshold=float(row['sell_threshold']),
+                                            emer_escape_threshold=escape)
+    engine.journal = journal.Journal(verbosity=journal.OFF)
+    engine.clock = clock
+    engine.backtest(prices, times)
+    engine.sell()  # what close() does, without its report
+    return engine.funds_available, engine.min_fund_value, engine.max_fund_value, len(engine.ledger)
+
+
+def test_sweep_matches_engines():
+    times, prices = history()
+    clock = lambda: times[-1] + 3600.0
+    results = sweep.sweep_ith_deriv(prices, times, DERIV_DIMS, BUY_THRESHOLDS, SELL_THRESHOLDS,
+                                    EMER_ESCAPE_THRESHOLDS, clock=clock)
+    assert len(results) == len(DERIV_DIMS) * len(BUY_THRESHOLDS) * len(SELL_THRESHOLDS) * len(EMER_ESCAPE_THRESHOLDS)
+    assert results['num_trades'].sum() > 100
+    assert np.all(np.diff(results['final_value']) <= 0)
+    for row in results:
+        final_value, min_fund_value, max_fund_value, num_trades = engine_result(row, times, prices, clock)
+        assert float(row['final_value']) == final_value
+        assert float(row['min_fund_value']) == min_fund_value
+        assert float(row['max_fund_value']) == max_fund_value
+        assert int(row['num_trades']) == num_trades
+
+
+def test_chunked_sweep_matches_whole_sweep():
+    times, prices = history()
+    clock = lambda: times[-1] + 3600.0
+    whole = sweep.sweep_ith_deriv(prices, times, DERIV_DIMS, BUY_THRESHOLDS, SELL_THRESHOLDS,
+                                  EMER_ESCAPE_THRESHOLDS, clock=clock)
+    for sizes in ([1] * 7 + [3, 50, 1000], [5, 1, 1, 1, 1, 100]):
+        run = sweep.IthDerivSweep(DERIV_DIMS, BUY_THRESHOLDS, SELL_THRESHOLDS, EMER_ESCAPE_THRESHOLDS, clock=clock)
+        start = 0
+        for step in range(len(prices)):
+            if start >= len(prices):
+                break
+            stop = start + sizes[step % len(sizes)]
+            run.update(prices[start:stop], times[start:stop])
+            start = stop
+        chunked = run.results()
+        for name in whole.dtype.names:
+            np.testing.assert_array_equal(chunked[name], whole[name], err_msg=name)
+
+
+def test_small_blocks_and_long_holds_match_engines(monkeypatch):
+    # Blocks of a few bars carry every combination's state across block boundaries, and sell
+    # thresholds far below the buys hold positions long enough for the escape to be searched in bulk
+    monkeypatch.setattr(sweep.SweepBatch, 'BLOCK_SIZE', 7 * 24)
+    times, prices = history()
+    clock = lambda: times[-1] + 3600.0
+    sell_thresholds = [-0.05, -0.005, 0.005]
+    results = sweep.sweep_ith_deriv(prices, times, [1, 4], BUY_THRESHOLDS, sell_thresholds, (None, 0.97),
+                                    clock=clock)
+    for row in results:
+        final_value, min_fund_value, max_fund_value, num_trades = engine_result(row, times, prices, clock)
+        assert float(row['final_value']) == final_value
+        assert float(row['min_fund_value']) == min_fund_value
+        assert float(row['max_fund_value']) == max_fund_value
+        assert int(row['num_trades']) == num_trades
+
+
+def test_sweep_follows_the_clock():
+    # A clock right after the first bar blocks trading, just like it does for the engines
+    times, prices = history()
+    clock = lambda: times[0] + 1.0
+    results = sweep.sweep_ith_deriv(prices, times, [2], BUY_THRESHOLDS, SELL_THRESHOLDS, clock=clock)
+    assert np.all(results['num_trades'] == 0)
+    for row in results:
+        assert engine_result(row, times, prices, clock)[3] == 0
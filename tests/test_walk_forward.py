@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+import quant
+import journal
+import benchmark
+import walk_forward
+
+from ledger import COLUMNS
+
+
+def history():
+    return benchmark.synthetic_prices(1500, 'mean_reverting', 3600, seed=7)
+
+
+def warmed_tick_by_tick(engine, times, prices, warmup_start, test_start):
+    # What a live engine does: watch the warm-up bars, then trade from the first test bar
+    engine.journal = journal.Journal(verbosity=journal.OFF)
+    for price, time_of_price in zip(prices[warmup_start:test_start].tolist(), times[warmup_start:test_start].tolist()):
+        engine.update_model(price, time_of_price)
+    for price, time_of_price in zip(prices[test_start:].tolist(), times[test_start:].tolist()):
+        engine.update_model(price, time_of_price)
+        if engine.should_buy():
+            engine.buy()
+        elif engine.should_sell():
+            engine.sell()
+    engine.sell()
+
+
+@pytest.mark.parametrize('build', [
+    lambda: walk_forward.build_ith_deriv({'deriv_dim': 2, 'buy_threshold': 0.0005, 'sell_threshold': -0.0005,
+                                          'emer_escape_threshold': 0.97}),
+    lambda: walk_forward.build_time_based({'emer_escape_threshold': 0.98, 'min_samples': 60}),
+])
+def test_warmed_evaluation_matches_tick_by_tick(build):
+    times, prices = history()
+    train_start, train_stop = 0, 1000
+    evaluated = build()
+    warmup = walk_forward.warmup_bars(evaluated, prices, times, train_start, train_stop)
+    walk_forward.evaluate(evaluated, prices[train_stop:], times[train_stop:], warmup=warmup)
+
+    ticked = build()
+    warmed_tick_by_tick(ticked, times, prices, train_stop - ticked.required_history(), train_stop)
+
+    assert len(evaluated.ledger) > 2
+    assert evaluated.funds_available == pytest.approx(ticked.funds_available, rel=1e-12)
+    for name in COLUMNS:
+        np.testing.assert_allclose(evaluated.ledger.column(name), ticked.ledger.column(name), rtol=1e-12)
+
+
+def always_buy_and_hold():
+    # Buys as soon as it's ready and never sells, so every bar it isn't invested shows
+    return walk_forward.build_ith_deriv({'deriv_dim': 1, 'buy_threshold': -1e9, 'sell_threshold': -1e9,
+                                         'emer_escape_threshold': None})
+
+
+def test_warmed_engine_trades_from_the_first_test_bar():
+    times, prices = history()
+    train_stop = 1000
+    engine = always_buy_and_hold()
+    result = walk_forward.evaluate(engine, prices[train_stop:], times[train_stop:],
+                                   warmup=walk_forward.warmup_bars(engine, prices, times, 0, train_stop))
+    assert engine.ledger.column('time')[0] == times[train_stop]
+    assert result['return'] == pytest.approx((prices[-1] - prices[train_stop]) / prices[train_stop], rel=1e-12)
+
+    # Cold, the first min_samples bars of the window are spent warming up
+    cold = always_buy_and_hold()
+    walk_forward.evaluate(cold, prices[train_stop:], times[train_stop:])
+    assert cold.ledger.column('time')[0] == times[train_stop + cold.min_samples - 1]
+
+
+def test_run_fold_warms_up_on_the_training_window(tmp_path):
+    times, prices = history()
+    runner = walk_forward.WalkForwardRunner(max_workers=1, work_dir=str(tmp_path))
+    runner.add_history('X', prices, times, deriv_dims=(1, 2))
+    _, paths = runner.histories['X']
+    result = walk_forward.run_fold(('X', paths, (0, 700, 900), walk_forward.ith_deriv_grid(deriv_dims=(1, 2)), None))
+    assert result['test_times'][0] == times[700]
+    assert result['buy_and_hold'] == pytest.approx((prices[899] - prices[700]) / prices[700])
+
+    engine = walk_forward.build_ith_deriv(result['ith_deriv']['params'])
+    expected = walk_forward.evaluate(engine, prices[700:900], times[700:900],
+                                     warmup=(prices[700 - engine.required_history():700],
+                                             times[700 - engine.required_history():700]))
+    assert result['ith_deriv']['out_of_sample'] == expected